@@ -0,0 +1,85 @@
+"""
+Per-request latency of the GIS agent with and without graph reuse.
+
+"before" builds and compiles a new graph for every query (what
+process_gis_query used to do), "after" reuses the graph compiled by
+get_gis_agent(). The OpenAI client is replaced by a stub that answers
+instantly, so the numbers only measure our own overhead.
+
+Usage:
+    python benchmarks/bench_agent_graph.py [--requests 200]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+os.environ.setdefault("AGENT_WARM_UP", "1")
+
+import main  # noqa: E402
+
+
+class StubCompletions:
+    """Stands in for client.chat.completions and answers without a network call"""
+
+    async def create(self, **kwargs):
+        message = SimpleNamespace(content="Buffers grow a geometry by a fixed distance.")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+def initial_state(query):
+    return {
+        "messages": [{"role": "user", "content": query}],
+        "actions": [],
+        "params_dict": {},
+        "params_list": [],
+        "results": [],
+        "intermediate_layers": [],
+        "include_geojson": True,
+    }
+
+
+async def measure(get_agent, requests):
+    timings = []
+    for i in range(requests):
+        start = time.perf_counter()
+        agent = get_agent()
+        await agent.ainvoke(initial_state(f"What is a buffer? ({i})"))
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def report(label, timings):
+    timings = sorted(timings)
+    p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+    print(
+        f"{label:<8} mean {statistics.mean(timings) * 1000:8.3f} ms  "
+        f"p50 {statistics.median(timings) * 1000:8.3f} ms  "
+        f"p99 {p99 * 1000:8.3f} ms"
+    )
+
+
+async def run(requests):
+    main.client = SimpleNamespace(chat=SimpleNamespace(completions=StubCompletions()))
+
+    before = await measure(lambda: main.create_gis_agent(main.DEFAULT_MODEL), requests)
+
+    main.warm_up_agents()
+    after = await measure(lambda: main.get_gis_agent(main.DEFAULT_MODEL), requests)
+
+    report("before", before)
+    report("after", after)
+    print(f"speedup  {statistics.mean(before) / statistics.mean(after):.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200, help="Queries to run per variant")
+    args = parser.parse_args()
+    asyncio.run(run(args.requests))
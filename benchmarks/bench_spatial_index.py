@@ -0,0 +1,118 @@
+"""
+Spatial-index-accelerated overlay, clip and join versus plain geopandas calls.
+
+Builds synthetic layers from the bundled sample data: the Alberta cities
+(uploads/Cities_AB.shp) are jittered into `--points` points and buffered
+into `--polygons` polygons, and the study area (uploads/StudyArea.shp) is
+used as the clip / containment layer. Every operation is run `--repeat`
+times on the same loaded layers, the way a chain of agent steps would.
+
+"before" calls gpd.overlay/gpd.clip/gpd.sjoin directly (what the GIS
+functions used to do), "after" calls the functions in main.py, which
+reuse each layer's spatial index and prefilter by bounding box.
+
+Usage:
+    python benchmarks/bench_spatial_index.py [--points 200000] [--polygons 20000] [--repeat 3]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+# Keep the benchmark layers out of the layer catalog in uploads/
+os.environ.setdefault("LAYER_SHARED_DIR", tempfile.mkdtemp(prefix="bench-layers-"))
+
+import geopandas as gpd  # noqa: E402
+import numpy as np  # noqa: E402
+
+import main  # noqa: E402
+
+
+def load_samples():
+    study_area = gpd.read_file(ROOT / "uploads" / "StudyArea.shp")
+    cities = gpd.read_file(ROOT / "uploads" / "Cities_AB.shp").to_crs(study_area.crs)
+    return cities, study_area
+
+
+def scaled_points(cities, study_area, count, rng):
+    """Points scattered around the sample cities and across the study area"""
+    minx, miny, maxx, maxy = study_area.total_bounds
+    seeds = np.column_stack([cities.geometry.x, cities.geometry.y])
+    seeds = np.vstack([seeds, rng.uniform([minx, miny], [maxx, maxy], size=(len(seeds), 2))])
+    picked = seeds[rng.integers(0, len(seeds), count)]
+    coords = picked + rng.normal(0, (maxx - minx) / 20, size=(count, 2))
+    return gpd.GeoDataFrame(
+        {"point_id": np.arange(count), "value": rng.random(count)},
+        geometry=gpd.points_from_xy(coords[:, 0], coords[:, 1]),
+        crs=study_area.crs,
+    )
+
+
+def scaled_polygons(points, count, rng, radius):
+    sample = points.sample(count, random_state=int(rng.integers(1 << 31))).reset_index(drop=True)
+    return gpd.GeoDataFrame(
+        {"zone_id": np.arange(count), "value": rng.random(count)},
+        geometry=sample.geometry.buffer(radius * rng.uniform(0.5, 1.5, count), resolution=8).values,
+        crs=points.crs,
+    )
+
+
+def timed(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), len(result)
+
+
+def run(points_count, polygons_count, repeat, seed):
+    rng = np.random.default_rng(seed)
+    cities, study_area = load_samples()
+    points = scaled_points(cities, study_area, points_count, rng)
+    radius = (study_area.total_bounds[2] - study_area.total_bounds[0]) / 200
+    zones_a = scaled_polygons(points, polygons_count, rng, radius)
+    zones_b = scaled_polygons(points, polygons_count, rng, radius)
+
+    main.LAYER_STORE.budget = 1 << 62  # Keep everything in memory while measuring
+    for name, layer in (("points", points), ("zones_a", zones_a), ("zones_b", zones_b), ("study_area", study_area)):
+        main.register_layer(name, layer)
+
+    cases = [
+        ("intersection",
+         lambda: gpd.overlay(zones_a, zones_b, how="intersection", keep_geom_type=False),
+         lambda: main.intersection("zones_a", "zones_b")),
+        ("union",
+         lambda: gpd.overlay(zones_a, zones_b, how="union"),
+         lambda: main.union_layers("zones_a", "zones_b")),
+        ("clip",
+         lambda: gpd.clip(points, zones_a),
+         lambda: main.clip_layer("points", "zones_a")),
+        ("points_within_polygon",
+         lambda: gpd.sjoin(points, study_area, predicate="within", how="inner"),
+         lambda: main.points_within_polygon("points", "study_area")),
+    ]
+
+    print(f"{points_count} points, {polygons_count} polygons per zone layer, median of {repeat} runs")
+    print(f"{'operation':<24}{'before (s)':>12}{'after (s)':>12}{'speedup':>10}{'rows':>10}")
+    for name, before, after in cases:
+        before_time, before_rows = timed(before, repeat)
+        after_time, after_rows = timed(after, repeat)
+        rows = str(after_rows) if after_rows == before_rows else f"{after_rows}!={before_rows}"
+        print(f"{name:<24}{before_time:>12.3f}{after_time:>12.3f}{before_time / after_time:>9.1f}x{rows:>10}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--points", type=int, default=200_000, help="Synthetic points")
+    parser.add_argument("--polygons", type=int, default=20_000, help="Synthetic polygons per zone layer")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per operation")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    run(args.points, args.polygons, args.repeat, args.seed)
@@ -0,0 +1,369 @@
+"""
+Benchmark suite for the GIS operations and the HTTP endpoints.
+
+Every case runs `--repeat` times on synthetic layers (see synthetic.py) of
+each size in `--sizes`, and on the sample datasets in uploads/. For each
+case it reports throughput (features/s for operations, requests/s for
+endpoints), p50/p99 latency and the peak RSS of the process while the case
+ran (and how far above the RSS before the case that was).
+
+Operations are called directly on main.py's functions. Endpoints go through
+the FastAPI app in-process (TestClient), with the OpenAI client replaced by
+a stub that answers instantly with a fixed plan, so /process-gis-query only
+measures our own work. The result, plan and dissolve caches are disabled so
+repeated runs recompute everything.
+
+Results can be saved as a JSON baseline and compared with a later run:
+
+    python benchmarks/bench_suite.py --sizes 1k,10k,100k --save benchmarks/baselines/before.json
+    python benchmarks/bench_suite.py --sizes 1k,10k,100k --compare benchmarks/baselines/before.json
+
+Usage:
+    python benchmarks/bench_suite.py [--sizes 1k,10k,100k] [--repeat 5]
+        [--cases buffer,intersection,...] [--no-endpoints] [--save PATH] [--compare PATH]
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Callable, NamedTuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+# Measure the work itself, not cache hits, and don't let quotas stop big runs
+os.environ.setdefault("RESULT_CACHE_SIZE", "0")
+os.environ.setdefault("PLAN_CACHE_SIZE", "0")
+os.environ.setdefault("DISSOLVE_CACHE_SIZE", "0")
+os.environ.setdefault("SESSION_MAX_LAYERS", "100000")
+os.environ.setdefault("SESSION_MEMORY_QUOTA_MB", str(1 << 30))
+os.environ.setdefault("AGENT_WARM_UP", "1")  # Compile the agent graphs before measuring
+# Keep the benchmark layers out of the layer catalog in uploads/
+os.environ.setdefault("LAYER_SHARED_DIR", tempfile.mkdtemp(prefix="bench-layers-"))
+
+import psutil  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+from pyproj import Transformer  # noqa: E402
+
+import main  # noqa: E402
+import synthetic  # noqa: E402
+
+ROOT = synthetic.ROOT
+
+
+class StubCompletions:
+    """Stands in for client.chat.completions; answers with `reply` without a network call"""
+
+    def __init__(self):
+        self.reply = "Buffers grow a geometry by a fixed distance."
+
+    async def create(self, **kwargs):
+        message = SimpleNamespace(content=self.reply)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+class StubClient:
+    """Replaces main.client (an AsyncOpenAI)"""
+
+    def __init__(self):
+        self.chat = SimpleNamespace(completions=StubCompletions())
+
+    async def close(self):
+        pass
+
+
+class PeakRSS:
+    """Samples the RSS of this process in a background thread while active"""
+
+    def __init__(self, interval=0.002):
+        self.process = psutil.Process()
+        self.interval = interval
+        self.peak = 0
+        self.stop = threading.Event()
+
+    def _sample(self):
+        while not self.stop.wait(self.interval):
+            self.peak = max(self.peak, self.process.memory_info().rss)
+
+    def __enter__(self):
+        self.start = self.process.memory_info().rss
+        self.peak = self.start
+        self.thread = threading.Thread(target=self._sample, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop.set()
+        self.thread.join()
+        self.peak = max(self.peak, self.process.memory_info().rss)
+
+
+def percentile(values, q):
+    """Nearest-rank percentile"""
+    values = sorted(values)
+    return values[max(0, math.ceil(q / 100 * len(values)) - 1)]
+
+
+class Case(NamedTuple):
+    name: str
+    kind: str  # "operation" or "endpoint"
+    run: Callable  # Takes the role -> layer name dict
+    source: str = None  # Role or name of the input layer (throughput in its features/s); None = requests/s
+    max_features: int = 0  # Skipped above this size (0 = no limit)
+
+
+def drop_layers(keep):
+    """Remove the layers created by a run (results of operations and queries)"""
+    for name in list(main.LOADED_LAYERS.keys()):
+        if name not in keep:
+            del main.LOADED_LAYERS[name]
+
+
+def measure(case, layers, keep, repeat):
+    timings = []
+    items = len(main.LOADED_LAYERS[layers.get(case.source, case.source)]) if case.source else 1
+    with PeakRSS() as rss:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            case.run(layers)
+            timings.append(time.perf_counter() - started)
+            drop_layers(keep)
+    total = sum(timings)
+    return {
+        "case": case.name,
+        "kind": case.kind,
+        "runs": repeat,
+        "items": items,
+        "throughput": items * repeat / total if total else None,
+        "p50_ms": percentile(timings, 50) * 1000,
+        "p99_ms": percentile(timings, 99) * 1000,
+        "mean_ms": total / repeat * 1000,
+        "peak_rss_mb": rss.peak / 2 ** 20,
+        "rss_growth_mb": (rss.peak - rss.start) / 2 ** 20,
+    }
+
+
+def operation_cases():
+    return [
+        Case("buffer_points", "operation",
+             lambda l: main.buffer_layer(l["points"], 100), "points"),
+        Case("buffer_polygons", "operation",
+             lambda l: main.buffer_layer(l["polygons"], 100), "polygons"),
+        Case("simplify_lines", "operation",
+             lambda l: main.simplify_layer(l["lines"], 50), "lines"),
+        Case("reproject_points", "operation",
+             lambda l: main.reproject_layer(l["points"]), "points"),
+        Case("clip_points", "operation",
+             lambda l: main.clip_layer(l["points"], l["study_area"]), "points"),
+        Case("points_within_polygon", "operation",
+             lambda l: main.points_within_polygon(l["points"], l["study_area"]), "points"),
+        Case("points_within_zones", "operation",
+             lambda l: main.points_within_polygon(l["points"], l["polygons"]), "points"),
+        Case("dissolve_polygons", "operation",
+             lambda l: main.dissolve_layer(l["polygons"], "group"), "polygons"),
+        Case("intersection", "operation",
+             lambda l: main.intersection(l["polygons"], l["polygons_b"]), "polygons", max_features=100_000),
+        Case("union", "operation",
+             lambda l: main.union_layers(l["polygons"], l["polygons_b"]), "polygons", max_features=10_000),
+    ]
+
+
+def sample_cases():
+    """The same operations on the bundled datasets (Cities_AB, StudyArea)"""
+    return [
+        Case("sample_buffer_cities", "operation",
+             lambda l: main.buffer_layer("Cities_AB", 1000), "Cities_AB"),
+        Case("sample_cities_within_study_area", "operation",
+             lambda l: main.points_within_polygon("Cities_AB", "StudyArea"), "Cities_AB"),
+        Case("sample_clip_cities", "operation",
+             lambda l: main.clip_layer("Cities_AB", "StudyArea"), "Cities_AB"),
+        Case("sample_reproject_study_area", "operation",
+             lambda l: main.reproject_layer("StudyArea"), "StudyArea"),
+    ]
+
+
+def visible_tiles(gdf, zoom, count):
+    """Up to `count` (z, x, y) tiles over the middle of a layer"""
+    minx, miny, maxx, maxy = Transformer.from_crs(gdf.crs, 4326, always_xy=True).transform_bounds(*gdf.total_bounds)
+    lon, lat = (minx + maxx) / 2, (miny + maxy) / 2
+    n = 2 ** zoom
+    x = int((lon + 180) / 360 * n)
+    y = int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n)
+    side = math.ceil(math.sqrt(count))
+    return [(zoom, x + dx, y + dy) for dx in range(side) for dy in range(side)][:count]
+
+
+def endpoint_cases(client, stub, repeat):
+    def request(method, url, **kwargs):
+        response = client.request(method, url, **kwargs)
+        response.raise_for_status()
+        # Most routes report failures as {"error": ...} with a 200
+        if response.headers.get("content-type", "").startswith("application/json"):
+            body = response.json()
+            if isinstance(body, dict) and "error" in body:
+                raise RuntimeError(f"{url}: {body['error']}")
+        return response
+
+    def upload(paths):
+        files = [("files", (path.name, path.read_bytes())) for path in paths]
+        request("POST", "/upload/", files=files, params={"include_geojson": "false"})
+
+    study_area_parts = [ROOT / "uploads" / f"StudyArea.{ext}" for ext in ("shp", "shx", "dbf", "prj")]
+    tiles = {}
+
+    def tile(l):
+        queue = tiles.setdefault(l["points"], visible_tiles(main.LOADED_LAYERS[l["points"]], 10, repeat * 4))
+        z, x, y = queue.pop() if queue else (10, 0, 0)
+        request("GET", f"/tiles/{l['points']}/{z}/{x}/{y}.mvt")
+
+    def viewport(l):
+        gdf = main.LOADED_LAYERS[l["points"]]
+        bounds = Transformer.from_crs(gdf.crs, 4326, always_xy=True).transform_bounds(*gdf.total_bounds)
+        request("GET", f"/layers/{l['points']}/query",
+                params={"bbox": ",".join(map(str, bounds)), "zoom": 8, "limit": 1000})
+
+    def llm_query(l):
+        main.FAST_PATH_ENABLED = False
+        stub.reply = f"Buffering the points. [GIS_ACTION:buffer_layer:layer_name={l['points']}:distance=100]"
+        try:
+            request("POST", "/process-gis-query", json={"query": f"buffer the {l['points']} layer", "include_geojson": False})
+        finally:
+            main.FAST_PATH_ENABLED = True
+
+    def fast_path_query(l):
+        request("POST", "/process-gis-query",
+                json={"query": f"buffer {l['points']} 100", "include_geojson": False})
+
+    return [
+        Case("POST /upload/ (Cities zip)", "endpoint", lambda l: upload([ROOT / "uploads" / "02-Cities.zip"])),
+        Case("POST /upload/ (StudyArea shp)", "endpoint", lambda l: upload(study_area_parts)),
+        Case("GET /layers/{name} (GeoJSON)", "endpoint",
+             lambda l: request("GET", f"/layers/{l['points']}")),
+        Case("GET /layers/{name} (Arrow)", "endpoint",
+             lambda l: request("GET", f"/layers/{l['points']}", headers={"Accept": main.ARROW_MEDIA_TYPE})),
+        Case("GET /layers/{name}/query", "endpoint", viewport),
+        Case("GET /tiles/{name}/{z}/{x}/{y}.mvt", "endpoint", tile),
+        Case("POST /execute-command/", "endpoint",
+             lambda l: request("POST", "/execute-command/",
+                               json={"command": f"buffer_layer('{l['points']}', 100)", "include_geojson": False})),
+        Case("POST /process-gis-query (LLM stub)", "endpoint", llm_query),
+        Case("POST /process-gis-query (fast path)", "endpoint", fast_path_query),
+        Case("GET /metrics", "endpoint", lambda l: request("GET", "/metrics")),
+    ]
+
+
+def load_layers(size, seed, samples):
+    """Register the synthetic layers of one size; returns role -> layer name"""
+    rng_seed = seed
+    layers = {}
+    for role, kind in (("points", "points"), ("lines", "lines"), ("polygons", "polygons"), ("polygons_b", "polygons")):
+        name = f"{role}_{size}"
+        main.register_layer(name, synthetic.generate(kind, size, seed=rng_seed, samples=samples))
+        layers[role] = name
+        rng_seed += 1
+    layers["study_area"] = "StudyArea"
+    return layers
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results, baseline=None):
+    previous = {(r["size"], r["case"]): r for r in baseline["results"]} if baseline else {}
+    header = f"{'size':>10}  {'case':<40}{'throughput':>14}{'p50 (ms)':>11}{'p99 (ms)':>11}{'peak RSS':>10}{'+RSS':>9}"
+    if previous:
+        header += f"{'vs base':>9}"
+    print(header)
+    for r in results:
+        if r.get("skipped"):
+            print(f"{r['size']:>10}  {r['case']:<40}{'skipped: ' + r['skipped']:>14}")
+            continue
+        unit = "feat/s" if r["kind"] == "operation" else "req/s"
+        line = (f"{r['size']:>10}  {r['case']:<40}{r['throughput']:>9.0f} {unit:<5}"
+                f"{r['p50_ms']:>10.2f}{r['p99_ms']:>11.2f}{r['peak_rss_mb']:>8.0f}MB{r['rss_growth_mb']:>7.0f}MB")
+        base = previous.get((r["size"], r["case"]))
+        if base and not base.get("skipped"):
+            line += f"{base['p50_ms'] / r['p50_ms']:>8.2f}x"
+        print(line)
+
+
+def run(args):
+    sizes = [synthetic.parse_count(size) for size in args.sizes.split(",")]
+    selected = set(args.cases.split(",")) if args.cases else None
+
+    logging.getLogger("httpx").setLevel(logging.WARNING)  # One line per request otherwise
+    main.LAYER_STORE.budget = 1 << 62  # Keep everything in memory while measuring
+    main.client = StubClient()
+    stub = main.client.chat.completions
+    main.warm_up_agents()
+
+    samples = synthetic.load_samples()
+    cities, study_area = samples
+    main.register_layer("Cities_AB", cities)
+    main.register_layer("StudyArea", study_area)
+
+    results = []
+    with TestClient(main.app) as client:
+        for size in sizes:
+            layers = load_layers(size, args.seed, samples)
+            cases = operation_cases() + (sample_cases() if size == sizes[0] else [])
+            if not args.no_endpoints:
+                cases += endpoint_cases(client, stub, args.repeat)
+            inputs = set(layers.values()) | {"Cities_AB", "StudyArea"}
+            for case in cases:
+                if selected and not any(s in case.name for s in selected):
+                    continue
+                if case.max_features and size > case.max_features:
+                    results.append({"size": size, "case": case.name, "kind": case.kind,
+                                    "skipped": f">{case.max_features}"})
+                    continue
+                print(f"[{size}] {case.name}", file=sys.stderr)
+                result = measure(case, layers, inputs, args.repeat)
+                results.append({"size": size, **result})
+            for name in layers.values():
+                if name != "StudyArea":
+                    del main.LOADED_LAYERS[name]
+
+    baseline = json.loads(Path(args.compare).read_text()) if args.compare else None
+    print_results(results, baseline)
+
+    if args.save:
+        path = Path(args.save)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps({
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "args": vars(args),
+            "results": results,
+        }, indent=2))
+        print(f"Saved {len(results)} results to {path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1k,10k,100k", help="Synthetic layer sizes, e.g. 1k,10k,100k,1M,10M")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per case")
+    parser.add_argument("--cases", help="Only run cases whose name contains one of these (comma separated)")
+    parser.add_argument("--no-endpoints", action="store_true", help="Only benchmark the GIS functions")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--save", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Baseline JSON file to compare p50 latencies against")
+    args = parser.parse_args()
+    run(args)
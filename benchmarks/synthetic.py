@@ -0,0 +1,105 @@
+"""
+Synthetic layers for the benchmarks, scaled from a few features to tens of
+millions.
+
+Every generator is vectorized (numpy + shapely 2) and seeded, so the same
+arguments always produce the same layer. Features are spread over the
+extent of the sample study area (uploads/StudyArea.shp, NAD83 10TM, meters):
+half of them uniformly, half clustered around the Alberta cities
+(uploads/Cities_AB.shp), which is closer to real data than a uniform scatter.
+"""
+from pathlib import Path
+
+import geopandas as gpd
+import numpy as np
+import shapely
+
+ROOT = Path(__file__).resolve().parent.parent
+SAMPLES = ROOT / "uploads"
+
+
+def load_samples():
+    """(cities, study_area) from uploads/, both in the study area's CRS"""
+    study_area = gpd.read_file(SAMPLES / "StudyArea.shp")
+    cities = gpd.read_file(SAMPLES / "Cities_AB.shp").to_crs(study_area.crs)
+    return cities, study_area
+
+
+def parse_count(text):
+    """'1k' -> 1000, '10M' -> 10000000, '2500' -> 2500"""
+    text = text.strip().lower()
+    scale = {"k": 1_000, "m": 1_000_000}.get(text[-1:], 1)
+    return int(float(text[:-1] if scale > 1 else text) * scale)
+
+
+def _attributes(count, rng):
+    # ~sqrt(count) groups, so dissolve has both many groups and big groups
+    groups = max(1, int(np.sqrt(count)))
+    return {
+        "feature_id": np.arange(count),
+        "group": rng.integers(0, groups, count),
+        "value": rng.random(count) * 100,
+    }
+
+
+def _coordinates(count, cities, study_area, rng):
+    minx, miny, maxx, maxy = study_area.total_bounds
+    uniform = rng.uniform([minx, miny], [maxx, maxy], size=(count - count // 2, 2))
+    seeds = np.column_stack([cities.geometry.x, cities.geometry.y])
+    clustered = seeds[rng.integers(0, len(seeds), count // 2)]
+    clustered = clustered + rng.normal(0, (maxx - minx) / 50, size=clustered.shape)
+    coords = np.vstack([uniform, clustered])
+    return coords[rng.permutation(count)]
+
+
+def _spacing(count, study_area):
+    """Typical distance between neighbouring features for `count` features"""
+    minx, miny, maxx, maxy = study_area.total_bounds
+    return np.sqrt((maxx - minx) * (maxy - miny) / max(count, 1))
+
+
+def points(count, cities, study_area, rng):
+    coords = _coordinates(count, cities, study_area, rng)
+    return gpd.GeoDataFrame(
+        _attributes(count, rng),
+        geometry=shapely.points(coords),
+        crs=study_area.crs,
+    )
+
+
+def lines(count, cities, study_area, rng, vertices=8):
+    """Random-walk polylines of `vertices` vertices each"""
+    starts = _coordinates(count, cities, study_area, rng)
+    step = _spacing(count, study_area) / 2
+    walks = np.cumsum(rng.normal(0, step, size=(count, vertices, 2)), axis=1)
+    walks[:, 0] = 0
+    coords = (starts[:, None, :] + walks).reshape(-1, 2)
+    return gpd.GeoDataFrame(
+        _attributes(count, rng),
+        geometry=shapely.linestrings(coords, indices=np.repeat(np.arange(count), vertices)),
+        crs=study_area.crs,
+    )
+
+
+def polygons(count, cities, study_area, rng):
+    """Buffered points sized so that neighbouring polygons overlap"""
+    centers = _coordinates(count, cities, study_area, rng)
+    radius = _spacing(count, study_area) * rng.uniform(0.4, 1.2, count)
+    return gpd.GeoDataFrame(
+        _attributes(count, rng),
+        geometry=shapely.buffer(shapely.points(centers), radius, quad_segs=4),
+        crs=study_area.crs,
+    )
+
+
+GENERATORS = {
+    "points": points,
+    "lines": lines,
+    "polygons": polygons,
+}
+
+
+def generate(kind, count, seed=42, samples=None):
+    """One synthetic layer; `samples` is the result of load_samples() when already loaded"""
+    cities, study_area = samples if samples is not None else load_samples()
+    return GENERATORS[kind](count, cities, study_area, np.random.default_rng(seed))
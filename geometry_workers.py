@@ -0,0 +1,130 @@
+"""
+Geometry work executed in the process pool used for large layers (see
+`partitioned_geometry_op` and `partitioned_dissolve` in main.py).
+
+This module only depends on numpy, shapely and pyproj so worker processes
+can import it without loading the FastAPI app. Geometries travel as WKB:
+the parent writes every feature into one shared memory block and each task
+receives the block name plus the offsets of its chunk, so no GeoDataFrame
+is ever pickled.
+"""
+from functools import lru_cache
+from multiprocessing import shared_memory
+
+import numpy as np
+import shapely
+from pyproj import Transformer
+
+
+@lru_cache(maxsize=16)
+def _transformer(source_crs, target_crs):
+    return Transformer.from_crs(source_crs, target_crs, always_xy=True)
+
+
+def _buffer(geometries, distance):
+    # GeoSeries.buffer's default resolution, so partitioned and in-process results match
+    return shapely.buffer(geometries, distance, quad_segs=16)
+
+
+def _simplify(geometries, tolerance):
+    return shapely.simplify(geometries, tolerance, preserve_topology=True)
+
+
+def _reproject(geometries, source_crs, target_crs):
+    transformer = _transformer(source_crs, target_crs)
+
+    def transform(coords):
+        # (x, y) or (x, y, z) columns, the z ones go through the transformer too
+        return np.column_stack(transformer.transform(*coords.T))
+
+    # Like GeoSeries.to_crs, 3D geometries keep their Z and 2D ones stay 2D
+    geometries = np.asarray(geometries, dtype=object)
+    has_z = shapely.has_z(geometries)
+    result = shapely.transform(geometries, transform)
+    if has_z.any():
+        result[has_z] = shapely.transform(geometries[has_z], transform, include_z=True)
+    return result
+
+
+OPERATIONS = {
+    "buffer": _buffer,
+    "simplify": _simplify,
+    "reproject": _reproject,
+}
+
+
+def encode_chunk(geometries):
+    """Encode geometries as one WKB buffer plus per-feature lengths (0 = missing)"""
+    wkbs = shapely.to_wkb(geometries)
+    lengths = np.fromiter((len(wkb) if wkb is not None else 0 for wkb in wkbs), dtype=np.int64, count=len(wkbs))
+    return b"".join(wkb for wkb in wkbs if wkb is not None), lengths
+
+
+def decode_chunk(raw, lengths):
+    """Geometries from one WKB buffer plus per-feature lengths, as made by encode_chunk"""
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    return shapely.from_wkb([raw[start:stop] if stop > start else None
+                             for start, stop in zip(offsets[:-1], offsets[1:])])
+
+
+def write_shared(geometries):
+    """
+    Write geometries as WKB into a new shared memory block (in the parent).
+
+    Returns:
+        (SharedMemory, offsets) where feature i is at offsets[i]:offsets[i + 1]
+        (empty for missing geometries); the caller closes and unlinks the block
+    """
+    raw, lengths = encode_chunk(geometries)
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    shm = shared_memory.SharedMemory(create=True, size=max(1, len(raw)))
+    shm.buf[:len(raw)] = raw
+    return shm, offsets
+
+
+def read_chunk(shm_name, offsets):
+    """Copy one chunk of WKB out of shared memory and decode it"""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        raw = bytes(shm.buf[offsets[0]:offsets[-1]])
+    finally:
+        shm.close()
+    return decode_chunk(raw, np.diff(offsets))
+
+
+def run_chunk(shm_name, offsets, operation, params):
+    """
+    Apply one geometry operation to a chunk of a layer.
+
+    Args:
+        shm_name: Name of the shared memory block holding the layer's WKB
+        offsets: Byte offsets of the chunk's features (len = features + 1)
+        operation: Key of OPERATIONS
+        params: Keyword arguments for the operation
+
+    Returns:
+        (bytes, lengths) as produced by encode_chunk
+    """
+    geometries = read_chunk(shm_name, offsets)
+    return encode_chunk(OPERATIONS[operation](geometries, **params))
+
+
+def union_groups(shm_name, offsets, groups):
+    """
+    Union a chunk of a dissolve, one geometry per group.
+
+    Args:
+        shm_name: Name of the shared memory block holding the layer's WKB
+        offsets: Byte offsets of the chunk's features (len = features + 1)
+        groups: Sorted group code of each feature of the chunk
+
+    Returns:
+        (codes, bytes, lengths): the chunk's distinct group codes and their
+        unions, encoded as by encode_chunk
+    """
+    geometries = read_chunk(shm_name, offsets)
+    codes, starts = np.unique(groups, return_index=True)
+    stops = np.append(starts[1:], len(groups))
+    unions = np.empty(len(codes), dtype=object)
+    unions[:] = [shapely.union_all(geometries[start:stop]) for start, stop in zip(starts, stops)]
+    return (codes, *encode_chunk(unions))
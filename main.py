@@ -1,41 +1,135 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, File, UploadFile, HTTPException, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
 import shutil
 import traceback
-import geopandas as gpd
 import json
 from pathlib import Path
 
 import tempfile
+import sqlite3
 import sys
 import io
-import contextlib
+import ast
 from typing import Dict, Any, Optional, List
-import rasterio
-from rasterio.plot import reshape_as_image
 import numpy as np
-from openai import OpenAI
+import orjson
+import threading
+import heapq
+from collections import OrderedDict, deque
+from urllib.parse import quote, parse_qs
+import asyncio
+import functools
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import httpx
 from pydantic import BaseModel
-from typing import Dict, Any, Annotated, TypedDict, List, Any
+from typing import Dict, Any, Annotated, TypedDict, List, Any, NamedTuple, Callable
+from contextvars import ContextVar, copy_context
 
 
 import operator
-
-from langgraph.prebuilt import tools_condition, ToolNode
-from langgraph.graph import StateGraph, END
+import abc
 
 import logging
 
 import inspect
+import importlib
+import importlib.util
 import os
+import zipfile
+import re
+import time
+import hashlib
+import random
+import uuid
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
 
 from dotenv import load_dotenv
+
+class LazyModule:
+    """
+    A module that is only imported on first attribute access.
+    
+    geopandas, pandas, rasterio and Pillow take seconds to import together
+    (shapely and pyproj a few hundred milliseconds more); loading them when
+    the first request needs them keeps worker (re)starts fast. `submodules` are imported along with the module.
+    """
+    
+    def __init__(self, name, submodules=()):
+        self._name = name
+        self._submodules = submodules
+        self._module = None
+    
+    def __getattr__(self, attribute):
+        if self._module is None:
+            module = importlib.import_module(self._name)
+            for submodule in self._submodules:
+                importlib.import_module(f"{self._name}.{submodule}")
+            self._module = module
+        return getattr(self._module, attribute)
+
+gpd = LazyModule("geopandas")
+pd = LazyModule("pandas")
+rasterio = LazyModule("rasterio", submodules=("crs", "enums", "features", "plot", "shutil", "transform", "warp", "windows"))
+Image = LazyModule("PIL.Image")
+shapely = LazyModule("shapely")
+pyproj = LazyModule("pyproj")
+geometry_workers = LazyModule("geometry_workers")  # Imports shapely and pyproj
 load_dotenv()
 API_KEY = os.getenv("OPENAI_API_KEY")
 app = FastAPI(title="GIS Intelligent Assistant")
-client = OpenAI(api_key=API_KEY)
+
+# Models the agent can run with; a compiled graph is kept for each of them
+DEFAULT_MODEL = os.getenv("GIS_AGENT_MODEL", "gpt-4")
+AGENT_MODELS = [m.strip() for m in os.getenv("GIS_AGENT_MODELS", DEFAULT_MODEL).split(",") if m.strip()]
+if DEFAULT_MODEL not in AGENT_MODELS:
+    AGENT_MODELS.insert(0, DEFAULT_MODEL)
+
+# OpenAI client settings: one pooled async client shared by every request
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))  # Seconds per request
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "3"))
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "20"))
+
+client = None  # Created on first use, importing openai takes a while
+
+def get_openai_client():
+    global client
+    if client is None:
+        from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+        client = AsyncOpenAI(
+            api_key=API_KEY,
+            timeout=OPENAI_TIMEOUT,
+            max_retries=OPENAI_MAX_RETRIES,
+            http_client=DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=OPENAI_MAX_CONNECTIONS,
+                    max_keepalive_connections=OPENAI_MAX_CONNECTIONS
+                )
+            )
+        )
+    return client
+
+# GIS work (reading files, overlays, encoding) runs in this pool so it never
+# blocks the event loop. Most shapely/GEOS work releases the GIL, so threads
+# give real overlap without copying layers into other processes.
+GIS_WORKERS = int(os.getenv("GIS_WORKERS", str(min(8, os.cpu_count() or 1))))
+GIS_EXECUTOR = ThreadPoolExecutor(max_workers=GIS_WORKERS, thread_name_prefix="gis")
+
+# Maximum number of independent steps of one agent plan that run at the same time
+GIS_PLAN_PARALLELISM = max(1, int(os.getenv("GIS_PLAN_PARALLELISM", str(GIS_WORKERS))))
+
+async def run_gis(func, *args, **kwargs):
+    """Run a blocking GIS function in GIS_EXECUTOR and wait for it without blocking the loop"""
+    loop = asyncio.get_running_loop()
+    # Carry the caller's context (session, plan listener) into the worker thread
+    context = copy_context()
+    return await loop.run_in_executor(GIS_EXECUTOR, functools.partial(context.run, func, *args, **kwargs))
+
 # Add CORS middleware to allow all origins
 app.add_middleware(
     CORSMiddleware,
@@ -48,29 +142,1060 @@ app.add_middleware(
 UPLOAD_DIR = Path("uploads")
 UPLOAD_DIR.mkdir(exist_ok=True)
 
+# Uploads are streamed to disk in pieces of this size
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+REQUIRED_SHAPEFILE_PARTS = ['shp', 'shx', 'dbf', 'prj']
+
+# pyogrio can hand data over as Arrow when pyarrow is installed, which is much faster
+PYARROW_AVAILABLE = importlib.util.find_spec("pyarrow") is not None
+
+# Memory budget for loaded layers; least recently used layers beyond it are spilled to disk
+LAYER_MEMORY_BUDGET = int(float(os.getenv("LAYER_MEMORY_BUDGET_MB", "1024")) * 1024 * 1024)
+LAYER_SPILL_DIR = Path(os.getenv("LAYER_SPILL_DIR", Path(tempfile.gettempdir()) / "gis_layer_spill" / str(os.getpid())))
+
+def estimate_layer_bytes(gdf):
+    """
+    Approximate memory used by a GeoDataFrame.
+    
+    pandas only counts the pointers of the geometry column, so geometries are
+    estimated from their coordinate count (two float64s per coordinate plus
+    a fixed per-geometry overhead).
+    """
+    attributes = gdf.drop(columns=[gdf.geometry.name]).memory_usage(deep=True, index=True).sum()
+    coordinates = shapely.get_num_coordinates(np.asarray(gdf.geometry.array, dtype=object)).sum()
+    return int(attributes + coordinates * 16 + len(gdf) * 100)
+
+# Where layers live besides this process' memory: "shared" keeps them in the
+# on-disk catalog in LAYER_SHARED_DIR, so every worker sees them and they
+# survive restarts; "memory" keeps them per process only
+LAYER_BACKEND = os.getenv("LAYER_BACKEND", "shared" if PYARROW_AVAILABLE else "memory")
+LAYER_SHARED_DIR = Path(os.getenv("LAYER_SHARED_DIR", UPLOAD_DIR / "layers"))
+
+def layer_catalog_entry(gdf, lineage=None):
+    """
+    Catalog metadata of a layer: size, CRS, bounds, columns and lineage.
+    
+    Args:
+        gdf: The layer
+        lineage: Optional dict with the operation, params and input layers
+            that produced the layer
+    """
+    return {
+        "features": len(gdf),
+        "bytes": estimate_layer_bytes(gdf),
+        "crs": gdf.crs.to_string() if gdf.crs is not None else None,
+        "bounds": [float(value) for value in gdf.total_bounds] if len(gdf) else None,
+        "columns": {str(name): str(dtype) for name, dtype in gdf.dtypes.items() if name != gdf.geometry.name},
+        "geometry_types": sorted(str(kind) for kind in gdf.geom_type.dropna().unique()),
+        "created": time.time(),
+        "lineage": lineage,
+    }
+
+class LayerBackend(abc.ABC):
+    """
+    Storage shared by LayerStore instances (e.g. several uvicorn workers).
+    
+    A version identifies one write of a layer; LayerStore keeps it next to its
+    in-memory copy and drops the copy when the backend reports another one.
+    """
+    
+    @abc.abstractmethod
+    def versions(self):
+        """Dict of layer name -> current version, in creation order"""
+    
+    @abc.abstractmethod
+    def read(self, layer_name):
+        """(GeoDataFrame, version) of a layer; KeyError if it doesn't exist"""
+    
+    @abc.abstractmethod
+    def write(self, layer_name, gdf, metadata=None):
+        """Store a layer (replacing any previous version) and return its version"""
+    
+    def metadata(self, layer_name):
+        """Catalog metadata stored with a layer (see layer_catalog_entry), or None"""
+        return None
+    
+    @abc.abstractmethod
+    def delete(self, layer_name):
+        """Remove a layer; missing layers are ignored"""
+    
+    def close(self):
+        pass
+
+class SharedDirectoryBackend(LayerBackend):
+    """
+    Layers as uncompressed Arrow IPC (Feather) files in a shared directory,
+    indexed by a SQLite database next to them that also keeps each layer's
+    metadata and lineage (the layer catalog).
+    
+    Files are never modified: every write goes to a new file and the index row
+    is switched to it in one write transaction, which also returns the file
+    it replaced for removal, so readers never see a partial layer. Reads memory-map the file, so attribute buffers come straight from
+    the page cache that all workers share. The index is only re-read when
+    another connection committed (PRAGMA data_version).
+    
+    Nothing is read at startup: after a restart the catalog is available
+    right away and each layer is mapped the first time it is used.
+    """
+    
+    def __init__(self, root=LAYER_SHARED_DIR):
+        if not PYARROW_AVAILABLE:
+            raise RuntimeError("The shared layer backend needs pyarrow")
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(
+            self.root / "index.sqlite", timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        # Workers open the index at the same time, so the schema is checked and
+        # migrated under the database write lock
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS layers ("
+                "name TEXT PRIMARY KEY, file TEXT NOT NULL, created REAL NOT NULL, metadata TEXT)"
+            )
+            columns = {row[1] for row in self.connection.execute("PRAGMA table_info(layers)")}
+            if "metadata" not in columns:
+                # Catalogs written before metadata and lineage were kept
+                self.connection.execute("ALTER TABLE layers ADD COLUMN metadata TEXT")
+            self.connection.execute("COMMIT")
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        self.data_version = None
+        self.index = OrderedDict()  # name -> file (the file name is the version)
+        self.lock = threading.Lock()
+    
+    def _refresh(self):
+        data_version = self.connection.execute("PRAGMA data_version").fetchone()[0]
+        if data_version != self.data_version:
+            rows = self.connection.execute("SELECT name, file FROM layers ORDER BY created").fetchall()
+            self.index = OrderedDict(rows)
+            self.data_version = data_version
+    
+    def versions(self):
+        with self.lock:
+            self._refresh()
+            return self.index
+    
+    def read(self, layer_name):
+        for _ in range(2):
+            with self.lock:
+                self._refresh()
+                file_name = self.index[layer_name]
+            try:
+                return gpd.read_feather(self.root / file_name, memory_map=True), file_name
+            except FileNotFoundError:
+                # Replaced by another worker between the lookup and the read
+                with self.lock:
+                    self.data_version = None
+        raise KeyError(layer_name)
+    
+    def write(self, layer_name, gdf, metadata=None):
+        file_name = f"{uuid.uuid4().hex}.arrow"
+        if not all(isinstance(name, str) for name in gdf.columns):
+            gdf = gdf.rename(columns=str)  # Arrow only takes string column names
+        gdf.to_feather(self.root / file_name, compression="uncompressed")
+        encoded = json.dumps(metadata, default=str) if metadata is not None else None
+        previous = self._swap(
+            layer_name,
+            "INSERT INTO layers (name, file, created, metadata) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET file = excluded.file, metadata = excluded.metadata",
+            (layer_name, file_name, time.time(), encoded)
+        )
+        if previous is not None:
+            self._unlink(previous)
+        return file_name
+    
+    def _swap(self, layer_name, statement, parameters):
+        """
+        Run `statement` on a layer's row and return the file it pointed to before.
+        
+        Both run in one write transaction (BEGIN IMMEDIATE takes the database
+        write lock), so when workers replace the same layer concurrently each
+        old file is reported to exactly one of them.
+        """
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                previous = self.connection.execute("SELECT file FROM layers WHERE name = ?", (layer_name,)).fetchone()
+                self.connection.execute(statement, parameters)
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+            # data_version doesn't change for our own commits
+            self.data_version = None
+        return previous[0] if previous is not None else None
+    
+    def metadata(self, layer_name):
+        with self.lock:
+            row = self.connection.execute("SELECT metadata FROM layers WHERE name = ?", (layer_name,)).fetchone()
+        return json.loads(row[0]) if row is not None and row[0] else None
+    
+    def delete(self, layer_name):
+        previous = self._swap(layer_name, "DELETE FROM layers WHERE name = ?", (layer_name,))
+        if previous is not None:
+            self._unlink(previous)
+    
+    def _unlink(self, file_name):
+        # Workers that mapped the old file keep their mapping (POSIX); on
+        # platforms that refuse to delete mapped files the file is left behind
+        try:
+            (self.root / file_name).unlink(missing_ok=True)
+        except OSError as e:
+            logger.warning(f"Could not remove old layer file {file_name}: {e}")
+    
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+def make_layer_backend(kind=LAYER_BACKEND):
+    """LayerBackend for a LAYER_BACKEND setting (None for per-process layers)"""
+    if kind == "memory":
+        return None
+    if kind == "shared":
+        return SharedDirectoryBackend(LAYER_SHARED_DIR)
+    raise ValueError(f"Unknown LAYER_BACKEND '{kind}' (expected 'memory' or 'shared')")
+
+class LayerStore:
+    """
+    Dict-like store of loaded layers with a memory budget.
+    
+    Layers are kept in LRU order. When the estimated size of the in-memory
+    layers goes over `budget`, the least recently used ones are written to
+    GeoParquet in `spill_dir` and dropped from memory; reading them again
+    reloads them transparently. Hits, misses (reloads) and spills are counted.
+    Spill files are written after the lock is released; until then the
+    layer stays readable from `spilling`.
+    
+    With a `backend`, every layer is written to it and the in-memory layers are
+    only a cache: layers stored by other processes are visible, evicted layers
+    are simply dropped (the backend already has them), and a cached layer that
+    another process replaced or deleted is forgotten on the next access, with
+    `change_listeners` called for its name.
+    """
+    
+    def __init__(self, budget=LAYER_MEMORY_BUDGET, spill_dir=LAYER_SPILL_DIR, backend=None):
+        self.budget = budget
+        self.spill_dir = Path(spill_dir)
+        self.backend = backend
+        self.backend_versions = {}  # Backend version of each in-memory layer
+        self.synced_versions = None  # Backend index seen by the last _sync
+        self.change_listeners = []
+        self.layers = OrderedDict()
+        self.sizes = {}
+        self.spilled = {}
+        self.spilling = {}  # Layers picked for spilling whose file is being written
+        self.fingerprints = {}
+        self.row_hash_cache = {}  # Only for layers something asked row hashes of (dissolve)
+        self.statistics = {}
+        self.catalog = {}  # Catalog metadata of each layer when there's no backend
+        self.memory_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.spills = 0
+        self.lock = threading.RLock()
+    
+    def _sync(self):
+        """Forget in-memory layers that another process replaced or deleted"""
+        if self.backend is None:
+            return
+        with self.lock:
+            versions = self.backend.versions()
+            if versions is self.synced_versions:
+                return  # Index unchanged since the last check
+            changed = [name for name, version in self.backend_versions.items() if versions.get(name) != version]
+            for layer_name in changed:
+                self._forget(layer_name)
+            self.synced_versions = versions
+        # Listeners take their own locks, so call them without holding ours
+        for layer_name in changed:
+            for listener in self.change_listeners:
+                listener(layer_name)
+    
+    def __contains__(self, layer_name):
+        self._sync()
+        with self.lock:
+            if self.backend is not None:
+                return layer_name in self.backend.versions()
+            return layer_name in self.layers or layer_name in self.spilled or layer_name in self.spilling
+    
+    def __len__(self):
+        return len(self.keys())
+    
+    def __iter__(self):
+        return iter(self.keys())
+    
+    def keys(self):
+        """Names of every layer, in memory or spilled"""
+        self._sync()
+        with self.lock:
+            if self.backend is not None:
+                return list(self.backend.versions())
+            # A reloaded layer keeps its spill file, don't list it twice
+            return list(self.layers.keys()) + [name for name in self.spilling] + [
+                name for name in self.spilled if name not in self.layers and name not in self.spilling
+            ]
+    
+    def __getitem__(self, layer_name):
+        self._sync()
+        with self.lock:
+            if layer_name in self.layers:
+                self.hits += 1
+                self.layers.move_to_end(layer_name)
+                return self.layers[layer_name]
+            if layer_name in self.spilling:
+                self.hits += 1
+                return self.spilling[layer_name]
+            if self.backend is not None:
+                self.misses += 1
+                gdf, version = self.backend.read(layer_name)
+                self.backend_versions[layer_name] = version
+            elif layer_name in self.spilled:
+                # Reload a spilled layer; the spill file stays valid until the layer is replaced
+                self.misses += 1
+                gdf = gpd.read_parquet(self.spilled[layer_name])
+            else:
+                raise KeyError(layer_name)
+            victims = self._keep_in_memory(layer_name, gdf)
+        self._spill(victims)
+        return gdf
+    
+    def get(self, layer_name, default=None):
+        try:
+            return self[layer_name]
+        except KeyError:
+            return default
+    
+    def __setitem__(self, layer_name, gdf):
+        self.put(layer_name, gdf)
+    
+    def put(self, layer_name, gdf, metadata=None):
+        """Store a layer along with its catalog metadata (see layer_catalog_entry)"""
+        version = None
+        if self.backend is not None:
+            # Written without the lock, like spill files. If another put of the
+            # same name wins the race, _sync sees that our version is no longer
+            # the backend's and reloads the current one.
+            version = self.backend.write(layer_name, gdf, metadata)
+        with self.lock:
+            self._forget(layer_name)
+            if self.backend is not None:
+                self.backend_versions[layer_name] = version
+            else:
+                self.catalog[layer_name] = metadata
+            victims = self._keep_in_memory(layer_name, gdf)
+        self._spill(victims)
+    
+    def __delitem__(self, layer_name):
+        exists = layer_name in self
+        with self.lock:
+            if not exists:
+                raise KeyError(layer_name)
+            self._forget(layer_name)
+            self.catalog.pop(layer_name, None)
+            if self.backend is not None:
+                self.backend.delete(layer_name)
+    
+    def metadata(self, layer_name):
+        """Catalog metadata of a layer, without loading it (None if none was stored)"""
+        if self.backend is not None:
+            return self.backend.metadata(layer_name)
+        with self.lock:
+            return self.catalog.get(layer_name)
+    
+    def _keep_in_memory(self, layer_name, gdf):
+        size = estimate_layer_bytes(gdf)
+        self.layers[layer_name] = gdf
+        self.sizes[layer_name] = size
+        self.memory_bytes += size
+        return self._evict(keep=layer_name)
+    
+    def fingerprint(self, layer_name):
+        """Content fingerprint of a layer, computed once per layer version"""
+        self._sync()
+        with self.lock:
+            fingerprint = self.fingerprints.get(layer_name)
+        if fingerprint is not None:
+            return fingerprint
+        gdf = self[layer_name]
+        with self.lock:
+            row_hashes = self.row_hash_cache.get(layer_name)
+        
+        fingerprint = layer_fingerprint(gdf, row_hashes=row_hashes)
+        with self.lock:
+            # Only keep it if the layer wasn't replaced while hashing
+            if self.layers.get(layer_name) is gdf:
+                self.fingerprints[layer_name] = fingerprint
+        return fingerprint
+    
+    def row_hashes(self, layer_name):
+        """layer_row_hashes() of a layer, computed once per layer version"""
+        self._sync()
+        with self.lock:
+            row_hashes = self.row_hash_cache.get(layer_name)
+        if row_hashes is not None:
+            return row_hashes
+        gdf = self[layer_name]
+        
+        row_hashes = layer_row_hashes(gdf)
+        with self.lock:
+            if self.layers.get(layer_name) is gdf:
+                self.row_hash_cache[layer_name] = row_hashes
+        return row_hashes
+    
+    def layer_stats(self, layer_name):
+        """LayerStats of a layer, computed once per layer version (kept across spills)"""
+        self._sync()
+        with self.lock:
+            stats = self.statistics.get(layer_name)
+        if stats is not None:
+            return stats
+        gdf = self[layer_name]
+        
+        stats = LayerStats(gdf)
+        with self.lock:
+            if self.layers.get(layer_name) is gdf:
+                self.statistics[layer_name] = stats
+        return stats
+    
+    def name_of(self, gdf):
+        """Name under which this exact GeoDataFrame object is stored, if any"""
+        with self.lock:
+            for layer_name, layer in self.layers.items():
+                if layer is gdf:
+                    return layer_name
+        return None
+    
+    def _forget(self, layer_name):
+        """Drop a layer from memory and the spill directory (not from the backend)"""
+        self.backend_versions.pop(layer_name, None)
+        self.fingerprints.pop(layer_name, None)
+        self.row_hash_cache.pop(layer_name, None)
+        self.statistics.pop(layer_name, None)
+        if layer_name in self.layers:
+            del self.layers[layer_name]
+            self.memory_bytes -= self.sizes.pop(layer_name)
+        self.spilling.pop(layer_name, None)  # _spill discards the file it's writing
+        spill_path = self.spilled.pop(layer_name, None)
+        if spill_path is not None:
+            spill_path.unlink(missing_ok=True)
+    
+    def _evict(self, keep=None):
+        """
+        Drop least recently used layers from memory until the in-memory layers
+        fit the budget (called with the lock held).
+        
+        Returns:
+            List of (name, GeoDataFrame) to write with _spill once the lock is released
+        """
+        victims = []
+        while self.memory_bytes > self.budget:
+            victim = next((name for name in self.layers if name != keep), None)
+            if victim is None:
+                break  # Only the layer being used is left, keep it even if it's over budget
+            
+            gdf = self.layers.pop(victim)
+            self.memory_bytes -= self.sizes.pop(victim)
+            if self.backend is not None:
+                # Reloaded from the backend on next use; derived data stays valid
+                # while the backend version is unchanged
+                logger.info(f"Dropped layer '{victim}' from memory ({len(self.layers)} layers left in memory)")
+                continue
+            if victim in self.spilled:
+                logger.info(f"Dropped layer '{victim}', already spilled ({len(self.layers)} layers left in memory)")
+                continue
+            self.spilling[victim] = gdf
+            victims.append((victim, gdf))
+        return victims
+    
+    def _spill(self, victims):
+        """Write the layers picked by _evict to GeoParquet (without holding the lock)"""
+        for victim, gdf in victims:
+            self.spill_dir.mkdir(parents=True, exist_ok=True)
+            # Unique per write, a replaced layer may be spilled while its old version still is
+            spill_path = self.spill_dir / f"{hashlib.sha1(victim.encode()).hexdigest()}-{uuid.uuid4().hex[:8]}.parquet"
+            try:
+                gdf.to_parquet(spill_path)
+                error = None
+            except Exception as e:
+                error = e
+            
+            with self.lock:
+                if self.spilling.get(victim) is not gdf:
+                    # Replaced or deleted while it was being written
+                    spill_path.unlink(missing_ok=True)
+                    continue
+                del self.spilling[victim]
+                if error is None:
+                    self.spilled[victim] = spill_path
+                    self.spills += 1
+                else:
+                    # Keep it in memory rather than lose it, even over budget
+                    spill_path.unlink(missing_ok=True)
+                    self.layers[victim] = gdf
+                    self.layers.move_to_end(victim, last=False)
+                    self.sizes[victim] = estimate_layer_bytes(gdf)
+                    self.memory_bytes += self.sizes[victim]
+            if error is None:
+                logger.info(f"Spilled layer '{victim}' to disk")
+            else:
+                logger.error(f"Could not spill layer '{victim}', keeping it in memory: {error}")
+    
+    def stats(self):
+        """Counters and sizes of the store"""
+        with self.lock:
+            return {
+                "layers_in_memory": len(self.layers),
+                "layers_spilled": len(self.spilled) - sum(1 for name in self.spilled if name in self.layers),
+                "layers_spilling": len(self.spilling),
+                "memory_bytes": self.memory_bytes,
+                "budget_bytes": self.budget,
+                "hits": self.hits,
+                "misses": self.misses,
+                "spills": self.spills,
+                "backend": type(self.backend).__name__ if self.backend is not None else "memory",
+            }
+    
+    def clear_spill(self):
+        """Remove every spill file (used on shutdown)"""
+        with self.lock:
+            for layer_name, spill_path in list(self.spilled.items()):
+                spill_path.unlink(missing_ok=True)
+                if layer_name not in self.layers:
+                    logger.warning(f"Layer '{layer_name}' was only on disk and is lost")
+            self.spilled.clear()
+
+# Every layer lives in one LayerStore under "<session>/<name>"; the code
+# below only ever sees the names of the current request's session
+LAYER_STORE = LayerStore(backend=make_layer_backend())
+
+DEFAULT_SESSION = "default"  # Requests without a session header share this one
+SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+CURRENT_SESSION: ContextVar[str] = ContextVar("CURRENT_SESSION", default=DEFAULT_SESSION)
+
+def split_layer_key(key):
+    """(session, layer name) of a LAYER_STORE key"""
+    session_id, _, layer_name = key.partition("/")
+    return session_id, layer_name
+
+class SessionLayers:
+    """
+    Dict-like view of the current session's layers in a LayerStore.
+    
+    Same interface as LayerStore, with names relative to CURRENT_SESSION, so
+    the GIS functions keep using plain layer names.
+    """
+    
+    def __init__(self, store):
+        self.store = store
+    
+    @staticmethod
+    def qualified(layer_name, session_id=None):
+        """LAYER_STORE key of a layer of the current (or given) session"""
+        return f"{session_id or CURRENT_SESSION.get()}/{layer_name}"
+    
+    def __contains__(self, layer_name):
+        return isinstance(layer_name, str) and self.qualified(layer_name) in self.store
+    
+    def __len__(self):
+        return len(self.keys())
+    
+    def __iter__(self):
+        return iter(self.keys())
+    
+    def keys(self):
+        prefix = self.qualified("")
+        return [key[len(prefix):] for key in self.store.keys() if key.startswith(prefix)]
+    
+    def __getitem__(self, layer_name):
+        try:
+            return self.store[self.qualified(layer_name)]
+        except KeyError:
+            raise KeyError(layer_name) from None
+    
+    def get(self, layer_name, default=None):
+        try:
+            return self[layer_name]
+        except KeyError:
+            return default
+    
+    def __setitem__(self, layer_name, gdf):
+        self.store[self.qualified(layer_name)] = gdf
+    
+    def put(self, layer_name, gdf, metadata=None):
+        self.store.put(self.qualified(layer_name), gdf, metadata)
+    
+    def metadata(self, layer_name):
+        return self.store.metadata(self.qualified(layer_name))
+    
+    def __delitem__(self, layer_name):
+        try:
+            del self.store[self.qualified(layer_name)]
+        except KeyError:
+            raise KeyError(layer_name) from None
+    
+    def fingerprint(self, layer_name):
+        return self.store.fingerprint(self.qualified(layer_name))
+    
+    def row_hashes(self, layer_name):
+        return self.store.row_hashes(self.qualified(layer_name))
+    
+    def layer_stats(self, layer_name):
+        return self.store.layer_stats(self.qualified(layer_name))
+    
+    def name_of(self, gdf):
+        key = self.store.name_of(gdf)
+        if key is None:
+            return None
+        session_id, layer_name = split_layer_key(key)
+        return layer_name if session_id == CURRENT_SESSION.get() else None
+    
+    def stats(self):
+        return self.store.stats()
+
 # Store loaded layers in memory for operations
-LOADED_LAYERS: Dict[str, gpd.GeoDataFrame] = {}
+LOADED_LAYERS = SessionLayers(LAYER_STORE)
+
+# Sessions: idle ones are removed with all their layers, and each is bounded
+SESSION_TTL = float(os.getenv("SESSION_TTL", "3600"))  # Seconds without requests before a session expires
+SESSION_MAX_LAYERS = int(os.getenv("SESSION_MAX_LAYERS", "200"))
+SESSION_MEMORY_QUOTA = int(float(os.getenv("SESSION_MEMORY_QUOTA_MB", "2048")) * 1024 * 1024)
+SESSION_CLEANUP_INTERVAL = float(os.getenv("SESSION_CLEANUP_INTERVAL", "60"))
+SESSION_TOUCH_INTERVAL = 30  # Seconds between activity marks in the shared directory
+# DEFAULT_SESSION never expires, so its layers and rasters are removed one by
+# one once they're this old instead (0 keeps them forever)
+DEFAULT_SESSION_MAX_AGE = float(os.getenv("DEFAULT_SESSION_MAX_AGE", str(7 * 24 * 3600)))
+
+class SessionQuotaExceeded(ValueError):
+    pass
+
+class LayerSession:
+    """Naming counters and activity of one session"""
+    
+    def __init__(self, session_id):
+        self.id = session_id
+        self.created_at = time.time()
+        self.last_seen = self.created_at
+        self.last_marked = 0.0
+        self.counters = {}  # Name prefix -> last number handed out
+        self.lock = threading.RLock()
+
+class SessionManager:
+    """
+    Sessions by ID: atomic layer name allocation, quotas and expiry.
+    
+    With the shared layer backend, activity is also marked in
+    `activity_dir` so a worker doesn't expire a session that is only being
+    used through another worker.
+    """
+    
+    def __init__(self, ttl=SESSION_TTL, max_layers=SESSION_MAX_LAYERS, memory_quota=SESSION_MEMORY_QUOTA, activity_dir=None,
+                 default_max_age=DEFAULT_SESSION_MAX_AGE):
+        self.ttl = ttl
+        self.default_max_age = default_max_age
+        self.max_layers = max_layers
+        self.memory_quota = memory_quota
+        self.activity_dir = Path(activity_dir) if activity_dir else None
+        if self.activity_dir is not None:
+            self.activity_dir.mkdir(parents=True, exist_ok=True)
+        self.sessions = {}
+        self.lock = threading.Lock()
+    
+    def touch(self, session_id):
+        """Get a session, creating it on first use, and mark it as active"""
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is None:
+                session = self.sessions[session_id] = LayerSession(session_id)
+        now = time.time()
+        session.last_seen = now
+        if self.activity_dir is not None and now - session.last_marked > SESSION_TOUCH_INTERVAL:
+            session.last_marked = now
+            (self.activity_dir / session_id).touch()
+        return session
+    
+    def current(self):
+        return self.touch(CURRENT_SESSION.get())
+    
+    def allocate_names(self, prefix, count=1, separator=" "):
+        """
+        Reserve `count` consecutive unused layer names in the current session.
+        
+        Numbers continue from the session's layer count (the old naming) but
+        never repeat, so concurrent requests can't get the same name.
+        """
+        session = self.current()
+        with session.lock:
+            start = max(session.counters.get(prefix, 0), len(LOADED_LAYERS)) + 1
+            while any(f"{prefix}{separator}{n}" in LOADED_LAYERS or f"{prefix}{separator}{n}" in LOADED_RASTERS
+                      for n in range(start, start + count)):
+                start += 1
+            session.counters[prefix] = start + count - 1
+            return [f"{prefix}{separator}{n}" for n in range(start, start + count)]
+    
+    def allocate_name(self, prefix, separator=" "):
+        return self.allocate_names(prefix, 1, separator)[0]
+    
+    @staticmethod
+    def usage(session_id):
+        """
+        Size in bytes of each layer and raster of a session, from the catalog.
+        
+        Read from the catalog on every call rather than tracked per worker, so
+        layers that other workers stored (or deleted) are counted too. This
+        includes layers kept from before a restart.
+        """
+        prefix = SessionLayers.qualified("", session_id)
+        sizes = {}
+        for key in LAYER_STORE.keys():
+            metadata = LAYER_STORE.metadata(key) if key.startswith(prefix) else None
+            if metadata is not None:
+                sizes[key[len(prefix):]] = metadata["bytes"]
+        # Rasters count as layers, their size being that of the GeoTIFF
+        sizes.update(LOADED_RASTERS.session_sizes(session_id))
+        return sizes
+    
+    def _check_quota(self, session, layer_name, size, replacing):
+        """Raise SessionQuotaExceeded if storing `size` bytes under `layer_name` goes over a quota"""
+        count = len(LOADED_LAYERS) + len(LOADED_RASTERS.keys())
+        if not replacing and self.max_layers and count >= self.max_layers:
+            raise SessionQuotaExceeded(f"Session '{session.id}' already has {self.max_layers} layers")
+        if not self.memory_quota:
+            return
+        sizes = self.usage(session.id)
+        used = sum(sizes.values()) - sizes.get(layer_name, 0)
+        if used + size > self.memory_quota:
+            raise SessionQuotaExceeded(
+                f"Layer '{layer_name}' ({size // (1024 * 1024)} MB) would exceed the session's "
+                f"{self.memory_quota // (1024 * 1024)} MB quota"
+            )
+    
+    def store_layer(self, layer_name, gdf, lineage=None):
+        """Store a layer in the current session (and the catalog), enforcing its quotas"""
+        session = self.current()
+        entry = layer_catalog_entry(gdf, lineage)
+        size = entry["bytes"]
+        with session.lock:
+            self._check_quota(session, layer_name, size, layer_name in LOADED_LAYERS)
+            LOADED_LAYERS.put(layer_name, gdf, entry)
+    
+    def store_raster(self, raster_name, path):
+        """Register a GeoTIFF as a raster of the current session, enforcing its quotas"""
+        session = self.current()
+        size = Path(path).stat().st_size
+        with session.lock:
+            self._check_quota(session, raster_name, size, raster_name in LOADED_RASTERS)
+            LOADED_RASTERS.register(raster_name, path, size)
+    
+    def _last_activity(self, session_id):
+        with self.lock:
+            session = self.sessions.get(session_id)
+        last_seen = session.last_seen if session is not None else 0.0
+        if self.activity_dir is not None:
+            try:
+                last_seen = max(last_seen, (self.activity_dir / session_id).stat().st_mtime)
+            except FileNotFoundError:
+                pass
+        return last_seen
+    
+    def drop(self, session_id):
+        """Delete every layer of a session and forget it"""
+        prefix = SessionLayers.qualified("", session_id)
+        removed = 0
+        for key in LAYER_STORE.keys():
+            if key.startswith(prefix):
+                try:
+                    del LAYER_STORE[key]
+                except KeyError:
+                    continue  # Removed concurrently
+                invalidate_derived(key)
+                removed += 1
+        removed += len(LOADED_RASTERS.drop_session(session_id))
+        DISSOLVE_CACHE.drop_session(session_id)
+        with self.lock:
+            self.sessions.pop(session_id, None)
+        if self.activity_dir is not None:
+            (self.activity_dir / session_id).unlink(missing_ok=True)
+        return removed
+    
+    def prune(self, session_id, cutoff):
+        """Delete the layers and rasters of a session created before `cutoff`; returns how many"""
+        prefix = SessionLayers.qualified("", session_id)
+        removed = []
+        for key in LAYER_STORE.keys():
+            metadata = LAYER_STORE.metadata(key) if key.startswith(prefix) else None
+            if metadata is None or metadata["created"] >= cutoff:
+                continue
+            try:
+                del LAYER_STORE[key]
+            except KeyError:
+                continue  # Removed concurrently
+            invalidate_derived(key)
+            removed.append(key[len(prefix):])
+        removed += LOADED_RASTERS.drop_session(session_id, created_before=cutoff)
+        return len(removed)
+    
+    def expire(self, busy=()):
+        """
+        Drop sessions idle for longer than the TTL (except DEFAULT_SESSION and
+        `busy` ones), and the DEFAULT_SESSION layers older than its max age.
+        """
+        if self.default_max_age > 0 and DEFAULT_SESSION not in busy:
+            removed = self.prune(DEFAULT_SESSION, time.time() - self.default_max_age)
+            if removed:
+                logger.info(f"Removed {removed} layers older than {self.default_max_age:.0f}s from session '{DEFAULT_SESSION}'")
+        if self.ttl <= 0:
+            return []
+        with self.lock:
+            known = set(self.sessions)
+        known |= {split_layer_key(key)[0] for key in LAYER_STORE.keys()}
+        known |= {split_layer_key(key)[0] for key in LOADED_RASTERS.all_keys()}
+        cutoff = time.time() - self.ttl
+        expired = [session_id for session_id in known
+                   if session_id != DEFAULT_SESSION and session_id not in busy and self._last_activity(session_id) < cutoff]
+        for session_id in expired:
+            removed = self.drop(session_id)
+            logger.info(f"Session '{session_id}' expired, removed {removed} layers")
+        return expired
+    
+    def info(self, session_id):
+        session = self.touch(session_id)
+        used = sum(self.usage(session_id).values())
+        return {
+            "session_id": session_id,
+            "layers": len(LOADED_LAYERS),
+            "rasters": len(LOADED_RASTERS.keys()),
+            "layer_bytes": used,
+            "max_layers": self.max_layers,
+            "memory_quota_bytes": self.memory_quota,
+            "expires_at": None if session_id == DEFAULT_SESSION or self.ttl <= 0 else session.last_seen + self.ttl,
+        }
+
+SESSIONS = SessionManager(activity_dir=LAYER_SHARED_DIR / "sessions" if LAYER_BACKEND == "shared" else None)
+
+class SessionMiddleware:
+    """
+    Sets CURRENT_SESSION for each request from the X-Session-ID header (or a
+    `session` query parameter, for tile URLs used directly by map clients).
+    """
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        
+        headers = dict(scope.get("headers") or [])
+        session_id = headers.get(b"x-session-id", b"").decode("latin-1")
+        if not session_id:
+            query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+            session_id = query.get("session", [DEFAULT_SESSION])[0]
+        if not SESSION_ID_PATTERN.match(session_id):
+            response = JSONResponse(status_code=400, content={"status": "error", "message": "Invalid session ID"})
+            return await response(scope, receive, send)
+        
+        SESSIONS.touch(session_id)
+        token = CURRENT_SESSION.set(session_id)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            CURRENT_SESSION.reset(token)
 
-# Configure logging
+app.add_middleware(SessionMiddleware)
+
+# Media types understood by the layer transport (picked via the Accept header)
+GEOJSON_MEDIA_TYPE = "application/geo+json"
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+FLATGEOBUF_MEDIA_TYPE = "application/flatgeobuf"
+
+# Number of features encoded per chunk when streaming GeoJSON
+GEOJSON_CHUNK_SIZE = 5000
+
+# Vector tile settings
+MVT_MEDIA_TYPE = "application/vnd.mapbox-vector-tile"
+TILE_EXTENT = 4096  # Tile coordinate space used by the MVT encoder
+TILE_BUFFER = 64  # Extra tile units clipped around each tile to hide seams
+TILE_MAX_ZOOM = 22
+TILE_SIZE_PIXELS = 256  # Screen size of a web map tile, for pixel tolerances
+TILE_CACHE_SIZE = int(os.getenv("TILE_CACHE_SIZE", "512"))  # Tiles kept per layer
+# Web Mercator copies of layers kept for tiles and /query, on top of LAYER_MEMORY_BUDGET
+TILE_PROJECTED_CACHE_BYTES = int(float(os.getenv("TILE_PROJECTED_CACHE_MB", "256")) * 1024 * 1024)
+WEB_MERCATOR_HALF_WORLD = 20037508.342789244
+
+# Configure logging. Per-call DEBUG logs (payload and key dumps) are only
+# written for a sample of calls, DEBUG_LOG_SAMPLE_RATE (0 = never, 1 = always)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+DEBUG_LOG_SAMPLE_RATE = float(os.getenv("DEBUG_LOG_SAMPLE_RATE", "0"))
 logging.basicConfig(
-    level=logging.DEBUG,
+    level=LOG_LEVEL,
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
+if DEBUG_LOG_SAMPLE_RATE > 0:
+    logger.setLevel(logging.DEBUG)
+
+def debug_sampled():
+    """Whether this call should write its DEBUG logs"""
+    return DEBUG_LOG_SAMPLE_RATE > 0 and random.random() < DEBUG_LOG_SAMPLE_RATE
+
+# Metrics, exported on /metrics in the Prometheus text format
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+STAGE_SECONDS = Histogram(
+    "gis_stage_seconds", "Time spent in each request stage", ["stage"], buckets=STAGE_BUCKETS
+)
+GIS_FUNCTION_SECONDS = Histogram(
+    "gis_function_seconds", "Run time of GIS functions", ["function", "status"], buckets=STAGE_BUCKETS
+)
+PLAN_STEP_SECONDS = Histogram(
+    "gis_plan_step_seconds", "Duration of agent plan steps", ["action", "status"], buckets=STAGE_BUCKETS
+)
+LLM_REQUEST_SECONDS = Histogram(
+    "gis_llm_request_seconds", "Latency of planner LLM calls", ["model", "status"], buckets=STAGE_BUCKETS
+)
+PLANNER_DECISIONS = Counter("gis_planner_decisions", "Plans by the path that produced them", ["planner"])
+
+def instrumented(func):
+    """Record the run time of a GIS function in GIS_FUNCTION_SECONDS"""
+    histogram_ok = GIS_FUNCTION_SECONDS.labels(func.__name__, "ok")
+    histogram_error = GIS_FUNCTION_SECONDS.labels(func.__name__, "error")
+    
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            histogram_error.observe(time.perf_counter() - started)
+            raise
+        histogram_ok.observe(time.perf_counter() - started)
+        return result
+    return wrapper
+
+METRICS_PUBLISH_INTERVAL = float(os.getenv("METRICS_PUBLISH_INTERVAL", "15"))
+
+def store_stat_samples():
+    """
+    Counters kept by the layer store and the caches of this process.
+    
+    Returns:
+        List of (metric name, help, "gauge" or "counter", label names, label values, value)
+    """
+    stats = LAYER_STORE.stats()
+    samples = [
+        ("gis_layer_store_layers", "Layers in the store", "gauge", ["state"], [state], stats[key])
+        for state, key in (("memory", "layers_in_memory"), ("spilled", "layers_spilled"), ("spilling", "layers_spilling"))
+    ]
+    samples += [
+        ("gis_layer_store_memory_bytes", "Estimated size of in-memory layers", "gauge", [], [], stats["memory_bytes"]),
+        ("gis_layer_store_budget_bytes", "Memory budget of the layer store", "gauge", [], [], stats["budget_bytes"]),
+    ]
+    samples += [(f"gis_layer_store_{name}", f"Layer store {name}", "counter", [], [], stats[name]) for name in ("hits", "misses", "spills")]
+    for cache_name, cache in (("result", RESULT_CACHE), ("plan", PLAN_CACHE), ("raster_tile", RASTER_TILE_CACHE)):
+        cache_stats = cache.stats()
+        for result, key in (("hit", "hits"), ("miss", "misses")):
+            samples.append((f"gis_{cache_name}_cache_lookups", f"{cache_name} cache lookups", "counter", ["result"], [result], cache_stats[key]))
+    samples += [
+        ("gis_raster_tile_cache_bytes", "Size of cached raster tiles", "gauge", [], [], RASTER_TILE_CACHE.stats()["bytes"]),
+        ("gis_sessions", "Sessions known to this process", "gauge", [], [], len(SESSIONS.sessions)),
+    ]
+    return samples
+
+class StoreStatsCollector:
+    """Exports the counters kept by the layer store and the caches at scrape time (single process)"""
+    
+    def describe(self):
+        # The stores are created further down; don't collect at registration
+        return []
+    
+    def collect(self):
+        families = {}
+        for name, documentation, kind, label_names, label_values, value in store_stat_samples():
+            family = families.get(name)
+            if family is None:
+                family_class = GaugeMetricFamily if kind == "gauge" else CounterMetricFamily
+                family = families[name] = family_class(name, documentation, labels=label_names)
+            family.add_metric(label_values, value)
+        yield from families.values()
+
+class MultiprocessStoreStats:
+    """
+    The same numbers as StoreStatsCollector, written as multiprocess metrics.
+    
+    With several workers a scrape is answered by one of them, so a collector
+    would only report that worker's store. Instead every worker publishes its
+    numbers every METRICS_PUBLISH_INTERVAL seconds (and on each scrape it
+    answers): gauges are summed over the live workers (the session count
+    takes the largest, sessions are shared) and counters are incremented by
+    what changed since the last publish.
+    """
+    
+    GAUGE_MODES = {"gis_sessions": "livemax"}
+    
+    def __init__(self):
+        self.metrics = {}
+        self.published = {}  # Counter values already added to the metric files
+        self.lock = threading.Lock()
+    
+    def publish(self):
+        with self.lock:
+            for name, documentation, kind, label_names, label_values, value in store_stat_samples():
+                metric = self.metrics.get(name)
+                if metric is None:
+                    if kind == "gauge":
+                        metric = Gauge(name, documentation, label_names, registry=None,
+                                       multiprocess_mode=self.GAUGE_MODES.get(name, "livesum"))
+                    else:
+                        metric = Counter(name, documentation, label_names, registry=None)
+                    self.metrics[name] = metric
+                child = metric.labels(*label_values) if label_names else metric
+                if kind == "gauge":
+                    child.set(value)
+                    continue
+                key = (name, tuple(label_values))
+                delta = value - self.published.get(key, 0)
+                if delta > 0:
+                    child.inc(delta)
+                    self.published[key] = value
+
+if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+    # Several uvicorn workers: aggregate the per-process metric files
+    METRICS_REGISTRY = CollectorRegistry()
+    multiprocess.MultiProcessCollector(METRICS_REGISTRY)
+    STORE_STATS = MultiprocessStoreStats()
+else:
+    METRICS_REGISTRY = REGISTRY
+    METRICS_REGISTRY.register(StoreStatsCollector())
+    STORE_STATS = None
 
 class CommandRequest(BaseModel):
     command: str
+    include_geojson: bool = True  # False: only return the tile URL/bbox of result layers
 
 class GISQueryRequest(BaseModel):
     query: str
     context: Dict[str, Any] = {}  # Optional additional context
+    include_geojson: bool = True  # False: only return the tile URL/bbox of result layers
+    model: Optional[str] = None  # One of AGENT_MODELS, DEFAULT_MODEL when omitted
+
+class OperationJobRequest(BaseModel):
+    operation: str  # A key of gis_operations, e.g. "buffer_layer"
+    params: Dict[str, Any] = {}
+    include_geojson: bool = True
 
 class AgentState(TypedDict):
     messages: Annotated[List[Dict[str, Any]], operator.add]
     actions: List[str]
     params_dict: Dict[str, Dict[str, Any]] 
+    params_list: List[Dict[str, Any]]  # Parameters of each action, in the same order
     results: List[Dict[str, Any]]
     intermediate_layers: List[str]
+    include_geojson: bool
+    planner: str  # "fast_path", "plan_cache" or "llm"
+    planner_ms: float
 
 # Dictionary of available GIS operations
 gis_operations = {
@@ -78,192 +1203,693 @@ gis_operations = {
     "intersection": "Find the geometric intersection between two layers",
     "union": "Combine two layers into one",
     "clip": "Clip a layer using another layer as boundary",
-    "dissolve": "Merge features in a layer based on an attribute",
+    "dissolve": "Merge features in a layer based on an attribute: layer_name, column, aggregations (e.g. sum(population), mean(area), count)",
     "simplify": "Simplify geometries in a layer",
     "reproject_layer": "Change the coordinate system of a layer",
     "points_within_polygon": "Find points that fall within polygons",
-    "get_layers_info": "List all layer information"
+    "get_layers_info": "List all layer information",
+    "zonal_statistics": "Raster statistics (count, sum, mean, min, max) per polygon: raster_name, zones_layer_name, band",
+    "clip_raster": "Clip a raster to the polygons of a layer: raster_name, clip_layer_name",
+    "resample_raster": "Reproject and/or resample a raster: raster_name, target_crs, resolution, resampling"
 }
 
 class OperationDependencyTracker:
-    """Tracks GIS operations and their dependencies for chaining multi-step workflows"""
+    """
+    Tracks GIS operations and their dependencies for chaining multi-step workflows.
+    
+    The operations form a DAG: an operation depends on every parameter that
+    names another operation, either by its ID ("Result_2") or by the layer it
+    writes (its `output_name`). Dependencies are linked once every operation
+    is added, indexed both ways, and each operation keeps a count of
+    unfinished dependencies, so finding the next runnable operations is
+    proportional to the number of operations that just became ready rather
+    than a rescan of the whole plan.
+    """
     
     def __init__(self):
         self.operations = []
+        self.operations_by_id = {}
+        self.references = {}  # Operation ID or output layer name -> operation ID
         self.dependencies = {}
+        self.dependents = {}
+        self.remaining = {}
+        self.ready = []  # Heap of (plan position, operation ID) ready to run
         self.results = {}
+        self.id_mapping = {}
+        self.linked = False
     
-    def add_operation(self, operation_id, operation_type, params):
-        """Add an operation to the tracker"""
-        self.operations.append({
+    def add_operation(self, operation_id, operation_type, params, output_name=None):
+        """
+        Add an operation to the tracker (all of them before scheduling starts).
+        
+        Args:
+            operation_id: ID later steps can reference, e.g. "Result_1"
+            operation_type: Name of the GIS function
+            params: Its parameters
+            output_name: Name of the layer the operation will create, if known
+        """
+        op = {
             "id": operation_id,
             "type": operation_type,
             "params": params,
-            "status": "pending"
-        })
-        
-        # Track dependencies by analyzing parameters
-        self.dependencies[operation_id] = []
-        for param_name, param_value in params.items():
-            if isinstance(param_value, str) and param_value.startswith("Result_"):
-                self.dependencies[operation_id].append(param_value)
+            "output_name": output_name,
+            "status": "pending",
+            "position": len(self.operations)
+        }
+        self.operations.append(op)
+        self.operations_by_id[operation_id] = op
+        self.references[operation_id] = operation_id
+        if output_name is not None:
+            self.references[output_name] = operation_id
+    
+    def _link(self):
+        """Resolve each operation's parameters to the operations they depend on"""
+        if self.linked:
+            return
+        self.linked = True
+        for op in self.operations:
+            operation_id = op["id"]
+            dependencies = self.dependencies[operation_id] = []
+            for param_value in op["params"].values():
+                if not isinstance(param_value, str):
+                    continue
+                dependency = self.references.get(param_value)
+                if dependency is None and param_value.startswith("Result_"):
+                    dependency = param_value  # No such step: the operation can never run
+                if dependency is not None and dependency not in dependencies:
+                    dependencies.append(dependency)
+                    self.dependents.setdefault(dependency, []).append(operation_id)
+            
+            self.remaining[operation_id] = sum(1 for dep in dependencies if dep not in self.results)
+            if self.remaining[operation_id] == 0:
+                heapq.heappush(self.ready, (op["position"], operation_id))
     
     def get_executable_operations(self):
         """Get operations that can be executed (all dependencies satisfied)"""
-        executable = []
-        for op in self.operations:
-            if op["status"] != "pending":
-                continue
-                
-            deps = self.dependencies[op["id"]]
-            if all(dep in self.results for dep in deps):
-                # All dependencies are satisfied
-                executable.append(op)
+        self._link()
+        return [self.operations_by_id[operation_id] for _, operation_id in sorted(self.ready)
+                if self.operations_by_id[operation_id]["status"] == "pending"]
+    
+    def pop_executable_operations(self, limit=None):
+        """
+        Take up to `limit` runnable operations and mark them as running.
         
-        return executable
+        Args:
+            limit: Maximum number of operations to take (all when None)
+            
+        Returns:
+            The operations, in plan order
+        """
+        self._link()
+        taken = []
+        while self.ready and (limit is None or len(taken) < limit):
+            _, operation_id = heapq.heappop(self.ready)
+            op = self.operations_by_id[operation_id]
+            if op["status"] == "pending":
+                op["status"] = "running"
+                taken.append(op)
+        return taken
     
     def mark_completed(self, operation_id, result):
         """Mark an operation as completed and store its result"""
-        for op in self.operations:
-            if op["id"] == operation_id:
-                op["status"] = "completed"
-                break
-                
+        op = self.operations_by_id.get(operation_id)
+        if op is not None:
+            op["status"] = "completed"
+        
+        if operation_id in self.results:
+            return
         self.results[operation_id] = result
+        
+        # Release the operations that were only waiting on this one
+        for dependent_id in self.dependents.get(operation_id, []):
+            self.remaining[dependent_id] -= 1
+            if self.remaining[dependent_id] == 0:
+                heapq.heappush(self.ready, (self.operations_by_id[dependent_id]["position"], dependent_id))
+    
+    def topological_order(self):
+        """
+        Order the operations so every operation comes after its dependencies.
+        
+        Returns:
+            (ordered, blocked): operation IDs in execution order, and the IDs of
+            operations that can never run (cycles or references to unknown results)
+        """
+        self._link()
+        remaining = {op["id"]: sum(1 for dep in self.dependencies[op["id"]] if dep not in self.results)
+                     for op in self.operations}
+        queue = deque(op["id"] for op in self.operations if remaining[op["id"]] == 0)
+        ordered = []
+        while queue:
+            operation_id = queue.popleft()
+            ordered.append(operation_id)
+            for dependent_id in self.dependents.get(operation_id, []):
+                remaining[dependent_id] -= 1
+                if remaining[dependent_id] == 0:
+                    queue.append(dependent_id)
+        
+        placed = set(ordered)
+        blocked = [op["id"] for op in self.operations if op["id"] not in placed]
+        return ordered, blocked
     
     def resolve_dependencies(self, params):
         """Resolve references to operation results in parameters"""
         resolved_params = {}
         for key, value in params.items():
+            operation_id = self.references.get(value) if isinstance(value, str) else None
             # If value is a reference to an operation result
-            if isinstance(value, str) and value in self.results:
+            if operation_id in self.results:
                 # Use the mapped layer ID if available
-                if hasattr(self, 'id_mapping') and value in self.id_mapping:
-                    resolved_params[key] = self.id_mapping[value]
+                if operation_id in self.id_mapping:
+                    resolved_params[key] = self.id_mapping[operation_id]
                 else:
-                    resolved_params[key] = self.results[value]
+                    resolved_params[key] = self.results[operation_id]
             else:
                 resolved_params[key] = value
         return resolved_params
 
-@app.get("/")
-def read_root():
-    return {"message": "Hello, GIS World!"}
+def _json_default(value):
+    """Fallback for values orjson can't serialize natively (pandas NA, Decimal, ...)"""
+    try:
+        if gpd.pd.isna(value):
+            return None
+    except (TypeError, ValueError):
+        pass
+    return str(value)
 
-@app.post("/upload/")
-async def upload_shapefiles(files: list[UploadFile] = File(...)):
-    file_dict = {}
+def _dumps(value):
+    return orjson.dumps(
+        value,
+        default=_json_default,
+        option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+    )
 
-    # Organize files by their extensions
-    for file in files:
-        file_extension = file.filename.split('.')[-1]
-        if file_extension not in file_dict:
-            file_dict[file_extension] = []
-        file_dict[file_extension].append(file)
-    
-    # Ensure all required file types are present
-    required_file_types = ['shp', 'shx', 'dbf','prj']
-    missing_files = [f"{file}" for file in required_file_types if file not in file_dict]
-    
-    if missing_files:
-        return {"error": f"Missing shapefile components: {', '.join(missing_files)}"}
-    
-    # Save the uploaded files
-    for files in file_dict.values():
-        for file in files:
-            file_location = UPLOAD_DIR / file.filename
-            with open(file_location, "wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
-    
-    # Read the .shp file using geopandas
-    try:
-        shp_file = [file for file in file_dict.get('shp', [])][0]
-        shp_file_location = UPLOAD_DIR / shp_file.filename
-        gdf = gpd.read_file(shp_file_location)
-        
-        # Store the layer in memory
-        layer_name = f"Layer {len(LOADED_LAYERS) + 1}"
-        LOADED_LAYERS[layer_name] = gdf
-
-        # Convert GeoDataFrame to GeoJSON - ensure it's a proper GeoJSON structure
-        geojson_data = json.loads(gdf.to_json())
-        
-        # Make sure we have a valid GeoJSON structure
-        if "type" not in geojson_data or "features" not in geojson_data:
-            # Create a proper GeoJSON structure if it's missing
-            geojson_data = {
-                "type": "FeatureCollection",
-                "features": geojson_data if isinstance(geojson_data, list) else []
-            }
+class LayerJSONResponse(Response):
+    """
+    JSON response rendered with orjson.
+
+    GeoJSON wrapped in orjson.Fragment is copied into the body as-is, so layers
+    embedded in a response envelope are never turned back into Python dicts.
+    """
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return _dumps(content)
+
+def iter_geojson_features(gdf, chunk_size=GEOJSON_CHUNK_SIZE):
+    """
+    Encode the features of a GeoDataFrame as GeoJSON, chunk by chunk.
+
+    Geometries are written by shapely's vectorized GeoJSON writer and properties
+    by orjson, so no intermediate FeatureCollection dict is ever built.
+
+    Args:
+        gdf: The GeoDataFrame to encode
+        chunk_size: Number of features per yielded chunk
+
+    Yields:
+        bytes: Comma separated encoded features
+    """
+    geometry_name = gdf.geometry.name
+    properties = gdf.drop(columns=[geometry_name])
+    geometries = np.asarray(gdf.geometry.array, dtype=object)
+    feature_ids = gdf.index.astype(str)
+
+    for start in range(0, len(gdf), chunk_size):
+        stop = start + chunk_size
+        encoded_geometries = shapely.to_geojson(geometries[start:stop])
+        # to_dict("records") returns no rows at all for a frame without columns
+        records = properties.iloc[start:stop].to_dict("records") if len(properties.columns) else [{}] * len(encoded_geometries)
+
+        features = []
+        for feature_id, record, geometry in zip(feature_ids[start:stop], records, encoded_geometries):
+            features.append(
+                b'{"id":' + _dumps(feature_id)
+                + b',"type":"Feature","properties":' + _dumps(record)
+                + b',"geometry":' + (geometry.encode() if geometry is not None else b"null")
+                + b"}"
+            )
+        yield b",".join(features)
+
+def iter_geojson_bytes(gdf, chunk_size=GEOJSON_CHUNK_SIZE):
+    """Stream a GeoDataFrame as a GeoJSON FeatureCollection"""
+    yield b'{"type":"FeatureCollection","features":['
+    for i, chunk in enumerate(iter_geojson_features(gdf, chunk_size)):
+        yield chunk if i == 0 else b"," + chunk
+    yield b"]}"
+
+def timed_chunks(chunks, stage):
+    """
+    Pass chunks through, observing the time spent producing them (not the
+    time the client takes to receive them) as one STAGE_SECONDS sample.
+    """
+    chunks = iter(chunks)
+    elapsed = 0.0
+    while True:
+        started = time.perf_counter()
+        chunk = next(chunks, None)
+        elapsed += time.perf_counter() - started
+        if chunk is None:
+            break
+        yield chunk
+    STAGE_SECONDS.labels(stage).observe(elapsed)
+
+def geojson_bytes(gdf):
+    """Encode a GeoDataFrame as GeoJSON FeatureCollection bytes"""
+    with STAGE_SECONDS.labels("serialize_geojson").time():
+        return b"".join(iter_geojson_bytes(gdf))
+
+def geojson_fragment(gdf):
+    """Pre-encoded GeoJSON that can be embedded in a LayerJSONResponse"""
+    return orjson.Fragment(geojson_bytes(gdf))
+
+def arrow_ipc_bytes(gdf):
+    """Encode a GeoDataFrame as an Arrow IPC stream with GeoArrow geometry"""
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise HTTPException(status_code=406, detail="Arrow output requires pyarrow")
+
+    table = pa.table(gdf.to_arrow(geometry_encoding="geoarrow"))
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+def flatgeobuf_bytes(gdf):
+    """Encode a GeoDataFrame as FlatGeobuf"""
+    buffer = io.BytesIO()
+    gdf.to_file(buffer, driver="FlatGeobuf", engine="pyogrio")
+    return buffer.getvalue()
+
+def negotiate_layer_format(request: Optional[Request]):
+    """Pick the layer encoding from the request's Accept header (GeoJSON by default)"""
+    accept = request.headers.get("accept", "") if request is not None else ""
+    for media_type in (ARROW_MEDIA_TYPE, FLATGEOBUF_MEDIA_TYPE):
+        if media_type in accept:
+            return media_type
+    return GEOJSON_MEDIA_TYPE
+
+def layer_response(gdf, request: Optional[Request] = None):
+    """
+    Build the HTTP response for a whole layer.
+
+    Clients asking for Arrow IPC or FlatGeobuf get the binary encoding, everyone
+    else (including the current frontends) gets streamed GeoJSON.
+    """
+    media_type = negotiate_layer_format(request)
+    if media_type == ARROW_MEDIA_TYPE:
+        with STAGE_SECONDS.labels("serialize_arrow").time():
+            return Response(content=arrow_ipc_bytes(gdf), media_type=media_type)
+    if media_type == FLATGEOBUF_MEDIA_TYPE:
+        with STAGE_SECONDS.labels("serialize_flatgeobuf").time():
+            return Response(content=flatgeobuf_bytes(gdf), media_type=media_type)
+    return StreamingResponse(timed_chunks(iter_geojson_bytes(gdf), "serialize_geojson"), media_type=GEOJSON_MEDIA_TYPE)
+
+class LayerTileCache:
+    """
+    Per-layer vector tile cache.
+
+    Keeps layers reprojected to Web Mercator, in an LRU bounded by their
+    estimated size, plus an LRU of encoded tiles per layer. Everything cached
+    for a layer is dropped when the layer changes.
+    """
+
+    def __init__(self, max_tiles=TILE_CACHE_SIZE, max_projected_bytes=TILE_PROJECTED_CACHE_BYTES):
+        self.max_tiles = max_tiles
+        self.max_projected_bytes = max_projected_bytes
+        self.projected = OrderedDict()  # layer name -> (EPSG:3857 copy, estimated bytes)
+        self.projected_bytes = 0
+        self.tiles = {}
+        self.versions = {}
+        self.lock = threading.Lock()
+
+    def invalidate(self, layer_name):
+        """Forget everything cached for a layer"""
+        with self.lock:
+            self.versions[layer_name] = self.versions.get(layer_name, 0) + 1
+            _, size = self.projected.pop(layer_name, (None, 0))
+            self.projected_bytes -= size
+            self.tiles.pop(layer_name, None)
+
+    def version(self, layer_name):
+        """Current version of a layer, bumped every time it is invalidated"""
+        with self.lock:
+            return self.versions.get(layer_name, 0)
+
+    def get_projected(self, layer_name, gdf, version=None):
+        """
+        Get the layer in EPSG:3857, reprojecting it on first use.
+
+        Args:
+            layer_name: Name of the layer
+            gdf: The layer
+            version: version() read before `gdf` was fetched (read here when None).
+                The copy is only cached if the layer wasn't replaced since.
+        """
+        with self.lock:
+            if version is None:
+                version = self.versions.get(layer_name, 0)
+            cached = self.projected.get(layer_name)
+            if cached is not None:
+                self.projected.move_to_end(layer_name)
+                return cached[0]
+
+        if gdf.crs is None:
+            raise HTTPException(status_code=400, detail=f"Layer '{layer_name}' has no CRS and can't be tiled")
+        projected = gdf.to_crs(epsg=3857)
+        # Build the spatial index up front so tile requests only do bbox queries
+        projected.sindex
+        size = estimate_layer_bytes(projected)
+        if size > self.max_projected_bytes:
+            return projected
+        with self.lock:
+            # The layer changed while it was reprojected, don't cache stale data
+            if self.versions.get(layer_name, 0) != version or layer_name in self.projected:
+                return projected
+            self.projected[layer_name] = (projected, size)
+            self.projected_bytes += size
+            while self.projected_bytes > self.max_projected_bytes:
+                _, (_, evicted_size) = self.projected.popitem(last=False)
+                self.projected_bytes -= evicted_size
+        return projected
+
+    def get_tile(self, layer_name, key):
+        with self.lock:
+            layer_tiles = self.tiles.get(layer_name)
+            if layer_tiles is None or key not in layer_tiles:
+                return None
+            layer_tiles.move_to_end(key)
+            return layer_tiles[key]
+
+    def put_tile(self, layer_name, key, tile, version):
+        with self.lock:
+            # The layer changed while this tile was rendered, don't cache stale data
+            if self.versions.get(layer_name, 0) != version:
+                return
+            layer_tiles = self.tiles.setdefault(layer_name, OrderedDict())
+            layer_tiles[key] = tile
+            while len(layer_tiles) > self.max_tiles:
+                layer_tiles.popitem(last=False)
+
+TILE_CACHE = LayerTileCache()
+
+def register_layer(layer_name, gdf, lineage=None):
+    """
+    Store a layer in LOADED_LAYERS (the current session), within its quotas.
+
+    Use this instead of assigning to LOADED_LAYERS directly so that anything
+    derived from the previous version of the layer (tiles, ...) is invalidated.
+    `lineage` (operation, params, inputs) is kept in the layer catalog.
+    """
+    SESSIONS.store_layer(layer_name, gdf, lineage)
+    invalidate_derived(LOADED_LAYERS.qualified(layer_name))
+
+def invalidate_derived(layer_key):
+    """Drop tiles and memoized results computed from a layer (by LAYER_STORE key)"""
+    TILE_CACHE.invalidate(layer_key)
+    RESULT_CACHE.invalidate_layer(layer_key)
+
+# Layers replaced by another worker (shared backend) invalidate the same way
+LAYER_STORE.change_listeners.append(invalidate_derived)
+
+def tile_bounds(z, x, y):
+    """Web Mercator bounds (minx, miny, maxx, maxy) of an XYZ tile"""
+    tile_size = 2 * WEB_MERCATOR_HALF_WORLD / (2 ** z)
+    minx = -WEB_MERCATOR_HALF_WORLD + x * tile_size
+    maxy = WEB_MERCATOR_HALF_WORLD - y * tile_size
+    return minx, maxy - tile_size, minx + tile_size, maxy
+
+def render_vector_tile(layer_name, gdf, z, x, y, version=None):
+    """
+    Encode one Mapbox Vector Tile for a layer.
+
+    Features are picked with the layer's spatial index, clipped to the tile
+    (plus a small buffer) and simplified to roughly one tile unit at this zoom.
+
+    Args:
+        layer_name: Name of the layer, also used as the MVT layer name
+        gdf: The layer's GeoDataFrame
+        z, x, y: Tile coordinates
+        version: TILE_CACHE version of the layer, read before `gdf` was fetched
+
+    Returns:
+        bytes: The encoded tile (empty for tiles without features)
+    """
+    import mapbox_vector_tile
+
+    projected = TILE_CACHE.get_projected(LOADED_LAYERS.qualified(layer_name), gdf, version)
+    minx, miny, maxx, maxy = tile_bounds(z, x, y)
+    unit = (maxx - minx) / TILE_EXTENT
+    pad = unit * TILE_BUFFER
+
+    candidates = projected.sindex.query(shapely.box(minx - pad, miny - pad, maxx + pad, maxy + pad))
+    if len(candidates) == 0:
+        return b""
+
+    subset = projected.iloc[np.sort(candidates)]
+    geometries = shapely.clip_by_rect(
+        np.asarray(subset.geometry.array, dtype=object),
+        minx - pad, miny - pad, maxx + pad, maxy + pad
+    )
+    geometries = shapely.simplify(geometries, unit, preserve_topology=True)
+    keep = ~(shapely.is_empty(geometries) | shapely.is_missing(geometries))
+    if not keep.any():
+        return b""
+
+    properties = subset.drop(columns=[subset.geometry.name])[keep]
+    features = []
+    for geometry, record in zip(geometries[keep], properties.to_dict("records")):
+        features.append({
+            "geometry": geometry,
+            # MVT attributes must be plain scalars; skip nulls and stringify the rest
+            "properties": {
+                key: value if isinstance(value, (bool, int, float, str)) else str(value)
+                for key, value in record.items()
+                if not (value is None or (isinstance(value, float) and np.isnan(value)))
+            }
+        })
+
+    return mapbox_vector_tile.encode(
+        [{"name": layer_name, "features": features}],
+        default_options={
+            "quantize_bounds": (minx, miny, maxx, maxy),
+            "extents": TILE_EXTENT,
+        }
+    )
+
+def layer_tile_url(layer_name):
+    """URL template of the vector tiles for a layer"""
+    url = f"/tiles/{quote(layer_name)}/{{z}}/{{x}}/{{y}}.mvt"
+    session_id = CURRENT_SESSION.get()
+    if session_id != DEFAULT_SESSION:
+        # Map clients fetch tiles without our headers
+        url += f"?session={quote(session_id)}"
+    return url
+
+def layer_reference(layer_name, gdf):
+    """Lightweight description of a layer: tile URL and WGS84 bbox instead of geometry"""
+    bounds = gdf.total_bounds
+    if gdf.crs is not None and not gdf.crs.equals("EPSG:4326") and len(gdf) > 0:
+        transformer = pyproj.Transformer.from_crs(gdf.crs, "EPSG:4326", always_xy=True)
+        bounds = transformer.transform_bounds(*bounds)
+
+    return {
+        "layer_name": layer_name,
+        "tile_url": layer_tile_url(layer_name),
+        "bbox": [None if np.isnan(v) else float(v) for v in bounds],
+        "feature_count": len(gdf),
+    }
+
+@app.get("/")
+def read_root():
+    return {"message": "Hello, GIS World!"}
+
+def parse_bbox(bbox):
+    """Parse a "minx,miny,maxx,maxy" string into a tuple of floats"""
+    values = [float(v) for v in bbox.split(",")]
+    if len(values) != 4:
+        raise ValueError("bbox must be 'minx,miny,maxx,maxy'")
+    return tuple(values)
+
+async def save_upload(file: UploadFile, target_dir: Path):
+    """
+    Stream an uploaded file to disk in UPLOAD_CHUNK_SIZE pieces.
+    
+    Only the base name of the uploaded file is kept, and every upload gets its
+    own directory, so concurrent uploads of files with the same name don't
+    overwrite each other.
+    """
+    target = target_dir / Path(file.filename).name
+    started = time.perf_counter()
+    with open(target, "wb") as buffer:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            await run_in_threadpool(buffer.write, chunk)
+    STAGE_SECONDS.labels("upload_write").observe(time.perf_counter() - started)
+    return target
+
+def find_zipped_shapefile(zip_path):
+    """
+    GDAL /vsizip/ path of the shapefile inside a zip archive.
+    
+    Only the archive's directory is read to find the .shp (it may sit in a
+    subfolder, like uploads/02-Cities.zip); nothing is extracted.
+    """
+    with zipfile.ZipFile(zip_path) as archive:
+        members = [name for name in archive.namelist() if not name.endswith("/")]
+    
+    parts = {}
+    for name in members:
+        stem, _, extension = name.rpartition(".")
+        parts.setdefault(stem, {})[extension.lower()] = name
+    
+    shapefiles = [stem for stem, extensions in parts.items() if "shp" in extensions]
+    if not shapefiles:
+        raise ValueError("No .shp file found in the zip archive")
+    
+    stem = shapefiles[0]
+    missing_files = [ext for ext in REQUIRED_SHAPEFILE_PARTS if ext not in parts[stem]]
+    if missing_files:
+        raise ValueError(f"Missing shapefile components: {', '.join(missing_files)}")
+    
+    return f"/vsizip/{Path(zip_path).resolve()}/{parts[stem]['shp']}"
+
+def read_vector(path, bbox=None, columns=None, max_rows=None):
+    """
+    Read a vector dataset through pyogrio, using Arrow when pyarrow is installed.
+    
+    Args:
+        path: File path or GDAL virtual path (/vsizip/...)
+        bbox: Optional (minx, miny, maxx, maxy) filter, in the dataset's CRS
+        columns: Optional list of attribute columns to read
+        max_rows: Optional maximum number of features to read
+        
+    Returns:
+        GeoDataFrame
+    """
+    kwargs = {"engine": "pyogrio", "use_arrow": PYARROW_AVAILABLE}
+    if bbox is not None:
+        kwargs["bbox"] = bbox
+    if columns:
+        kwargs["columns"] = columns
+    if max_rows is not None:
+        kwargs["rows"] = max_rows
+    with STAGE_SECONDS.labels("read_file").time():
+        return gpd.read_file(path, **kwargs)
+
+@app.post("/upload/")
+async def upload_shapefiles(
+    request: Request,
+    files: list[UploadFile] = File(...),
+    include_geojson: bool = True,
+    bbox: Optional[str] = None,  # "minx,miny,maxx,maxy" in the layer's CRS
+    columns: Optional[str] = None,  # Comma separated attribute columns to keep
+    max_rows: Optional[int] = None,  # Read at most this many features
+):
+    file_dict = {}
+
+    # Organize files by their extensions
+    for file in files:
+        file_extension = file.filename.split('.')[-1].lower()
+        if file_extension not in file_dict:
+            file_dict[file_extension] = []
+        file_dict[file_extension].append(file)
+    
+    # Ensure all required file types are present (a zipped shapefile is checked once saved)
+    if 'zip' not in file_dict:
+        missing_files = [f"{file}" for file in REQUIRED_SHAPEFILE_PARTS if file not in file_dict]
+        
+        if missing_files:
+            return {"error": f"Missing shapefile components: {', '.join(missing_files)}"}
+    
+    try:
+        bbox_filter = parse_bbox(bbox) if bbox else None
+    except ValueError as e:
+        return {"error": f"Invalid bbox: {str(e)}"}
+    column_filter = [c.strip() for c in columns.split(",") if c.strip()] if columns else None
+    
+    # Each upload is written to its own directory
+    upload_dir = Path(tempfile.mkdtemp(prefix="upload-", dir=UPLOAD_DIR))
+    try:
+        # Save the uploaded files
+        saved = {}
+        for extension, uploaded in file_dict.items():
+            for file in uploaded:
+                saved.setdefault(extension, []).append(await save_upload(file, upload_dir))
         
-        return geojson_data
+        # Read the shapefile (directly out of the zip when one was uploaded)
+        if 'zip' in saved:
+            source = find_zipped_shapefile(saved['zip'][0])
+        else:
+            source = saved['shp'][0]
+        gdf = await run_gis(read_vector, source, bbox=bbox_filter, columns=column_filter, max_rows=max_rows)
+        
+        # Store the layer in memory
+        layer_name = SESSIONS.allocate_name("Layer")
+        register_layer(layer_name, gdf, {
+            "operation": "upload",
+            "params": {"files": [file.filename for file in files], "bbox": bbox, "columns": columns, "max_rows": max_rows},
+            "inputs": [],
+        })
+
+        # Tile-based clients only need to know where to fetch the layer from
+        if not include_geojson:
+            return LayerJSONResponse(layer_reference(layer_name, gdf))
+
+        # Stream the layer back in the encoding the client asked for
+        # (a GeoJSON FeatureCollection unless Arrow/FlatGeobuf was requested)
+        return layer_response(gdf, request)
     except Exception as e:
         return {"error": f"Error processing shapefile: {str(e)}"}
+    finally:
+        # The layer is in memory now, the uploaded files are no longer needed
+        shutil.rmtree(upload_dir, ignore_errors=True)
 
 @app.post("/execute-command/")
 async def execute_command(command_request: CommandRequest):
     command = command_request.command.strip()
     
-    # Create a dictionary of functions available to the command
-    available_functions = {
-        # GIS processing functions
-        "buffer_layer": buffer_layer,
-        "intersection": intersection,
-        "union": union_layers,
-        "clip": clip_layer,
-        "dissolve": dissolve_layer,
-        "simplify": simplify_layer,
-        "reproject_layer":reproject_layer,
-        "points_within_polygon":points_within_polygon,
-        
-        # Layer management
-        "get_layer": get_layer,
-        "list_layers": list_layers,
-        "layer_info": layer_info,
-        
-        # Import core modules that might be needed
-        "gpd": gpd,
-        "pd": gpd.pd,  # pandas is included with geopandas
-        
-        # Make loaded layers available
-        "layers": LOADED_LAYERS
-    }
-    
-    # Create sandbox for command execution
-    local_vars = available_functions.copy()
-    
-    # Capture stdout and stderr
-    stdout = io.StringIO()
-    stderr = io.StringIO()
     result = None
     geojson_data = None
+    layer_ref = None
     
     try:
-        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
-            # Execute the command
-            exec(f"result = {command}", globals(), local_vars)
-            
-            # Get the result from local variables
-            result = local_vars.get("result")
-            
-            # If result is a GeoDataFrame, convert to GeoJSON
-            if isinstance(result, gpd.GeoDataFrame):
-                # Store as a new layer
-                print("hehe")
-                new_layer_name = f"Result {len(LOADED_LAYERS) + 1}"
-                LOADED_LAYERS[new_layer_name] = result
-                print(f"Layers after adding new layer: {LOADED_LAYERS.keys()}")
-                # Convert to GeoJSON for the frontend
-                geojson_data = json.loads(result.to_json())
-                
-                # Add layer name to the output
-                stdout_content = f"Created new layer: {new_layer_name}\n" + stdout.getvalue()
+        # Parsing is cached per command text; evaluation runs off the event loop
+        result, run = await run_gis(run_command, command)
+        
+        # If result is a GeoDataFrame, convert to GeoJSON
+        if isinstance(result, gpd.GeoDataFrame):
+            # Reuse the layer name if the result is already loaded (e.g. a memoized result)
+            existing_layer_name = LOADED_LAYERS.name_of(result)
+            if existing_layer_name is not None:
+                new_layer_name = existing_layer_name
+                layer_message = f"Result is existing layer: {new_layer_name}"
             else:
-                stdout_content = stdout.getvalue()
+                # Store as a new layer
+                new_layer_name = SESSIONS.allocate_name("Result")
+                register_layer(new_layer_name, result, {
+                    "operation": "command",
+                    "params": {"command": command},
+                    "inputs": sorted({name for call in run.memoized_calls for name in call.input_layers}),
+                })
+                for call in run.memoized_calls:
+                    if call.result is result and call.key is not None:
+                        RESULT_CACHE.store(call.key, new_layer_name, call.input_layers)
+                if debug_sampled():
+                    logger.debug(f"Layers after adding new layer: {LOADED_LAYERS.keys()}")
+                layer_message = f"Created new layer: {new_layer_name}"
+            layer_ref = layer_reference(new_layer_name, result)
+            # Pre-encode the GeoJSON for the frontend
+            if command_request.include_geojson:
+                geojson_data = await run_gis(geojson_fragment, result)
+            
+            # Add layer name to the output
+            stdout_content = f"{layer_message}\n" + run.output.getvalue()
+        else:
+            stdout_content = run.output.getvalue()
                 
     except Exception as e:
         # Return the error message
-        return {"error": f"Error: {str(e)}\n{stderr.getvalue()}"}
+        return {"error": f"Error: {str(e)}"}
     
     # Format the result for display
     if result is not None and stdout_content.strip() == "":
@@ -277,11 +1903,86 @@ async def execute_command(command_request: CommandRequest):
     response = {"result": output}
     
     # Include GeoJSON data if available
-    if geojson_data:
+    if geojson_data is not None:
         response["geojson"] = geojson_data
+    if layer_ref is not None:
+        response["layer"] = layer_ref
+    
+    return LayerJSONResponse(response)
+
+# Large layers: buffer/simplify/reproject are split into spatially coherent
+# chunks and run in a process pool once a layer reaches either threshold
+PARTITION_FEATURE_THRESHOLD = int(os.getenv("PARTITION_FEATURE_THRESHOLD", "200000"))
+PARTITION_VERTEX_THRESHOLD = int(os.getenv("PARTITION_VERTEX_THRESHOLD", "5000000"))
+PARTITION_WORKERS = int(os.getenv("PARTITION_WORKERS", str(os.cpu_count() or 1)))
+PARTITION_CHUNKS_PER_WORKER = 4
+
+GEOMETRY_PROCESS_POOL = None
+GEOMETRY_PROCESS_POOL_LOCK = threading.Lock()
+
+def get_geometry_process_pool():
+    """Process pool for partitioned geometry work, started on first use"""
+    global GEOMETRY_PROCESS_POOL
+    with GEOMETRY_PROCESS_POOL_LOCK:
+        if GEOMETRY_PROCESS_POOL is None:
+            # spawn: forking a process that runs threads and an event loop isn't safe,
+            # and the workers only need the lightweight geometry_workers module
+            GEOMETRY_PROCESS_POOL = ProcessPoolExecutor(
+                max_workers=PARTITION_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return GEOMETRY_PROCESS_POOL
+
+def should_partition(gdf):
+    """Whether a layer is large enough for partitioned execution"""
+    if PARTITION_WORKERS < 2:
+        return False
+    if len(gdf) >= PARTITION_FEATURE_THRESHOLD:
+        return True
+    return int(shapely.get_num_coordinates(_geometry_array(gdf)).sum()) >= PARTITION_VERTEX_THRESHOLD
+
+def partitioned_geometry_op(gdf, operation, **params):
+    """
+    Apply a geometry_workers operation to a layer in the process pool.
+    
+    Features are ordered along a Hilbert curve so every chunk covers a compact
+    area, written as WKB into one shared memory block, processed chunk by chunk
+    in the workers and put back in the original order.
+    
+    Args:
+        gdf: The layer to process
+        operation: Name of the operation in geometry_workers.OPERATIONS
+        **params: Parameters of the operation
+        
+    Returns:
+        numpy array of the resulting geometries, aligned with gdf's rows
+    """
+    geometries = _geometry_array(gdf)
+    count = len(geometries)
+    
+    try:
+        order = np.argsort(gdf.geometry.hilbert_distance().values, kind="stable")
+    except Exception:
+        order = np.arange(count)  # Empty or missing geometries, keep the original order
     
-    return response
+    shm, offsets = geometry_workers.write_shared(geometries[order])
+    try:
+        pool = get_geometry_process_pool()
+        chunks = [chunk for chunk in np.array_split(np.arange(count), PARTITION_WORKERS * PARTITION_CHUNKS_PER_WORKER) if len(chunk)]
+        futures = [
+            pool.submit(geometry_workers.run_chunk, shm.name, offsets[chunk[0]:chunk[-1] + 2], operation, params)
+            for chunk in chunks
+        ]
+        
+        result = np.empty(count, dtype=object)
+        for chunk, future in zip(chunks, futures):
+            result[order[chunk]] = geometry_workers.decode_chunk(*future.result())
+        return result
+    finally:
+        shm.close()
+        shm.unlink()
 
+@instrumented
 def buffer_layer(layer_name, distance):
     
     if layer_name not in LOADED_LAYERS:
@@ -295,43 +1996,145 @@ def buffer_layer(layer_name, distance):
     
     # If already in a projected CRS, buffer directly
     buffered = layer.copy()
-    buffered['geometry'] = layer.geometry.buffer(distance_f)
+    if should_partition(layer):
+        buffered['geometry'] = gpd.GeoSeries(
+            partitioned_geometry_op(layer, "buffer", distance=distance_f), index=layer.index, crs=layer.crs
+        )
+    else:
+        buffered['geometry'] = layer.geometry.buffer(distance_f)
     
     return buffered
 
-def get_layer_metadata(layer):
-    if layer is None or len(layer) == 0:
-        return {"valid": False, "error": "Layer is empty or invalid."}
+# Columns with more rows than this get an approximate (HyperLogLog) distinct count
+EXACT_DISTINCT_LIMIT = int(os.getenv("EXACT_DISTINCT_LIMIT", "100000"))
+HYPERLOGLOG_PRECISION = 14  # 2**14 registers, about 0.8% standard error
+
+def hyperloglog_count(values, precision=HYPERLOGLOG_PRECISION):
+    """
+    Approximate number of distinct non-null values of a Series (HyperLogLog).
     
-    metadata = {
-        "valid": True,
-        "feature_count": len(layer),
-        "geometry_types": list(layer.geometry.geom_type.unique()),
-        "crs": str(layer.crs),
-        "bbox": layer.total_bounds.tolist() if layer.total_bounds is not None else None,
-        "attributes": {},
-        "numeric_stats": {},
-    }
+    Uses the 64-bit hashes pandas already computes for hashing objects, so it
+    works for any column type in one vectorized pass.
+    """
+    hashes = pd.util.hash_pandas_object(values.dropna(), index=False).values
+    if len(hashes) == 0:
+        return 0
+    
+    registers_count = 1 << precision
+    registers = np.zeros(registers_count, dtype=np.int64)
+    buckets = (hashes >> np.uint64(64 - precision)).astype(np.int64)
+    remainder = hashes & np.uint64((1 << (64 - precision)) - 1)
+    # Position of the leftmost 1 bit in the remaining (64 - precision) bits
+    bit_length = np.frexp(remainder.astype(np.float64))[1]
+    rank = (64 - precision) - bit_length + 1
+    np.maximum.at(registers, buckets, rank)
+    
+    alpha = 0.7213 / (1 + 1.079 / registers_count)
+    estimate = alpha * registers_count ** 2 / np.sum(np.power(2.0, -registers))
+    empty_registers = int(np.count_nonzero(registers == 0))
+    if estimate <= 2.5 * registers_count and empty_registers:
+        # Small range correction (linear counting)
+        estimate = registers_count * np.log(registers_count / empty_registers)
+    return int(round(estimate))
 
-    for col in layer.columns:
-        if col != "geometry":
-            dtype = str(layer[col].dtype)
+def _scalar(value):
+    """numpy/pandas scalar to a plain Python value"""
+    return value.item() if hasattr(value, "item") else value
+
+class LayerStats:
+    """
+    Statistics of one version of a layer.
+    
+    Everything cheap is computed in a single pass when the object is built:
+    geometry type counts, CRS, bounds, dtypes, samples and min/max/mean/std of
+    all numeric columns at once. Distinct counts are computed per column on
+    first use (exact for small layers, HyperLogLog above EXACT_DISTINCT_LIMIT)
+    and then kept. The object holds no reference to the layer itself.
+    """
+    
+    def __init__(self, layer):
+        geometry_name = layer.geometry.name
+        attributes = layer.drop(columns=[geometry_name])
+        
+        self.feature_count = len(layer)
+        self.columns = list(layer.columns)
+        self.geometry_type_counts = {str(k): int(v) for k, v in layer.geometry.geom_type.value_counts().items()}
+        self.crs = str(layer.crs)
+        self.bounds = [_scalar(v) for v in layer.total_bounds] if len(layer) else None
+        self.dtypes = {col: str(dtype) for col, dtype in attributes.dtypes.items()}
+        first_row = attributes.iloc[0] if len(attributes) else None
+        self.samples = {col: str(first_row[col])[:50] for col in attributes.columns} if first_row is not None else {}
+        
+        numeric = attributes.select_dtypes(include=["int64", "float64"])
+        self.numeric_stats = {}
+        if len(numeric.columns):
+            aggregated = numeric.agg(["min", "max", "mean", "std"])
+            self.numeric_stats = {
+                col: {stat: _scalar(aggregated.at[stat, col]) for stat in ("min", "max", "mean", "std")}
+                for col in numeric.columns
+            }
+        
+        self.distinct_counts = {}
+        self.lock = threading.Lock()
+    
+    def distinct_count(self, layer, column):
+        """(count, approximate) of distinct values in a column, computed once"""
+        with self.lock:
+            if column in self.distinct_counts:
+                return self.distinct_counts[column]
+        
+        if self.feature_count > EXACT_DISTINCT_LIMIT:
+            result = (hyperloglog_count(layer[column]), True)
+        else:
+            result = (int(layer[column].nunique()), False)
+        
+        with self.lock:
+            self.distinct_counts[column] = result
+        return result
+    
+    def metadata(self, layer):
+        """Full metadata (the get_layer_metadata format)"""
+        metadata = {
+            "valid": True,
+            "feature_count": self.feature_count,
+            "geometry_types": list(self.geometry_type_counts.keys()),
+            "crs": self.crs,
+            "bbox": self.bounds,
+            "attributes": {},
+            "numeric_stats": self.numeric_stats,
+        }
+        for col, dtype in self.dtypes.items():
+            unique_values, approximate = self.distinct_count(layer, col)
             metadata["attributes"][col] = {
                 "dtype": dtype,
-                "unique_values": int(layer[col].nunique()),
-                "sample": str(layer[col].iloc[0])[:50],
+                "unique_values": unique_values,
+                "sample": self.samples.get(col, ""),
             }
+            if approximate:
+                metadata["attributes"][col]["unique_values_approximate"] = True
+        return metadata
+    
+    def info(self, layer_name):
+        """Summary without any per-column work (the layer_info format)"""
+        return {
+            "name": layer_name,
+            "geometry_type": self.geometry_type_counts,
+            "crs": self.crs,
+            "feature_count": self.feature_count,
+            "columns": self.columns,
+            "bounds": self.bounds
+        }
 
-            if dtype in ["int64", "float64"]:
-                metadata["numeric_stats"][col] = {
-                    "min": layer[col].min(),
-                    "max": layer[col].max(),
-                    "mean": layer[col].mean(),
-                    "std": layer[col].std(),
-                }
-
-    return metadata
+def get_layer_metadata(layer):
+    if layer is None or len(layer) == 0:
+        return {"valid": False, "error": "Layer is empty or invalid."}
+    
+    # Loaded layers keep their statistics in the layer store
+    layer_name = LOADED_LAYERS.name_of(layer)
+    stats = LOADED_LAYERS.layer_stats(layer_name) if layer_name is not None else LayerStats(layer)
+    return stats.metadata(layer)
 
+@instrumented
 def get_layers_info(layer):
     
     """
@@ -343,11 +2146,123 @@ def get_layers_info(layer):
     Returns:
         str: Formatted text description of the layer
     """
-    Layer_temp = get_layer_metadata(LOADED_LAYERS(layer))
-    print(Layer_temp)
+    Layer_temp = get_layer_metadata(get_layer(layer) if isinstance(layer, str) else layer)
+    if debug_sampled():
+        logger.debug(f"Layer metadata: {Layer_temp}")
     return Layer_temp
 
 
+# Spatial index helpers. A GeoDataFrame builds its STRtree lazily on the first
+# `.sindex` access and keeps it for as long as the object lives, so querying the
+# index of the layer objects held in LOADED_LAYERS (instead of copies made by
+# gpd.overlay/gpd.sjoin) means each layer's tree is built once and reused by
+# every later operation on that layer.
+
+def _geometry_array(gdf):
+    return np.asarray(gdf.geometry.array, dtype=object)
+
+def _make_valid_polygons(geometries):
+    """Repair invalid polygons the same way gpd.overlay does before intersecting"""
+    invalid = np.isin(shapely.get_type_id(geometries), [3, 6]) & ~shapely.is_valid(geometries)
+    if invalid.any():
+        geometries = geometries.copy()
+        geometries[invalid] = shapely.make_valid(geometries[invalid])
+    return geometries
+
+def _suffixed_attributes(left, right, left_suffix, right_suffix):
+    """Attribute columns of two layers with shared names suffixed, like pandas merge"""
+    left = left.drop(columns=[left.geometry.name])
+    right = right.drop(columns=[right.geometry.name])
+    shared = set(left.columns) & set(right.columns)
+    left = left.rename(columns={c: f"{c}{left_suffix}" for c in shared})
+    right = right.rename(columns={c: f"{c}{right_suffix}" for c in shared})
+    return left, right
+
+def bbox_candidates(layer, other):
+    """
+    Positions of the rows of `layer` and `other` whose bounding boxes meet.
+    
+    Uses the persistent index of `other`; rows outside the returned sets can't
+    take part in any exact geometry predicate between the two layers.
+    """
+    layer_idx, other_idx = other.sindex.query(_geometry_array(layer))
+    return np.unique(layer_idx), np.unique(other_idx)
+
+def indexed_intersection(layer1, layer2):
+    """
+    gpd.overlay(layer1, layer2, how='intersection', keep_geom_type=False),
+    computed only for the pairs found by layer2's persistent spatial index.
+    """
+    idx1, idx2 = layer2.sindex.query(_geometry_array(layer1), predicate="intersects", sort=True)
+    geometries = shapely.intersection(
+        _make_valid_polygons(_geometry_array(layer1)[idx1]),
+        _make_valid_polygons(_geometry_array(layer2)[idx2])
+    )
+    keep = ~(shapely.is_empty(geometries) | shapely.is_missing(geometries))
+    
+    attributes1, attributes2 = _suffixed_attributes(layer1, layer2, "_1", "_2")
+    attributes = gpd.pd.concat([
+        attributes1.iloc[idx1[keep]].reset_index(drop=True),
+        attributes2.iloc[idx2[keep]].reset_index(drop=True)
+    ], axis=1)
+    return gpd.GeoDataFrame(attributes, geometry=geometries[keep], crs=layer1.crs)
+
+def indexed_union(layer1, layer2):
+    """
+    gpd.overlay(layer1, layer2, how='union') with a bbox prefilter.
+    
+    Features whose bbox meets nothing in the other layer come out of the union
+    unchanged, so only the overlapping candidates go through the overlay.
+    """
+    candidates1, candidates2 = bbox_candidates(layer1, layer2)
+    if len(candidates1) == len(layer1) and len(candidates2) == len(layer2):
+        return gpd.overlay(layer1, layer2, how='union')
+    
+    attributes1, attributes2 = _suffixed_attributes(layer1, layer2, "_1", "_2")
+    columns = list(attributes1.columns) + list(attributes2.columns)
+    
+    parts = []
+    if len(candidates1) and len(candidates2):
+        parts.append(gpd.overlay(layer1.iloc[candidates1], layer2.iloc[candidates2], how='union'))
+    for layer, attributes, candidates in ((layer1, attributes1, candidates1), (layer2, attributes2, candidates2)):
+        rest = np.setdiff1d(np.arange(len(layer)), candidates)
+        if len(rest):
+            parts.append(gpd.GeoDataFrame(
+                attributes.iloc[rest].reset_index(drop=True).reindex(columns=columns),
+                geometry=_geometry_array(layer)[rest],
+                crs=layer1.crs
+            ))
+    
+    return gpd.GeoDataFrame(gpd.pd.concat(parts, ignore_index=True), geometry="geometry", crs=layer1.crs)
+
+def indexed_clip(layer, mask):
+    """gpd.clip(layer, mask) restricted to the features found by layer's persistent index"""
+    _, candidates = layer.sindex.query(_geometry_array(mask), predicate="intersects")
+    candidates = np.unique(candidates)
+    if len(candidates) == len(layer):
+        return gpd.clip(layer, mask)
+    return gpd.clip(layer.iloc[candidates], mask)
+
+def indexed_sjoin_within(points, polygons):
+    """
+    gpd.sjoin(points, polygons, predicate="within", how="inner") using the
+    persistent index of the polygon layer.
+    """
+    left_idx, right_idx = polygons.sindex.query(_geometry_array(points), predicate="within", sort=True)
+    
+    right = polygons.drop(columns=[polygons.geometry.name])
+    shared = set(points.columns) & set(right.columns)
+    left = points.rename(columns={c: f"{c}_left" for c in shared})
+    right = right.rename(columns={c: f"{c}_right" for c in shared})
+    
+    index_right = polygons.index.name or "index_right"
+    result = left.iloc[left_idx].copy()
+    result[index_right] = polygons.index[right_idx]
+    for column in right.columns:
+        result[column] = right[column].values[right_idx]
+    return result
+
+@instrumented
 def intersection(layer1_name, layer2_name):
     """
     Find the geometric intersection between two layers.
@@ -367,8 +2282,9 @@ def intersection(layer1_name, layer2_name):
     layer1 = LOADED_LAYERS[layer1_name]
     layer2 = LOADED_LAYERS[layer2_name]
     
-    return gpd.overlay(layer1, layer2, how='intersection', keep_geom_type=False)
+    return indexed_intersection(layer1, layer2)
 
+@instrumented
 def union_layers(layer1_name, layer2_name):
     """
     Find the union of two layers.
@@ -388,8 +2304,9 @@ def union_layers(layer1_name, layer2_name):
     layer1 = LOADED_LAYERS[layer1_name]
     layer2 = LOADED_LAYERS[layer2_name]
     
-    return gpd.overlay(layer1, layer2, how='union')
+    return indexed_union(layer1, layer2)
 
+@instrumented
 def clip_layer(layer_name, clip_layer_name):
     """
     Clip a layer using another layer as the clip boundary.
@@ -409,141 +2326,1941 @@ def clip_layer(layer_name, clip_layer_name):
     layer = LOADED_LAYERS[layer_name]
     clip_boundary = LOADED_LAYERS[clip_layer_name]
     
-    return gpd.clip(layer, clip_boundary)
+    return indexed_clip(layer, clip_boundary)
+
+# Dissolve engine: one cascaded union per group (in the process pool for large
+# layers) with the aggregations computed in the same pass. Recent dissolves are
+# kept, so dissolving a layer that only gained features since an earlier
+# dissolve unions just the new features into the groups they belong to.
+DISSOLVE_AGGREGATIONS = {"sum", "mean", "count", "min", "max"}
+DISSOLVE_AGGREGATION_PATTERN = re.compile(r"(\w+)\s*(?:\(\s*([^()]*?)\s*\))?")
+DISSOLVE_CACHE_SIZE = int(os.getenv("DISSOLVE_CACHE_SIZE", "16"))
+DISSOLVE_PREFIX_CANDIDATES = 4  # Earlier dissolves checked as the start of a grown layer
+# Below the partitioning thresholds, a dissolve still goes to the process pool
+# when it has this many groups (and features): the groups are unioned
+# independently, with no final union of partial results
+DISSOLVE_PARTITION_GROUPS = int(os.getenv("DISSOLVE_PARTITION_GROUPS", "1000"))
+DISSOLVE_PARTITION_FEATURES = int(os.getenv("DISSOLVE_PARTITION_FEATURES", "20000"))
 
-def dissolve_layer(layer_name, column=None):
+def parse_aggregations(aggregations):
     """
-    Dissolve features in a layer.
+    Parse the aggregations of a dissolve.
     
     Args:
-        layer_name: The name of the layer to dissolve
-        column: Optional column to dissolve by
+        aggregations: "sum(population), mean(area), count" (or a list of such
+            items); count without a column counts the features of each group
         
     Returns:
-        A new GeoDataFrame with dissolved geometries
+        Tuple of (function, column or None) pairs
     """
-    if layer_name not in LOADED_LAYERS:
-        raise ValueError(f"Layer '{layer_name}' not found")
+    if not aggregations:
+        return ()
+    if isinstance(aggregations, str):
+        aggregations = aggregations.split(",")
     
-    layer = LOADED_LAYERS[layer_name]
-    return layer.dissolve(by=column).reset_index()
+    parsed = []
+    for item in aggregations:
+        item = str(item).strip()
+        if not item:
+            continue
+        match = DISSOLVE_AGGREGATION_PATTERN.fullmatch(item)
+        if not match or match.group(1).lower() not in DISSOLVE_AGGREGATIONS:
+            raise ValueError(f"Invalid aggregation '{item}', expected sum(column), mean(column), min(column), max(column) or count")
+        function, column = match.group(1).lower(), match.group(2) or None
+        if column is None and function != "count":
+            raise ValueError(f"Aggregation '{function}' needs a column, e.g. {function}(population)")
+        parsed.append((function, column))
+    return tuple(dict.fromkeys(parsed))
 
-def simplify_layer(layer_name, tolerance):
+def partitioned_dissolve(gdf, codes, group_count):
     """
-    Simplify geometries in a layer.
+    Union the features of each group in the process pool.
+    
+    Features are sorted by group (and along a Hilbert curve within a group),
+    so each chunk unions whole runs of a group; groups split across chunks
+    get their partial unions unioned once more here.
     
     Args:
-        layer_name: The name of the layer to simplify
-        tolerance: The tolerance for simplification
+        gdf: The layer to dissolve
+        codes: Group of each feature (-1 = no group, left out)
+        group_count: Number of groups
         
     Returns:
-        A new GeoDataFrame with simplified geometries
+        numpy array of one geometry per group
     """
-    if layer_name not in LOADED_LAYERS:
-        raise ValueError(f"Layer '{layer_name}' not found")
+    valid = np.flatnonzero(codes >= 0)
+    try:
+        hilbert = gdf.geometry.hilbert_distance().values[valid]
+    except Exception:
+        hilbert = np.zeros(len(valid))  # Empty or missing geometries
+    positions = valid[np.lexsort((hilbert, codes[valid]))]
+    sorted_codes = codes[positions]
     
-    layer = LOADED_LAYERS[layer_name]
-    return layer.copy().geometry.simplify(tolerance).to_frame()
+    shm, offsets = geometry_workers.write_shared(_geometry_array(gdf)[positions])
+    try:
+        pool = get_geometry_process_pool()
+        chunks = [chunk for chunk in np.array_split(np.arange(len(positions)), PARTITION_WORKERS * PARTITION_CHUNKS_PER_WORKER) if len(chunk)]
+        futures = [
+            pool.submit(geometry_workers.union_groups, shm.name, offsets[chunk[0]:chunk[-1] + 2], sorted_codes[chunk])
+            for chunk in chunks
+        ]
+        chunk_codes, chunk_unions = [], []
+        for future in futures:
+            group_codes, raw, lengths = future.result()
+            chunk_codes.append(group_codes)
+            chunk_unions.append(geometry_workers.decode_chunk(raw, lengths))
+    finally:
+        shm.close()
+        shm.unlink()
+    
+    result = np.empty(group_count, dtype=object)
+    if not chunk_codes:
+        return result
+    partial_codes = np.concatenate(chunk_codes)
+    partial_unions = np.concatenate(chunk_unions)
+    # Chunks are in group order, so the partial unions of a group are adjacent
+    starts = np.flatnonzero(np.r_[True, partial_codes[1:] != partial_codes[:-1]])
+    stops = np.r_[starts[1:], len(partial_codes)]
+    single = stops - starts == 1
+    result[partial_codes[starts[single]]] = partial_unions[starts[single]]
+    for start, stop in zip(starts[~single], stops[~single]):
+        result[partial_codes[start]] = shapely.union_all(partial_unions[start:stop])
+    return result
 
-def get_layer(layer_name):
+def should_partition_dissolve(gdf, group_count):
     """
-    Get a layer by name.
-    
-    Args:
-        layer_name: The name of the layer to get
-        
-    Returns:
-        The GeoDataFrame for the requested layer
+    Whether a dissolve runs in the process pool: for any layer over the
+    partitioning thresholds (see should_partition), and for layers of at
+    least DISSOLVE_PARTITION_FEATURES features in DISSOLVE_PARTITION_GROUPS
+    or more groups.
     """
-    if layer_name not in LOADED_LAYERS:
-        raise ValueError(f"Layer '{layer_name}' not found")
+    if should_partition(gdf):
+        return True
+    return (PARTITION_WORKERS >= 2 and group_count >= DISSOLVE_PARTITION_GROUPS
+            and len(gdf) >= DISSOLVE_PARTITION_FEATURES)
+
+def dissolve_geometries(gdf, codes, group_count):
+    """One union (GEOS cascaded union) of the features of each group"""
+    if should_partition_dissolve(gdf, group_count):
+        return partitioned_dissolve(gdf, codes, group_count)
     
-    return LOADED_LAYERS[layer_name]
+    geometries = _geometry_array(gdf)
+    valid = np.flatnonzero(codes >= 0)
+    positions = valid[np.argsort(codes[valid], kind="stable")]
+    sorted_codes = codes[positions]
+    groups = np.arange(group_count)
+    starts = np.searchsorted(sorted_codes, groups, side="left")
+    stops = np.searchsorted(sorted_codes, groups, side="right")
+    result = np.empty(group_count, dtype=object)
+    result[:] = [shapely.union_all(geometries[positions[start:stop]]) for start, stop in zip(starts, stops)]
+    return result
 
-def list_layers():
+class DissolveState:
     """
-    List all available layers.
+    A dissolve in a mergeable form: the group keys, one geometry per group,
+    the feature count per group, the sums/counts/minima/maxima the aggregations
+    are computed from and, without aggregations, the first value of every
+    other column. Merging the states of consecutive row ranges of a layer
+    gives the state of the whole range.
+    """
+    
+    def __init__(self, keys, geometries, sizes, partials, firsts, rows):
+        self.keys = keys  # pandas Index of the group values
+        self.geometries = geometries
+        self.sizes = sizes
+        self.partials = partials  # column -> {"sum", "count", "min", "max"} arrays aligned with keys
+        self.firsts = firsts  # DataFrame indexed by group position, or None
+        self.rows = rows  # Features of the layer dissolved so far
+        self.fingerprint = None  # layer_fingerprint of those features
+    
+    @classmethod
+    def build(cls, gdf, column, aggregations):
+        if column is None:
+            codes, keys = np.zeros(len(gdf), dtype=np.int64), pd.Index([0])
+        else:
+            codes, keys = pd.factorize(gdf[column], sort=True)  # -1 for missing values
+        group_count = len(keys)
+        valid = codes >= 0
+        
+        partials = {}
+        for agg_column in dict.fromkeys(agg_column for _, agg_column in aggregations if agg_column is not None):
+            values = gdf[agg_column]
+            present = valid & values.notna().to_numpy()
+            if pd.api.types.is_numeric_dtype(values):
+                stats = pd.Series(values.to_numpy()[present]).groupby(codes[present]).agg(["sum", "min", "max"]).reindex(range(group_count))
+                partials[agg_column] = {
+                    "sum": stats["sum"].fillna(0).to_numpy(dtype=float),
+                    "min": stats["min"].to_numpy(dtype=float),
+                    "max": stats["max"].to_numpy(dtype=float),
+                }
+            else:
+                partials[agg_column] = {}
+            partials[agg_column]["count"] = np.bincount(codes[present], minlength=group_count)
+        
+        firsts = None
+        if not aggregations:
+            others = gdf.drop(columns=[name for name in (gdf.geometry.name, column) if name is not None])
+            firsts = others[valid].groupby(codes[valid]).first().reindex(range(group_count))
+        
+        return cls(
+            keys,
+            dissolve_geometries(gdf, codes, group_count),
+            np.bincount(codes[valid], minlength=group_count),
+            partials,
+            firsts,
+            len(gdf),
+        )
+    
+    def merge(self, other):
+        """State of this state's rows followed by `other`'s rows"""
+        keys = self.keys.append(other.keys.difference(self.keys, sort=False))
+        theirs = keys.get_indexer(other.keys)
+        mine = len(self.keys)
+        
+        def extend(values, fill):
+            extended = np.full(len(keys), fill, dtype=values.dtype)
+            extended[:mine] = values
+            return extended
+        
+        geometries = extend(self.geometries, None)
+        current, incoming = geometries[theirs], other.geometries
+        both = ~shapely.is_missing(current) & ~shapely.is_missing(incoming)
+        combined = np.where(shapely.is_missing(incoming), current, incoming)
+        combined[both] = shapely.union(current[both], incoming[both])
+        geometries[theirs] = combined
+        
+        sizes = extend(self.sizes, 0)
+        sizes[theirs] += other.sizes
+        
+        partials = {}
+        for agg_column, stats in self.partials.items():
+            merged = {}
+            for name, values in stats.items():
+                if name in ("sum", "count"):
+                    merged[name] = extend(values, 0)
+                    merged[name][theirs] += other.partials[agg_column][name]
+                else:
+                    merged[name] = extend(values, np.nan)
+                    combine = np.fmin if name == "min" else np.fmax
+                    merged[name][theirs] = combine(merged[name][theirs], other.partials[agg_column][name])
+            partials[agg_column] = merged
+        
+        firsts = None
+        if self.firsts is not None:
+            # Earlier rows come first: only fill what the earlier rows left empty
+            firsts = self.firsts.reindex(range(len(keys))).combine_first(other.firsts.set_axis(theirs))[self.firsts.columns]
+        
+        return DissolveState(keys, geometries, sizes, partials, firsts, self.rows + other.rows)
+    
+    def to_frame(self, column, aggregations, geometry_name, crs):
+        data = {}
+        if column is not None:
+            data[column] = np.asarray(self.keys)
+        if self.firsts is not None:
+            for name in self.firsts.columns:
+                data[name] = self.firsts[name].to_numpy()
+        for function, agg_column in aggregations:
+            if agg_column is None:
+                data["count"] = self.sizes
+                continue
+            stats = self.partials[agg_column]
+            if function == "count":
+                values = stats["count"]
+            elif function == "mean":
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    values = np.where(stats["count"] > 0, stats["sum"] / stats["count"], np.nan)
+            else:
+                values = stats[function]
+            data[f"{agg_column}_{function}"] = values
+        
+        result = gpd.GeoDataFrame(data, geometry=gpd.GeoSeries(self.geometries, crs=crs), crs=crs)
+        result = result.rename_geometry(geometry_name) if geometry_name != "geometry" else result
+        columns = [column] if column is not None else []
+        result = result[columns + [geometry_name] + [name for name in result.columns if name not in columns and name != geometry_name]]
+        if column is not None and len(result) > 1:
+            try:
+                result = result.iloc[np.argsort(self.keys, kind="stable")]
+            except TypeError:
+                pass  # Mixed key types, keep the order groups were first seen in
+        return result.reset_index(drop=True)
+
+class DissolveCache:
+    """
+    States of recent dissolves, by session, column, aggregations and the
+    fingerprint of the dissolved layer.
+    
+    A dissolve of a layer whose first rows are exactly a layer dissolved
+    before (features were appended to it) starts from that dissolve and only
+    dissolves the new rows. Evicted LRU beyond `max_entries`.
+    """
+    
+    def __init__(self, max_entries=DISSOLVE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.incremental = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+    
+    def find(self, gdf, fingerprint, column, aggregations, row_hashes=None):
+        """
+        The state to start from: the same layer's, a state of its first rows, or None.
+        
+        `row_hashes` is a callable returning layer_row_hashes(gdf), only called
+        when there are prefix candidates to check.
+        """
+        prefix = (CURRENT_SESSION.get(), column, aggregations)
+        with self.lock:
+            state = self.entries.get(prefix + (fingerprint,))
+            if state is not None:
+                self.entries.move_to_end(prefix + (fingerprint,))
+                self.hits += 1
+                return state
+            candidates = sorted(
+                (state for key, state in self.entries.items() if key[:3] == prefix and state.rows < len(gdf)),
+                key=lambda state: state.rows, reverse=True
+            )[:DISSOLVE_PREFIX_CANDIDATES]
+        
+        # Hashing is done without the lock
+        hashes = None
+        if candidates:
+            hashes = row_hashes() if row_hashes is not None else layer_row_hashes(gdf)
+        for state in candidates:
+            if layer_fingerprint(gdf, rows=state.rows, row_hashes=hashes) == state.fingerprint:
+                with self.lock:
+                    self.incremental += 1
+                return state
+        with self.lock:
+            self.misses += 1
+        return None
+    
+    def store(self, state, column, aggregations):
+        key = (CURRENT_SESSION.get(), column, aggregations, state.fingerprint)
+        with self.lock:
+            self.entries[key] = state
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+    
+    def drop_session(self, session_id):
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == session_id]:
+                del self.entries[key]
+    
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "hits": self.hits, "incremental": self.incremental, "misses": self.misses}
+
+DISSOLVE_CACHE = DissolveCache()
+
+@instrumented
+def dissolve_layer(layer_name, column=None, aggregations=None):
+    """
+    Dissolve features in a layer.
+    
+    Args:
+        layer_name: The name of the layer to dissolve
+        column: Optional column to dissolve by
+        aggregations: Optional "sum(column), mean(column), min(column),
+            max(column), count"; without them the first value of every other
+            column is kept
+        
+    Returns:
+        A new GeoDataFrame with dissolved geometries
+    """
+    if layer_name not in LOADED_LAYERS:
+        raise ValueError(f"Layer '{layer_name}' not found")
+    
+    layer = LOADED_LAYERS[layer_name]
+    if column is not None and column not in layer.columns:
+        raise ValueError(f"Column '{column}' not found in layer '{layer_name}'")
+    aggregations = parse_aggregations(aggregations)
+    for function, agg_column in aggregations:
+        if agg_column is None:
+            continue
+        if agg_column not in layer.columns:
+            raise ValueError(f"Column '{agg_column}' not found in layer '{layer_name}'")
+        if function != "count" and not pd.api.types.is_numeric_dtype(layer[agg_column]):
+            raise ValueError(f"Column '{agg_column}' is not numeric, {function} needs numbers")
+    
+    fingerprint = LOADED_LAYERS.fingerprint(layer_name)
+    state = DISSOLVE_CACHE.find(
+        layer, fingerprint, column, aggregations,
+        row_hashes=lambda: LOADED_LAYERS.row_hashes(layer_name)
+    )
+    if state is None or state.fingerprint != fingerprint:
+        if state is None:
+            state = DissolveState.build(layer, column, aggregations)
+        else:
+            # Features were appended: dissolve only those and merge them in
+            state = state.merge(DissolveState.build(layer.iloc[state.rows:], column, aggregations))
+        state.fingerprint = fingerprint
+        DISSOLVE_CACHE.store(state, column, aggregations)
+    
+    return state.to_frame(column, aggregations, layer.geometry.name, layer.crs)
+
+@instrumented
+def simplify_layer(layer_name, tolerance):
+    """
+    Simplify geometries in a layer.
+    
+    Args:
+        layer_name: The name of the layer to simplify
+        tolerance: The tolerance for simplification
+        
+    Returns:
+        A new GeoDataFrame with simplified geometries
+    """
+    if layer_name not in LOADED_LAYERS:
+        raise ValueError(f"Layer '{layer_name}' not found")
+    
+    layer = LOADED_LAYERS[layer_name]
+    tolerance = float(tolerance)
+    if should_partition(layer):
+        return gpd.GeoSeries(
+            partitioned_geometry_op(layer, "simplify", tolerance=tolerance),
+            index=layer.index, crs=layer.crs, name=layer.geometry.name
+        ).to_frame()
+    return layer.geometry.simplify(tolerance).rename(layer.geometry.name).to_frame()
+
+def get_layer(layer_name):
+    """
+    Get a layer by name.
+    
+    Args:
+        layer_name: The name of the layer to get
+        
+    Returns:
+        The GeoDataFrame for the requested layer
+    """
+    if layer_name not in LOADED_LAYERS:
+        raise ValueError(f"Layer '{layer_name}' not found")
+    
+    return LOADED_LAYERS[layer_name]
+
+def list_layers():
+    """
+    List all available layers.
+    
+    Returns:
+        A list of layer names
+    """
+    return list(LOADED_LAYERS.keys())
+
+def layer_info(layer_name):
+    """
+    Get information about a layer.
+    
+    Args:
+        layer_name: The name of the layer to get info for
+        
+    Returns:
+        A dictionary with layer information
+    """
+    if layer_name not in LOADED_LAYERS:
+        raise ValueError(f"Layer '{layer_name}' not found")
+    
+    return LOADED_LAYERS.layer_stats(layer_name).info(layer_name)
+
+@instrumented
+def reproject_layer(layer_name):
+    """
+    Reproject a layer to the specified EPSG coordinate system.
+    
+    Args:
+        layer_name: The name of the layer to reproject
+        epsg: The target EPSG code (default: 4326 for WGS84)
+        
+    Returns:
+        A new GeoDataFrame with the reprojected geometries
+    """
+    epsg = 4326
+    if layer_name not in LOADED_LAYERS:
+        raise ValueError(f"Layer '{layer_name}' not found")
+
+    layer = LOADED_LAYERS[layer_name]
+
+    if layer.crs is None:
+        raise ValueError(f"Layer '{layer_name}' does not have a CRS. Please set the CRS before reprojecting.")
+
+    if should_partition(layer):
+        target_crs = f"EPSG:{epsg}"
+        reprojected = layer.copy()
+        reprojected[layer.geometry.name] = gpd.GeoSeries(
+            partitioned_geometry_op(layer, "reproject", source_crs=layer.crs.to_wkt(), target_crs=target_crs),
+            index=layer.index, crs=target_crs
+        )
+        return reprojected.set_crs(target_crs, allow_override=True)
+
+    return layer.to_crs(epsg=epsg)
+
+@instrumented
+def points_within_polygon(points_layer_name, polygon_layer_name):
+    if points_layer_name not in LOADED_LAYERS:
+        raise ValueError(f"Layer '{points_layer_name}' not found")
+    if polygon_layer_name not in LOADED_LAYERS:
+        raise ValueError(f"Layer '{polygon_layer_name}' not found")
+
+    points = LOADED_LAYERS[points_layer_name]
+    polygons = LOADED_LAYERS[polygon_layer_name]
+
+    if points.crs != polygons.crs:
+        polygons = polygons.to_crs(points.crs)
+
+    # Perform spatial join
+    result = indexed_sjoin_within(points, polygons)
+
+    return result
+
+# Rasters stay on disk as GeoTIFFs; every operation reads and writes them in
+# blocks of RASTER_BLOCK_SIZE pixels, so a raster is never fully in memory
+RASTER_DIR = UPLOAD_DIR / "rasters"
+RASTER_EXTENSIONS = {"tif", "tiff"}
+RASTER_BLOCK_SIZE = int(os.getenv("RASTER_BLOCK_SIZE", "1024"))
+RASTER_WORKERS = int(os.getenv("RASTER_WORKERS", str(os.cpu_count() or 1)))
+ZONAL_CHUNK_SIZE = 256  # Zones per zonal statistics task
+RASTER_EXECUTOR = ThreadPoolExecutor(max_workers=RASTER_WORKERS, thread_name_prefix="raster")
+
+RASTER_ORPHAN_GRACE = 300  # Seconds a raster file may exist before it's registered
+
+class RasterStore:
+    """
+    GeoTIFF paths of the loaded rasters, keyed like LAYER_STORE
+    ("<session>/<name>") and accessed by plain names of the current session.
+    
+    With an `index_path`, rasters are listed in a SQLite table (the layer
+    catalog's database when the shared backend is used), so every worker
+    sees them and they survive restarts; without one they're per process.
+    The file size of each raster is kept for the session quotas.
+    """
+    
+    def __init__(self, index_path=None):
+        self.rasters = {}  # key -> (path, bytes, created)
+        self.connection = None
+        self.data_version = None
+        self.lock = threading.Lock()
+        if index_path is not None:
+            Path(index_path).parent.mkdir(parents=True, exist_ok=True)
+            self.connection = sqlite3.connect(index_path, timeout=30, isolation_level=None, check_same_thread=False)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS rasters ("
+                "name TEXT PRIMARY KEY, path TEXT NOT NULL, bytes INTEGER NOT NULL, created REAL NOT NULL)"
+            )
+    
+    def _refresh(self):
+        if self.connection is None:
+            return
+        data_version = self.connection.execute("PRAGMA data_version").fetchone()[0]
+        if data_version != self.data_version:
+            rows = self.connection.execute("SELECT name, path, bytes, created FROM rasters ORDER BY created").fetchall()
+            self.rasters = {name: (Path(path), size, created) for name, path, size, created in rows}
+            self.data_version = data_version
+    
+    def __contains__(self, raster_name):
+        with self.lock:
+            self._refresh()
+            return LOADED_LAYERS.qualified(raster_name) in self.rasters
+    
+    def __getitem__(self, raster_name):
+        with self.lock:
+            self._refresh()
+            try:
+                return self.rasters[LOADED_LAYERS.qualified(raster_name)][0]
+            except KeyError:
+                raise KeyError(raster_name) from None
+    
+    def keys(self):
+        prefix = LOADED_LAYERS.qualified("")
+        return [key[len(prefix):] for key in self.all_keys() if key.startswith(prefix)]
+    
+    def all_keys(self):
+        """Keys of the rasters of every session"""
+        with self.lock:
+            self._refresh()
+            return list(self.rasters)
+    
+    def session_sizes(self, session_id):
+        """Dict of raster name -> file size for one session"""
+        prefix = SessionLayers.qualified("", session_id)
+        with self.lock:
+            self._refresh()
+            return {key[len(prefix):]: size for key, (_, size, _) in self.rasters.items() if key.startswith(prefix)}
+    
+    def catalog(self):
+        """Size and creation time of the current session's rasters"""
+        prefix = LOADED_LAYERS.qualified("")
+        with self.lock:
+            self._refresh()
+            return {key[len(prefix):]: {"bytes": size, "created": created}
+                    for key, (_, size, created) in self.rasters.items() if key.startswith(prefix)}
+    
+    def register(self, raster_name, path, size=None):
+        raster_key = LOADED_LAYERS.qualified(raster_name)
+        path = Path(path).resolve()
+        size = path.stat().st_size if size is None else size
+        created = time.time()
+        with self.lock:
+            self._refresh()
+            previous = self.rasters.get(raster_key)
+            if self.connection is not None:
+                self.connection.execute(
+                    "INSERT INTO rasters (name, path, bytes, created) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(name) DO UPDATE SET path = excluded.path, bytes = excluded.bytes",
+                    (raster_key, str(path), size, created)
+                )
+                # data_version doesn't change for our own commits
+                self.data_version = None
+            self.rasters[raster_key] = (path, size, created)
+        RASTER_TILE_CACHE.invalidate(raster_key)
+        if previous is not None and previous[0] != path:
+            remove_raster_files(previous[0])
+    
+    def drop_session(self, session_id, created_before=None):
+        """
+        Delete the rasters of a session (only those created before
+        `created_before` when given) and return their names.
+        """
+        prefix = SessionLayers.qualified("", session_id)
+        with self.lock:
+            self._refresh()
+            keys = [key for key, (_, _, created) in self.rasters.items()
+                    if key.startswith(prefix) and (created_before is None or created < created_before)]
+            paths = [self.rasters.pop(key)[0] for key in keys]
+            if self.connection is not None and keys:
+                self.connection.executemany("DELETE FROM rasters WHERE name = ?", [(key,) for key in keys])
+                self.data_version = None
+        for key, path in zip(keys, paths):
+            RASTER_TILE_CACHE.invalidate(key)
+            remove_raster_files(path)
+        return [key[len(prefix):] for key in keys]
+    
+    def remove_orphans(self, raster_dir=RASTER_DIR, grace=RASTER_ORPHAN_GRACE):
+        """
+        Delete the files in `raster_dir` that no raster refers to (left behind
+        by a crash, or by a restart when rasters were only kept in memory).
+        
+        Files changed in the last `grace` seconds are kept, since they may
+        belong to a raster another worker is still writing.
+        
+        Returns:
+            Number of files and directories removed
+        """
+        if not raster_dir.exists():
+            return 0
+        with self.lock:
+            self._refresh()
+            referenced = {path for path, _, _ in self.rasters.values()}
+        cutoff = time.time() - grace
+        removed = 0
+        for entry in raster_dir.iterdir():
+            # External overviews belong to the GeoTIFF they're named after
+            raster_path = entry.with_suffix("") if entry.suffix == ".ovr" else entry
+            try:
+                if raster_path.resolve() in referenced or entry.stat().st_mtime > cutoff:
+                    continue
+                if entry.is_dir():
+                    shutil.rmtree(entry)  # Left over from building overviews
+                else:
+                    entry.unlink()
+            except FileNotFoundError:
+                continue
+            removed += 1
+        return removed
+    
+    def close(self):
+        if self.connection is not None:
+            with self.lock:
+                self.connection.close()
+
+def remove_raster_files(path):
+    """Delete a GeoTIFF and its external overviews"""
+    path.unlink(missing_ok=True)
+    Path(f"{path}.ovr").unlink(missing_ok=True)
+
+LOADED_RASTERS = RasterStore(LAYER_SHARED_DIR / "index.sqlite" if LAYER_BACKEND == "shared" else None)
+
+def new_raster_path():
+    RASTER_DIR.mkdir(parents=True, exist_ok=True)
+    return RASTER_DIR / f"{uuid.uuid4().hex}.tif"
+
+def get_raster_path(raster_name):
+    if raster_name not in LOADED_RASTERS:
+        raise ValueError(f"Raster '{raster_name}' not found")
+    return LOADED_RASTERS[raster_name]
+
+def register_raster(path):
+    """Register a GeoTIFF under a new name of the current session and return the name"""
+    raster_name = SESSIONS.allocate_name("Raster")
+    try:
+        SESSIONS.store_raster(raster_name, path)
+    except SessionQuotaExceeded:
+        remove_raster_files(Path(path))
+        raise
+    return raster_name
+
+def raster_reference(raster_name):
+    """Size, CRS and WGS84 bbox of a raster (read from its header only)"""
+    with rasterio.open(get_raster_path(raster_name)) as src:
+        bounds = src.bounds
+        if src.crs is not None and src.crs != rasterio.crs.CRS.from_epsg(4326):
+            bounds = rasterio.warp.transform_bounds(src.crs, "EPSG:4326", *bounds)
+        return {
+            "raster_name": raster_name,
+            "crs": str(src.crs),
+            "width": src.width,
+            "height": src.height,
+            "band_count": src.count,
+            "dtype": src.dtypes[0],
+            "resolution": list(src.res),
+            "nodata": src.nodata,
+            "bbox": [float(v) for v in bounds],
+            "tile_url": raster_tile_url(raster_name),
+        }
+
+def block_windows(width, height, col_off=0, row_off=0, size=RASTER_BLOCK_SIZE):
+    """Windows of at most size x size pixels covering a width x height area"""
+    for row in range(0, height, size):
+        for col in range(0, width, size):
+            yield rasterio.windows.Window(col_off + col, row_off + row, min(size, width - col), min(size, height - row))
+
+def pixel_window(bounds, transform, width, height):
+    """
+    Smallest pixel window covering `bounds` (minx, miny, maxx, maxy), clamped
+    to the raster. None when the bounds are outside the raster.
+    """
+    minx, miny, maxx, maxy = bounds
+    inverse = ~transform
+    cols, rows = zip(*(inverse * corner for corner in ((minx, miny), (minx, maxy), (maxx, miny), (maxx, maxy))))
+    col_start, col_stop = max(0, int(np.floor(min(cols)))), min(width, int(np.ceil(max(cols))))
+    row_start, row_stop = max(0, int(np.floor(min(rows)))), min(height, int(np.ceil(max(rows))))
+    if col_stop <= col_start or row_stop <= row_start:
+        return None
+    return rasterio.windows.Window(col_start, row_start, col_stop - col_start, row_stop - row_start)
+
+def map_raster_tasks(path, tasks, work):
+    """
+    Run work(dataset, task) for every task on RASTER_EXECUTOR.
+    
+    Each task opens its own handle on the raster (datasets can't be shared
+    between threads). Results are yielded in task order with at most
+    2 * RASTER_WORKERS tasks in flight, so block results never pile up.
+    """
+    def run(task):
+        with rasterio.open(path) as src:
+            return task, work(src, task)
+    
+    pending = deque()
+    for task in tasks:
+        pending.append(RASTER_EXECUTOR.submit(run, task))
+        if len(pending) >= 2 * RASTER_WORKERS:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+def default_nodata(dtype):
+    return np.nan if np.issubdtype(np.dtype(dtype), np.floating) else 0
+
+def output_profile(src, **updates):
+    """GeoTIFF profile for a result raster: tiled and compressed, like the source otherwise"""
+    profile = src.profile.copy()
+    profile.update(driver="GTiff", tiled=True, blockxsize=256, blockysize=256, compress="deflate", BIGTIFF="IF_SAFER")
+    profile.update(updates)
+    return profile
+
+def _geometries_in_crs(layer, crs):
+    """Non-empty geometries of a layer, in the raster's CRS"""
+    if layer.crs is not None and crs is not None and not layer.crs.equals(crs):
+        layer = layer.to_crs(crs)
+    geometries = np.asarray(layer.geometry.array, dtype=object)
+    return geometries[~(shapely.is_missing(geometries) | shapely.is_empty(geometries))]
+
+@instrumented
+def zonal_statistics(raster_name, zones_layer_name, band=1):
+    """
+    Pixel statistics (count, sum, mean, min, max) of a raster band per polygon.
+    
+    Each zone only reads the blocks under its bounding box; zones are
+    processed in parallel chunks.
+    
+    Args:
+        raster_name: Name of the raster
+        zones_layer_name: Name of the polygon layer
+        band: Band number (1-based)
+        
+    Returns:
+        The zones layer with zonal_count/sum/mean/min/max columns
+    """
+    path = get_raster_path(raster_name)
+    if zones_layer_name not in LOADED_LAYERS:
+        raise ValueError(f"Layer '{zones_layer_name}' not found")
+    zones = LOADED_LAYERS[zones_layer_name]
+    band = int(band)
+    
+    with rasterio.open(path) as src:
+        if not 1 <= band <= src.count:
+            raise ValueError(f"Raster '{raster_name}' has no band {band}")
+        raster_crs = src.crs
+    
+    if zones.crs is not None and raster_crs is not None and not zones.crs.equals(raster_crs):
+        geometries = np.asarray(zones.geometry.to_crs(raster_crs).array, dtype=object)
+    else:
+        geometries = np.asarray(zones.geometry.array, dtype=object)
+    
+    def zone_stats(src, geometry):
+        count, total, low, high = 0, 0.0, np.inf, -np.inf
+        if geometry is None or geometry.is_empty:
+            return count, total, low, high
+        window = pixel_window(geometry.bounds, src.transform, src.width, src.height)
+        if window is None:
+            return count, total, low, high
+        for block in block_windows(window.width, window.height, window.col_off, window.row_off):
+            data = src.read(band, window=block)
+            outside = rasterio.features.geometry_mask([geometry], out_shape=data.shape, transform=src.window_transform(block))
+            valid = ~outside
+            if src.nodata is not None and not np.isnan(src.nodata):
+                valid &= data != src.nodata
+            if np.issubdtype(data.dtype, np.floating):
+                valid &= ~np.isnan(data)
+            values = data[valid]
+            if values.size:
+                count += values.size
+                total += float(values.sum(dtype=np.float64))
+                low = min(low, float(values.min()))
+                high = max(high, float(values.max()))
+        return count, total, low, high
+    
+    def work(src, chunk):
+        return [zone_stats(src, geometries[i]) for i in chunk]
+    
+    chunks = [range(start, min(start + ZONAL_CHUNK_SIZE, len(geometries))) for start in range(0, len(geometries), ZONAL_CHUNK_SIZE)]
+    stats = [zone for _, chunk_stats in map_raster_tasks(path, chunks, work) for zone in chunk_stats]
+    
+    result = zones.copy()
+    counts = np.array([zone[0] for zone in stats], dtype=np.int64)
+    sums = np.array([zone[1] for zone in stats], dtype=np.float64)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        result["zonal_count"] = counts
+        result["zonal_sum"] = np.where(counts > 0, sums, np.nan)
+        result["zonal_mean"] = np.where(counts > 0, sums / counts, np.nan)
+        result["zonal_min"] = [zone[2] if zone[0] else np.nan for zone in stats]
+        result["zonal_max"] = [zone[3] if zone[0] else np.nan for zone in stats]
+    return result
+
+@instrumented
+def clip_raster(raster_name, clip_layer_name):
+    """
+    Clip a raster to the polygons of a layer.
+    
+    The result covers the polygons' bounding box; pixels outside the polygons
+    are set to nodata. Blocks are read, masked and written one at a time.
+    
+    Args:
+        raster_name: Name of the raster to clip
+        clip_layer_name: Name of the polygon layer to clip with
+        
+    Returns:
+        Name of the new raster
+    """
+    path = get_raster_path(raster_name)
+    if clip_layer_name not in LOADED_LAYERS:
+        raise ValueError(f"Layer '{clip_layer_name}' not found")
+    
+    with rasterio.open(path) as src:
+        geometries = _geometries_in_crs(LOADED_LAYERS[clip_layer_name], src.crs)
+        if len(geometries) == 0:
+            raise ValueError(f"Layer '{clip_layer_name}' has no geometries")
+        window = pixel_window(shapely.total_bounds(geometries), src.transform, src.width, src.height)
+        if window is None:
+            raise ValueError(f"Layer '{clip_layer_name}' does not overlap raster '{raster_name}'")
+        nodata = src.nodata if src.nodata is not None else default_nodata(src.dtypes[0])
+        transform = src.window_transform(window)
+        profile = output_profile(src, width=window.width, height=window.height, transform=transform, nodata=nodata)
+    
+    tree = shapely.STRtree(geometries)
+    
+    def work(src, block):
+        source_window = rasterio.windows.Window(window.col_off + block.col_off, window.row_off + block.row_off, block.width, block.height)
+        data = src.read(window=source_window)
+        block_transform = rasterio.windows.transform(block, transform)
+        candidates = tree.query(shapely.box(*rasterio.windows.bounds(block, transform)))
+        if len(candidates) == 0:
+            data[:] = nodata
+            return data
+        outside = rasterio.features.geometry_mask(geometries[candidates], out_shape=data.shape[1:], transform=block_transform)
+        data[:, outside] = nodata
+        return data
+    
+    out_path = new_raster_path()
+    try:
+        with rasterio.open(out_path, "w", **profile) as dst:
+            for block, data in map_raster_tasks(path, list(block_windows(window.width, window.height)), work):
+                dst.write(data, window=block)
+    except Exception:
+        out_path.unlink(missing_ok=True)
+        raise
+    return register_raster(out_path)
+
+@instrumented
+def resample_raster(raster_name, target_crs=None, resolution=None, resampling="bilinear"):
+    """
+    Reproject and/or resample a raster.
+    
+    Every output block is warped separately from the part of the source it
+    needs, so memory use is bounded by the block size.
+    
+    Args:
+        raster_name: Name of the raster
+        target_crs: CRS of the result (e.g. "EPSG:4326"), the source CRS when omitted
+        resolution: Pixel size of the result in target CRS units, kept when omitted
+        resampling: nearest, bilinear, cubic, average, mode, min, max, ...
+        
+    Returns:
+        Name of the new raster
+    """
+    path = get_raster_path(raster_name)
+    try:
+        method = rasterio.enums.Resampling[str(resampling).strip().lower()]
+    except KeyError:
+        raise ValueError(f"Unknown resampling method '{resampling}'") from None
+    
+    with rasterio.open(path) as src:
+        if src.crs is None:
+            raise ValueError(f"Raster '{raster_name}' has no CRS")
+        dst_crs = rasterio.crs.CRS.from_user_input(target_crs) if target_crs else src.crs
+        transform, width, height = rasterio.warp.calculate_default_transform(
+            src.crs, dst_crs, src.width, src.height, *src.bounds,
+            resolution=float(resolution) if resolution else None
+        )
+        nodata = src.nodata if src.nodata is not None else default_nodata(src.dtypes[0])
+        count, dtype = src.count, src.dtypes[0]
+        profile = output_profile(src, crs=dst_crs, transform=transform, width=width, height=height, nodata=nodata)
+    
+    def work(src, block):
+        data = np.full((count, block.height, block.width), nodata, dtype=dtype)
+        rasterio.warp.reproject(
+            source=rasterio.band(src, list(range(1, count + 1))),
+            destination=data,
+            src_nodata=src.nodata,
+            dst_transform=rasterio.windows.transform(block, transform),
+            dst_crs=dst_crs,
+            dst_nodata=nodata,
+            resampling=method,
+        )
+        return data
+    
+    out_path = new_raster_path()
+    try:
+        with rasterio.open(out_path, "w", **profile) as dst:
+            for block, data in map_raster_tasks(path, list(block_windows(width, height)), work):
+                dst.write(data, window=block)
+    except Exception:
+        out_path.unlink(missing_ok=True)
+        raise
+    return register_raster(out_path)
+
+def list_rasters():
+    """
+    List all available rasters.
+    
+    Returns:
+        A list of raster names
+    """
+    return LOADED_RASTERS.keys()
+
+# Raster tiles: XYZ PNG/WebP rendered from the GeoTIFF (or its overviews)
+RASTER_TILE_SIZE = 256
+RASTER_TILE_FORMATS = {"png": ("PNG", "image/png"), "webp": ("WEBP", "image/webp")}
+RASTER_TILE_CACHE_BYTES = int(float(os.getenv("RASTER_TILE_CACHE_MB", "64")) * 1024 * 1024)
+
+class RasterTileCache:
+    """
+    Encoded raster tiles in one LRU bounded by their total size in bytes, plus
+    the display settings of each raster (overview factors, bands, value
+    ranges), which are worked out once per raster.
+    """
+    
+    def __init__(self, max_bytes=RASTER_TILE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.tiles = OrderedDict()  # (raster key, z, x, y, format) -> bytes
+        self.size = 0
+        self.displays = {}
+        self.display_locks = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+    
+    def get_tile(self, key):
+        with self.lock:
+            tile = self.tiles.get(key)
+            if tile is None:
+                self.misses += 1
+                return None
+            self.tiles.move_to_end(key)
+            self.hits += 1
+            return tile
+    
+    def put_tile(self, key, tile):
+        if len(tile) > self.max_bytes:
+            return
+        with self.lock:
+            previous = self.tiles.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            self.tiles[key] = tile
+            self.size += len(tile)
+            while self.size > self.max_bytes:
+                _, evicted = self.tiles.popitem(last=False)
+                self.size -= len(evicted)
+    
+    def get_display(self, raster_key, path):
+        """Display settings of a raster, preparing it (overviews) on first use"""
+        with self.lock:
+            display = self.displays.get(raster_key)
+            if display is not None:
+                return display
+            display_lock = self.display_locks.setdefault(raster_key, threading.Lock())
+        
+        # One request prepares the raster, concurrent ones wait for it
+        with display_lock:
+            with self.lock:
+                display = self.displays.get(raster_key)
+            if display is None:
+                display = prepare_raster_display(path)
+                with self.lock:
+                    self.displays[raster_key] = display
+        return display
+    
+    def invalidate(self, raster_key):
+        with self.lock:
+            for key in [key for key in self.tiles if key[0] == raster_key]:
+                self.size -= len(self.tiles.pop(key))
+            self.displays.pop(raster_key, None)
+            self.display_locks.pop(raster_key, None)
+    
+    def stats(self):
+        with self.lock:
+            return {"tiles": len(self.tiles), "bytes": self.size, "max_bytes": self.max_bytes, "hits": self.hits, "misses": self.misses}
+
+RASTER_TILE_CACHE = RasterTileCache()
+
+def build_external_overviews(path, factors):
+    """
+    Write the overviews of a GeoTIFF to `<path>.ovr` without opening it for update.
+    
+    rasterio only builds overviews on datasets opened "r+", so they're built
+    on a throwaway VRT that reads the GeoTIFF read-only; GDAL puts them in
+    the VRT's external .ovr, which is then moved next to the GeoTIFF in one
+    rename. Tiles being rendered from the same file never see the GeoTIFF
+    change or a half-written .ovr.
+    """
+    path = Path(path)
+    with tempfile.TemporaryDirectory(dir=path.parent) as temp_dir:
+        vrt_path = Path(temp_dir) / f"{path.stem}.vrt"
+        rasterio.shutil.copy(path, vrt_path, driver="VRT")
+        with rasterio.Env(TIFF_USE_OVR=True):
+            with rasterio.open(vrt_path, "r+") as vrt:
+                vrt.build_overviews(factors, rasterio.enums.Resampling.average)
+        os.replace(f"{vrt_path}.ovr", f"{path}.ovr")
+
+def prepare_raster_display(path):
+    """
+    Build overviews for a raster if it has none, and pick the bands and value
+    ranges used to render its tiles.
+    
+    Overviews are written to an external .ovr next to the GeoTIFF, so the
+    raster itself is never modified.
+    """
+    with rasterio.open(path) as src:
+        factors = src.overviews(1)
+        largest = max(src.width, src.height)
+    if not factors and largest > RASTER_TILE_SIZE:
+        factors = [2 ** level for level in range(1, int(np.ceil(np.log2(largest / RASTER_TILE_SIZE))) + 1)]
+        build_external_overviews(path, factors)
+    
+    with rasterio.open(path) as src:
+        bands = [1, 2, 3] if src.count >= 3 else [1]
+        # Value ranges from a decimated read, which GDAL serves from the overviews
+        step = max(1, int(np.ceil(max(src.width, src.height) / 1024)))
+        sample = src.read(bands, out_shape=(len(bands), max(1, src.height // step), max(1, src.width // step)), masked=True)
+        ranges = []
+        for band_values in sample:
+            values = band_values.compressed()
+            if np.issubdtype(values.dtype, np.floating):
+                values = values[~np.isnan(values)]
+            if src.dtypes[0] == "uint8":
+                ranges.append((0.0, 255.0))
+            elif values.size:
+                low, high = np.percentile(values, [2, 98])
+                ranges.append((float(low), float(high) if high > low else float(low) + 1.0))
+            else:
+                ranges.append((0.0, 1.0))
+        
+        if src.crs is None:
+            raise ValueError("Raster has no CRS and can't be tiled")
+        return {
+            "factors": src.overviews(1),
+            "resolution": src.res[0],
+            "bands": bands,
+            "ranges": ranges,
+            "crs": src.crs,
+            "bounds": rasterio.warp.transform_bounds(src.crs, "EPSG:3857", *src.bounds),
+            "categorical": src.dtypes[0] == "uint8" and src.count == 1 and src.colorinterp[0].name == "palette",
+        }
+
+@functools.lru_cache(maxsize=len(RASTER_TILE_FORMATS))
+def empty_raster_tile(image_format):
+    """Fully transparent tile, for tiles outside the raster"""
+    buffer = io.BytesIO()
+    Image.new("RGBA", (RASTER_TILE_SIZE, RASTER_TILE_SIZE), (0, 0, 0, 0)).save(buffer, format=image_format)
+    return buffer.getvalue()
+
+def render_raster_tile(path, display, z, x, y, image_format):
+    """
+    Render one XYZ tile of a raster as PNG/WebP bytes.
+    
+    Reads from the coarsest overview that still has at least the tile's
+    resolution, and only the part of it under the tile.
+    """
+    bounds = tile_bounds(z, x, y)
+    raster_bounds = display["bounds"]
+    if bounds[0] >= raster_bounds[2] or bounds[2] <= raster_bounds[0] or bounds[1] >= raster_bounds[3] or bounds[3] <= raster_bounds[1]:
+        return empty_raster_tile(image_format)
+    
+    # Pixel size of this tile in the raster's CRS
+    source_bounds = rasterio.warp.transform_bounds("EPSG:3857", display["crs"], *bounds)
+    tile_pixel = (source_bounds[2] - source_bounds[0]) / RASTER_TILE_SIZE
+    overview_level = None
+    for level, factor in enumerate(display["factors"]):
+        if display["resolution"] * factor <= tile_pixel:
+            overview_level = level
+    
+    bands = display["bands"]
+    data = np.full((len(bands), RASTER_TILE_SIZE, RASTER_TILE_SIZE), np.nan, dtype=np.float32)
+    open_options = {"overview_level": overview_level} if overview_level is not None else {}
+    with rasterio.open(path, **open_options) as src:
+        rasterio.warp.reproject(
+            source=rasterio.band(src, bands),
+            destination=data,
+            src_nodata=src.nodata,
+            dst_transform=rasterio.transform.from_bounds(*bounds, RASTER_TILE_SIZE, RASTER_TILE_SIZE),
+            dst_crs="EPSG:3857",
+            dst_nodata=np.nan,
+            resampling=rasterio.enums.Resampling.nearest if display["categorical"] else rasterio.enums.Resampling.bilinear,
+        )
+    
+    valid = ~np.isnan(data).any(axis=0)
+    channels = np.empty((len(bands), RASTER_TILE_SIZE, RASTER_TILE_SIZE), dtype=np.uint8)
+    for i, (low, high) in enumerate(display["ranges"]):
+        scaled = (np.nan_to_num(data[i], nan=low) - low) * (255.0 / (high - low))
+        channels[i] = np.clip(scaled, 0, 255).astype(np.uint8)
+    if len(bands) == 1:
+        channels = np.repeat(channels, 3, axis=0)
+    alpha = (valid * 255).astype(np.uint8)[np.newaxis]
+    
+    # (bands, rows, cols) -> (rows, cols, bands) for Pillow
+    image = rasterio.plot.reshape_as_image(np.concatenate([channels, alpha]))
+    buffer = io.BytesIO()
+    Image.fromarray(image, "RGBA").save(buffer, format=image_format)
+    return buffer.getvalue()
+
+def raster_tile_url(raster_name, extension="png"):
+    """URL template of the image tiles for a raster"""
+    url = f"/raster-tiles/{quote(raster_name)}/{{z}}/{{x}}/{{y}}.{extension}"
+    session_id = CURRENT_SESSION.get()
+    if session_id != DEFAULT_SESSION:
+        url += f"?session={quote(session_id)}"
+    return url
+
+@app.get("/raster-tiles/{raster_name}/{z}/{x}/{y}.{extension}")
+def get_raster_tile(raster_name: str, z: int, x: int, y: int, extension: str):
+    """Serve a PNG or WebP tile of a loaded raster"""
+    if extension not in RASTER_TILE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported tile format '{extension}' (use png or webp)")
+    if raster_name not in LOADED_RASTERS:
+        raise HTTPException(status_code=404, detail=f"Raster '{raster_name}' not found")
+    if not 0 <= z <= TILE_MAX_ZOOM or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise HTTPException(status_code=400, detail=f"Invalid tile {z}/{x}/{y}")
+    
+    image_format, media_type = RASTER_TILE_FORMATS[extension]
+    raster_key = LOADED_LAYERS.qualified(raster_name)
+    key = (raster_key, z, x, y, extension)
+    tile = RASTER_TILE_CACHE.get_tile(key)
+    if tile is None:
+        path = LOADED_RASTERS[raster_name]
+        try:
+            display = RASTER_TILE_CACHE.get_display(raster_key, path)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Raster '{raster_name}': {str(e)}")
+        tile = render_raster_tile(path, display, z, x, y, image_format)
+        RASTER_TILE_CACHE.put_tile(key, tile)
+    
+    return Response(content=tile, media_type=media_type)
+
+@app.post("/upload-raster/")
+async def upload_raster(file: UploadFile = File(...)):
+    """Upload a GeoTIFF; it is kept on disk and read block by block"""
+    if file.filename.split('.')[-1].lower() not in RASTER_EXTENSIONS:
+        return {"error": "Only GeoTIFF rasters (.tif, .tiff) are supported"}
+    
+    upload_dir = Path(tempfile.mkdtemp(prefix="upload-", dir=UPLOAD_DIR))
+    try:
+        saved = await save_upload(file, upload_dir)
+        path = new_raster_path()
+        os.replace(saved, path)
+        try:
+            # Only the header is read here
+            with rasterio.open(path) as src:
+                if src.crs is None:
+                    logger.warning(f"Raster {file.filename} has no CRS")
+        except Exception:
+            path.unlink(missing_ok=True)
+            raise
+        raster_name = register_raster(path)
+        return await run_gis(raster_reference, raster_name)
+    except Exception as e:
+        return {"error": f"Error processing raster: {str(e)}"}
+    finally:
+        shutil.rmtree(upload_dir, ignore_errors=True)
+
+# GIS functions the agent can call, keyed by the operation names in gis_operations
+GIS_FUNCTIONS = {
+    "buffer_layer": buffer_layer,
+    "intersection": intersection,
+    "union": union_layers,
+    "clip": clip_layer,
+    "dissolve": dissolve_layer,
+    "simplify": simplify_layer,
+    "reproject_layer": reproject_layer,
+    "points_within_polygon": points_within_polygon,
+    "get_layers_info": get_layers_info,
+    "zonal_statistics": zonal_statistics,
+    "clip_raster": clip_raster,
+    "resample_raster": resample_raster,
+}
+
+# Signatures of the GIS functions, used to validate the parameters of each step
+GIS_FUNCTION_SIGNATURES = {name: inspect.signature(func) for name, func in GIS_FUNCTIONS.items()}
+
+# Matches [GIS_ACTION:operation_name:param1=value1:...] tags in the assistant's reply
+GIS_ACTION_PATTERN = re.compile(r'\[GIS_ACTION:(\w+)(?::([^\]]+))?\]')
+
+# Operations whose results are memoized by RESULT_CACHE (all of them are pure
+# functions of their input layers and parameters and return a new layer)
+MEMOIZED_OPERATIONS = {
+    "buffer_layer", "intersection", "union", "clip", "dissolve",
+    "simplify", "reproject_layer", "points_within_polygon",
+}
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "256"))
+
+def layer_row_hashes(gdf):
+    """
+    One pair of 64-bit hashes per feature: (attributes with the index, geometry WKB).
+    
+    Returns:
+        uint64 array of shape (len(gdf), 2)
+    """
+    attributes = gdf.drop(columns=[gdf.geometry.name])
+    try:
+        attribute_hashes = pd.util.hash_pandas_object(attributes, index=True, categorize=False).values
+    except (TypeError, ValueError):
+        # Unhashable cell values (lists, dicts, ...)
+        attribute_hashes = pd.util.hash_pandas_object(attributes.astype(str), index=True, categorize=False).values
+    wkb = shapely.to_wkb(np.asarray(gdf.geometry.array, dtype=object))
+    wkb[pd.isna(wkb)] = b"\x00"
+    geometry_hashes = pd.util.hash_array(wkb, categorize=False)
+    return np.column_stack([attribute_hashes, geometry_hashes]).astype(np.uint64, copy=False)
+
+def layer_fingerprint(gdf, rows=None, row_hashes=None):
+    """
+    Content hash of a layer: CRS, column names, attribute values and geometry WKB.
+    
+    Two layers with the same fingerprint hold the same data, whatever their name.
+    
+    Args:
+        gdf: The layer
+        rows: Only hash the first `rows` features, same as hashing gdf.iloc[:rows]
+        row_hashes: layer_row_hashes(gdf) when already computed
+    """
+    if row_hashes is None:
+        row_hashes = layer_row_hashes(gdf if rows is None else gdf.iloc[:rows])
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str(gdf.crs).encode())
+    digest.update("\x00".join(map(str, gdf.columns)).encode())
+    digest.update(np.ascontiguousarray(row_hashes[:rows]).tobytes())
+    return digest.hexdigest()
+
+class OperationResultCache:
+    """
+    Maps (operation, normalized parameters, input layer fingerprints) to the
+    layer that already holds the result.
+    
+    Entries are evicted LRU beyond `max_entries` (the result layers themselves
+    are left alone) and dropped whenever one of their input layers or their
+    result layer is replaced.
+    """
+    
+    def __init__(self, max_entries=RESULT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # key -> (result layer name, input layer names)
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+    
+    def lookup(self, key):
+        """Name of the layer holding the result for `key`, or None"""
+        key = (CURRENT_SESSION.get(),) + key  # Results are layers of one session
+        with self.lock:
+            entry = self.entries.get(key)
+        # Checked without holding our lock: the layer store may call back into
+        # invalidate_layer when it notices a layer replaced by another worker
+        if entry is None or entry[0] not in LAYER_STORE:
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+            self.hits += 1
+        return split_layer_key(entry[0])[1]
+    
+    def store(self, key, result_layer, input_layers):
+        key = (CURRENT_SESSION.get(),) + key
+        with self.lock:
+            self.entries[key] = (LOADED_LAYERS.qualified(result_layer), tuple(map(LOADED_LAYERS.qualified, input_layers)))
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+    
+    def invalidate_layer(self, layer_name):
+        """Forget every entry that reads or produced `layer_name` (a LAYER_STORE key)"""
+        with self.lock:
+            stale = [key for key, (result_layer, input_layers) in self.entries.items()
+                     if result_layer == layer_name or layer_name in input_layers]
+            for key in stale:
+                del self.entries[key]
+    
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+RESULT_CACHE = OperationResultCache()
+
+class MemoizedCall(NamedTuple):
+    result: Any
+    key: Optional[tuple]  # None when the call can't be memoized
+    input_layers: List[str]
+    layer_name: Optional[str]  # Set when the result is an existing layer
+
+def _normalize_param(value, input_layers):
+    """Cache-key form of one parameter: layers by content, numbers as floats"""
+    if isinstance(value, str):
+        name = value.strip()
+        if name in LOADED_LAYERS:
+            input_layers.append(name)
+            return ("layer", LOADED_LAYERS.fingerprint(name))
+        try:
+            return ("number", float(name))
+        except ValueError:
+            return ("text", name)
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return ("number", float(value))
+    if value is None or isinstance(value, bool):
+        return ("value", value)
+    raise TypeError(f"Can't memoize parameter of type {type(value).__name__}")
+
+def memoized_call(operation, func, args=(), kwargs=None):
+    """
+    Call a GIS function, or return the layer that already holds its result.
+    
+    Args:
+        operation: Operation name (a key of GIS_FUNCTIONS)
+        func: The function to call
+        args, kwargs: Arguments for the call
+        
+    Returns:
+        MemoizedCall. On a miss the caller registers the result layer and then
+        calls RESULT_CACHE.store(call.key, layer_name, call.input_layers).
+    """
+    kwargs = kwargs or {}
+    key = None
+    input_layers = []
+    if operation in MEMOIZED_OPERATIONS:
+        try:
+            bound = inspect.signature(func).bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = (operation,) + tuple(
+                (name, _normalize_param(value, input_layers)) for name, value in bound.arguments.items()
+            )
+        except TypeError:
+            key = None  # Let the call itself report bad arguments
+    
+    if key is not None:
+        layer_name = RESULT_CACHE.lookup(key)
+        if layer_name is not None:
+            return MemoizedCall(LOADED_LAYERS[layer_name], key, input_layers, layer_name)
+    
+    return MemoizedCall(func(*args, **kwargs), key, input_layers, None)
+
+# /execute-command/ evaluates commands with a small AST interpreter instead of
+# exec: only the names, attributes and node types below are accepted
+COMMAND_CACHE_SIZE = int(os.getenv("COMMAND_CACHE_SIZE", "1024"))
+
+COMMAND_FUNCTIONS = {
+    # GIS processing functions (memoized through RESULT_CACHE)
+    "buffer_layer": buffer_layer,
+    "intersection": intersection,
+    "union": union_layers,
+    "clip": clip_layer,
+    "dissolve": dissolve_layer,
+    "simplify": simplify_layer,
+    "reproject_layer": reproject_layer,
+    "points_within_polygon": points_within_polygon,
+    
+    # Layer management
+    "get_layer": get_layer,
+    "list_layers": list_layers,
+    "layer_info": layer_info,
+    
+    # Rasters
+    "zonal_statistics": zonal_statistics,
+    "clip_raster": clip_raster,
+    "resample_raster": resample_raster,
+    "list_rasters": list_rasters,
+    
+    # Harmless builtins
+    "len": len, "str": str, "int": int, "float": float, "round": round, "abs": abs,
+    "min": min, "max": max, "sum": sum, "sorted": sorted, "list": list,
+}
+
+# Attributes and methods that can be used on values (layers, series, dicts)
+COMMAND_ATTRIBUTES = {
+    "crs", "total_bounds", "bounds", "columns", "dtypes", "shape", "geometry",
+    "geom_type", "area", "length", "centroid", "is_valid", "to_epsg",
+    "head", "tail", "copy", "to_crs", "buffer", "simplify", "explode",
+    "unique", "nunique", "value_counts", "describe", "count", "sum", "mean", "min", "max",
+    "keys", "values", "items", "get",
+}
+
+COMMAND_NODES = (
+    ast.Expression, ast.Call, ast.keyword, ast.Name, ast.Load, ast.Constant,
+    ast.Attribute, ast.Subscript, ast.Slice, ast.List, ast.Tuple, ast.Dict,
+    ast.UnaryOp, ast.USub, ast.UAdd, ast.BinOp, ast.Add, ast.Sub, ast.Mult, ast.Div,
+)
+
+@functools.lru_cache(maxsize=COMMAND_CACHE_SIZE)
+def parse_command(command):
+    """
+    Parse and validate a command, once per distinct command text.
+    
+    Args:
+        command: A single expression, e.g. buffer_layer("Layer 1", 500)
+        
+    Returns:
+        The validated ast.Expression
+        
+    Raises:
+        SyntaxError: The command is not a Python expression
+        ValueError: The command uses something outside the whitelist
+    """
+    tree = ast.parse(command, mode="eval")
+    for node in ast.walk(tree):
+        if not isinstance(node, COMMAND_NODES):
+            raise ValueError(f"{type(node).__name__} is not allowed in commands")
+        if isinstance(node, ast.Name) and node.id not in COMMAND_FUNCTIONS and node.id not in ("layers", "print"):
+            raise ValueError(f"Unknown name '{node.id}'")
+        if isinstance(node, ast.Attribute) and node.attr not in COMMAND_ATTRIBUTES:
+            raise ValueError(f"Attribute '{node.attr}' is not allowed")
+        if isinstance(node, ast.keyword) and node.arg is None:
+            raise ValueError("**kwargs is not allowed in commands")
+    return tree
+
+class CommandRun:
+    """
+    One evaluation of a parsed command.
+    
+    print() writes to `output` and the memoized GIS calls are recorded in
+    `memoized_calls`, both per run, so concurrent commands never share state.
+    """
+    
+    def __init__(self):
+        self.output = io.StringIO()
+        self.memoized_calls = []
+    
+    def print(self, *args, sep=" ", end="\n"):
+        self.output.write(sep.join(map(str, args)) + end)
+    
+    def evaluate(self, node):
+        if isinstance(node, ast.Expression):
+            return self.evaluate(node.body)
+        if isinstance(node, ast.Constant):
+            return node.value
+        if isinstance(node, ast.Name):
+            if node.id == "layers":
+                return LOADED_LAYERS
+            if node.id == "print":
+                return self.print
+            return COMMAND_FUNCTIONS[node.id]
+        if isinstance(node, ast.List):
+            return [self.evaluate(element) for element in node.elts]
+        if isinstance(node, ast.Tuple):
+            return tuple(self.evaluate(element) for element in node.elts)
+        if isinstance(node, ast.Dict):
+            return {self.evaluate(key): self.evaluate(value) for key, value in zip(node.keys, node.values)}
+        if isinstance(node, ast.Attribute):
+            return getattr(self.evaluate(node.value), node.attr)
+        if isinstance(node, ast.Subscript):
+            return self.evaluate(node.value)[self.evaluate(node.slice)]
+        if isinstance(node, ast.Slice):
+            return slice(*(self.evaluate(part) if part is not None else None for part in (node.lower, node.upper, node.step)))
+        if isinstance(node, ast.UnaryOp):
+            operand = self.evaluate(node.operand)
+            return -operand if isinstance(node.op, ast.USub) else +operand
+        if isinstance(node, ast.BinOp):
+            left, right = self.evaluate(node.left), self.evaluate(node.right)
+            # Numbers only, so "x" * 10**9 can't blow up the worker
+            if not all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in (left, right)):
+                raise TypeError("Arithmetic is only supported on numbers")
+            if isinstance(node.op, ast.Add):
+                return left + right
+            if isinstance(node.op, ast.Sub):
+                return left - right
+            if isinstance(node.op, ast.Mult):
+                return left * right
+            return left / right
+        if isinstance(node, ast.Call):
+            args = [self.evaluate(arg) for arg in node.args]
+            kwargs = {keyword.arg: self.evaluate(keyword.value) for keyword in node.keywords}
+            if isinstance(node.func, ast.Name) and node.func.id in MEMOIZED_OPERATIONS:
+                call = memoized_call(node.func.id, COMMAND_FUNCTIONS[node.func.id], args, kwargs)
+                self.memoized_calls.append(call)
+                return call.result
+            return self.evaluate(node.func)(*args, **kwargs)
+        raise ValueError(f"{type(node).__name__} is not allowed in commands")
+
+def run_command(command):
+    """Parse (cached) and evaluate a command; returns (result, CommandRun)"""
+    run = CommandRun()
+    return run.evaluate(parse_command(command)), run
+
+# Optional callback receiving progress events of run_gis_plan. A ContextVar so
+# that it follows the request/job through the agent graph's tasks.
+PLAN_STEP_LISTENER: ContextVar[Optional[Callable[[str, Dict[str, Any]], None]]] = ContextVar("PLAN_STEP_LISTENER", default=None)
+
+async def run_gis_plan(actions, params_dict=None, params_list=None, include_geojson=True):
+    """
+    Run the GIS steps of an agent plan, running independent steps concurrently.
+    
+    If a listener is set in PLAN_STEP_LISTENER, it is called with ("plan", info)
+    before the first step and with ("step", entry) as soon as each step finishes.
+    (The assistant node also reports its answer as ("assistant", info).)
+    
+    Args:
+        actions: Operation names, one per step
+        params_dict: Parameters keyed by operation name (used when params_list has no entry)
+        params_list: Parameters of each step, aligned with actions
+        include_geojson: Whether result entries carry the encoded GeoJSON
+        
+    Returns:
+        Dict with the "results" entries and the "intermediate_layers"
+    """
+    params_dict = params_dict or {}
+    params_list = params_list or []
+    listener = PLAN_STEP_LISTENER.get()
+    results = []
+    
+    # Create a dependency tracker
+    tracker = OperationDependencyTracker()
+    
+    available_functions = GIS_FUNCTIONS
+    
+    # Register all operations in the tracker. Step N is "Result_N" (as the model
+    # is told to reference it) and its output layer name is reserved up front, in
+    # plan order, so a step can also be referenced by the "Layer N" it creates
+    # and names don't depend on which step finishes first
+    output_names = SESSIONS.allocate_names("Layer", len(actions)) if actions else []
+    for i, action in enumerate(actions):
+        # Prefer the per-step parameters so repeated actions keep their own params
+        params = params_list[i] if i < len(params_list) else params_dict.get(action, {})
+        tracker.add_operation(f"Result_{i + 1}", action, params, output_name=output_names[i])
+    
+    async def execute_operation(op):
+        """Run one step and build its entry for `results`"""
+        operation_id = op["id"]
+        action = op["type"]
+        step = int(operation_id.split("_")[1])
+        
+        # Get the function
+        if action not in available_functions:
+            return {
+                "action": action,
+                "status": "unknown_action",
+                "message": f"Unknown GIS action: {action}",
+                "step": step
+            }, None
+            
+        func = available_functions[action]
+        
+        # Resolve dependencies with actual results
+        params = tracker.resolve_dependencies(op["params"])
+        
+        # Check required parameters
+        sig = GIS_FUNCTION_SIGNATURES[action]
+        param_names = list(sig.parameters.keys())
+        
+        missing_params = [p for p in param_names if p not in params and 
+                        sig.parameters[p].default == inspect.Parameter.empty]
+        
+        if missing_params:
+            return {
+                "action": action,
+                "status": "parameter_missing",
+                "message": f"Missing required parameters for {action}: {', '.join(missing_params)}",
+                "step": step
+            }, None
+        
+        # Filter parameters to only include those accepted by the function
+        filtered_params = {k: v for k, v in params.items() if k in param_names}
+        
+        # Execute the function with the parameters (or reuse the layer from an identical earlier call)
+        started = time.perf_counter()
+        call = await run_gis(memoized_call, action, func, kwargs=filtered_params)
+        result_data = call.result
+        compute_ms = (time.perf_counter() - started) * 1000
+        
+        # Process the result
+        if isinstance(result_data, gpd.GeoDataFrame):
+            if call.layer_name is not None:
+                layer_id = call.layer_name
+            else:
+                # The name reserved for this step
+                layer_id = op["output_name"]
+                
+                # Store with the Layer ID format
+                register_layer(layer_id, result_data, {
+                    "operation": action,
+                    "params": filtered_params,
+                    "inputs": [value for value in filtered_params.values() if isinstance(value, str) and value in LOADED_LAYERS],
+                })
+                if call.key is not None:
+                    RESULT_CACHE.store(call.key, layer_id, call.input_layers)
+                if debug_sampled():
+                    logger.debug(f"LOADED_LAYERS keys after: {list(LOADED_LAYERS.keys())}")
+            
+            # Map the operation_id to the layer_id so later steps can reference it
+            tracker.id_mapping[operation_id] = layer_id
+            
+            # Pre-encode the GeoJSON for the frontend unless the client renders from tiles
+            geojson_data = await run_gis(geojson_fragment, result_data) if include_geojson else None
+            
+            return {
+                "action": action,
+                "status": "executed",
+                "message": f"Successfully executed {action}. Created layer: {layer_id}",
+                "result": layer_id,  # Use layer_id in the results
+                "geojson": geojson_data,
+                "layer": layer_reference(layer_id, result_data),
+                "step": step,
+                "cached": call.layer_name is not None,
+                "compute_ms": round(compute_ms, 3)
+            }, result_data
+        
+        # Raster operations return the name of the raster they created
+        if isinstance(result_data, str) and result_data in LOADED_RASTERS:
+            return {
+                "action": action,
+                "status": "executed",
+                "message": f"Successfully executed {action}. Created raster: {result_data}",
+                "result": result_data,
+                "raster": await run_gis(raster_reference, result_data),
+                "step": step,
+                "compute_ms": round(compute_ms, 3)
+            }, result_data
+        
+        # For other types of results
+        return {
+            "action": action,
+            "status": "executed",
+            "message": f"Successfully executed {action}",
+            "result": str(result_data),
+            "step": step,
+            "compute_ms": round(compute_ms, 3)
+        }, result_data
+    
+    async def timed_operation(op):
+        started = time.perf_counter()
+        try:
+            entry, result_data = await execute_operation(op)
+        except Exception as e:
+            # Handle errors
+            logger.error(f"Error executing {op['type']}: {str(e)}")
+            logger.error(traceback.format_exc())
+            entry, result_data = {
+                "action": op["type"],
+                "status": "error",
+                "message": f"Error executing {op['type']}: {str(e)}",
+                "step": int(op["id"].split("_")[1])
+            }, None
+        duration = time.perf_counter() - started
+        PLAN_STEP_SECONDS.labels(op["type"], entry["status"]).observe(duration)
+        entry["duration_ms"] = round(duration * 1000, 3)
+        return entry, result_data
     
-    Returns:
-        A list of layer names
-    """
-    return list(LOADED_LAYERS.keys())
-
-def layer_info(layer_name):
-    """
-    Get information about a layer.
+    if listener is not None:
+        listener("plan", {"total_steps": len(actions), "actions": list(actions)})
     
-    Args:
-        layer_name: The name of the layer to get info for
+    # Schedule the DAG: keep up to GIS_PLAN_PARALLELISM ready steps running and
+    # start dependents as soon as the steps they wait on complete
+    running = {}
+    while True:
+        for op in tracker.pop_executable_operations(GIS_PLAN_PARALLELISM - len(running)):
+            running[asyncio.create_task(timed_operation(op))] = op
         
-    Returns:
-        A dictionary with layer information
-    """
-    if layer_name not in LOADED_LAYERS:
-        raise ValueError(f"Layer '{layer_name}' not found")
+        if not running:
+            break  # No more operations can be executed
+        
+        done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            op = running.pop(task)
+            entry, result_data = task.result()
+            results.append(entry)
+            if listener is not None:
+                listener("step", entry)
+            # Failed steps are marked completed too, with no result
+            tracker.mark_completed(op["id"], result_data)
     
-    layer = LOADED_LAYERS[layer_name]
+    # Steps that could never run because they reference unknown or circular results
+    _, blocked = tracker.topological_order()
+    for operation_id in blocked:
+        op = tracker.operations_by_id[operation_id]
+        missing = [dep for dep in tracker.dependencies[operation_id] if dep not in tracker.results]
+        entry = {
+            "action": op["type"],
+            "status": "dependency_missing",
+            "message": f"Could not run {op['type']}: unresolved inputs {', '.join(missing)}",
+            "step": int(operation_id.split("_")[1])
+        }
+        results.append(entry)
+        if listener is not None:
+            listener("step", entry)
+    
+    results.sort(key=lambda entry: entry["step"])
     
     return {
-        "name": layer_name,
-        "geometry_type": layer.geometry.geom_type.value_counts().to_dict(),
-        "crs": str(layer.crs),
-        "feature_count": len(layer),
-        "columns": list(layer.columns),
-        "bounds": layer.total_bounds.tolist()
+        "results": results,
+        "intermediate_layers": list(tracker.results.keys())
     }
 
-def reproject_layer(layer_name):
+# Queries that already name an operation and its layers ("buffer Layer 1 500",
+# "clip Layer 2 by Layer 3") are parsed locally instead of asking the model
+FAST_PATH_ENABLED = os.getenv("GIS_FAST_PATH", "1") != "0"
+
+# (operation, pattern) per statement form. {field} is replaced by a group for
+# that parameter: loaded layer names for *layer* fields, a number for distance
+# and tolerance, a column name otherwise.
+FAST_PATH_GRAMMAR = [
+    ("buffer_layer", r"(?:create (?:a )?)?buffer (?:around |of )?{layer_name} (?:by |of |with (?:a )?(?:distance (?:of )?)?)?{distance}(?: ?(?:m|meters?|metres?))?"),
+    ("simplify", r"simplify {layer_name} (?:by |with |with tolerance |tolerance )?{tolerance}"),
+    ("clip", r"clip {layer_name} (?:by|with|to|using) {clip_layer_name}"),
+    ("intersection", r"(?:intersect|intersection(?: of)?) {layer1_name} (?:with|and|by) {layer2_name}"),
+    ("union", r"(?:union|merge|combine)(?: of)? {layer1_name} (?:with|and) {layer2_name}"),
+    ("dissolve", r"dissolve {layer_name}(?: (?:by|on) {column})?(?: (?:with|computing) {aggregations})?"),
+    ("reproject_layer", r"reproject {layer_name}(?: to (?:wgs ?84|epsg:? ?4326))?"),
+    ("points_within_polygon", r"(?:find )?points (?:of |from |in )?{points_layer_name} (?:within|inside|in) {polygon_layer_name}"),
+    ("get_layers_info", r"(?:describe|(?:layer |show )?info(?: (?:for|of|about))?) {layer}"),
+]
+FAST_PATH_NUMBER_FIELDS = {"distance", "tolerance"}
+FAST_PATH_AGGREGATION = r"(?:sum|mean|count|min|max)(?: ?\(\w+\))?"
+FAST_PATH_FIELD_PATTERNS = {"aggregations": rf"{FAST_PATH_AGGREGATION}(?:\s*,\s*{FAST_PATH_AGGREGATION})*"}
+# Several statements can be chained: "buffer Layer 1 500; clip Layer 2 by Layer 3"
+FAST_PATH_STATEMENT_SEPARATOR = re.compile(r"\s*(?:;|\bthen\b|\band then\b)\s*", re.IGNORECASE)
+
+@functools.lru_cache(maxsize=8)
+def _fast_path_patterns(layer_names):
+    """Compiled FAST_PATH_GRAMMAR for one set of loaded layer names"""
+    # Longest names first so "Layer 10" isn't matched as "Layer 1"
+    names = "|".join(re.escape(name) for name in sorted(layer_names, key=len, reverse=True))
+    
+    def group(match):
+        field = match.group(1)
+        if "layer" in field:
+            return f"(?P<{field}>{names})"
+        if field in FAST_PATH_NUMBER_FIELDS:
+            return rf"(?P<{field}>-?\d+(?:\.\d+)?)"
+        if field in FAST_PATH_FIELD_PATTERNS:
+            return rf"(?P<{field}>{FAST_PATH_FIELD_PATTERNS[field]})"
+        return rf"(?P<{field}>[\w.]+)"
+    
+    return [
+        (operation, re.compile(re.sub(r"\{(\w+)\}", group, pattern), re.IGNORECASE))
+        for operation, pattern in FAST_PATH_GRAMMAR
+    ]
+
+def parse_fast_path(query, layer_names):
     """
-    Reproject a layer to the specified EPSG coordinate system.
+    Parse a query written as explicit operations, without the model.
     
     Args:
-        layer_name: The name of the layer to reproject
-        epsg: The target EPSG code (default: 4326 for WGS84)
+        query: The user's query
+        layer_names: Names of the loaded layers (only these are accepted as layers)
         
     Returns:
-        A new GeoDataFrame with the reprojected geometries
+        (actions, params_list), or None when any statement is free-form text
+        and the query has to go to the model
     """
-    epsg = 4326
-    if layer_name not in LOADED_LAYERS:
-        raise ValueError(f"Layer '{layer_name}' not found")
-
-    layer = LOADED_LAYERS[layer_name]
-
-    if layer.crs is None:
-        raise ValueError(f"Layer '{layer_name}' does not have a CRS. Please set the CRS before reprojecting.")
-
-    return layer.to_crs(epsg=epsg)
+    layer_names = tuple(sorted(layer_names))
+    if not layer_names:
+        return None
+    by_lower_name = {name.lower(): name for name in layer_names}
+    patterns = _fast_path_patterns(layer_names)
+    
+    actions = []
+    params_list = []
+    text = re.sub(r"\s+", " ", query).strip().rstrip(".!?")
+    for statement in FAST_PATH_STATEMENT_SEPARATOR.split(text):
+        if not statement:
+            continue
+        for operation, pattern in patterns:
+            match = pattern.fullmatch(statement)
+            if match:
+                break
+        else:
+            return None
+        
+        params = {}
+        for field, value in match.groupdict().items():
+            if value is None:
+                continue
+            params[field] = by_lower_name.get(value.lower(), value) if "layer" in field else value
+        actions.append(operation)
+        params_list.append(params)
+    
+    return (actions, params_list) if actions else None
 
-def points_within_polygon(points_layer_name, polygon_layer_name):
-    if points_layer_name not in LOADED_LAYERS:
-        raise ValueError(f"Layer '{points_layer_name}' not found")
-    if polygon_layer_name not in LOADED_LAYERS:
-        raise ValueError(f"Layer '{polygon_layer_name}' not found")
+def describe_plan(actions, params_list):
+    """Assistant message for a plan that didn't come from the model"""
+    steps = [
+        f"{action}({', '.join(f'{key}={value}' for key, value in params.items())})"
+        for action, params in zip(actions, params_list)
+    ]
+    return "Running " + "; then ".join(steps) + "."
 
-    points = LOADED_LAYERS[points_layer_name]
-    polygons = LOADED_LAYERS[polygon_layer_name]
+# Plans returned by the model for a query, so repeated queries skip the LLM call
+PLAN_CACHE_SIZE = int(os.getenv("PLAN_CACHE_SIZE", "512"))
+PLAN_CACHE_TTL = float(os.getenv("PLAN_CACHE_TTL", "3600"))  # seconds, 0 = never expire
+PLAN_CACHE_PATH = os.getenv("PLAN_CACHE_PATH")  # Optional JSON file to persist the cache across restarts
 
-    if points.crs != polygons.crs:
-        polygons = polygons.to_crs(points.crs)
+def normalize_query(query):
+    """Case, whitespace and trailing punctuation don't change the plan"""
+    return re.sub(r"\s+", " ", query).strip().rstrip(".!?").strip().lower()
 
-    # Perform spatial join
-    result = gpd.sjoin(points, polygons, predicate="within", how="inner")
+class PlanCache:
+    """
+    Parsed planner answers (message, actions, params) keyed on the normalized
+    query and the model. The model never sees the layer list, so a plan is
+    reused whatever else is loaded, as long as the layers it references
+    (recorded in the plan's "layers") still exist.
+    
+    Entries expire after `ttl` seconds and are evicted LRU beyond
+    `max_entries`. When `path` is set the cache is loaded from it on start
+    and written back by save() on shutdown.
+    """
+    
+    def __init__(self, max_entries=PLAN_CACHE_SIZE, ttl=PLAN_CACHE_TTL, path=PLAN_CACHE_PATH):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = Path(path) if path else None
+        self.entries = OrderedDict()  # key -> (stored at, plan)
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.load()
+    
+    @staticmethod
+    def key(query, model_name):
+        payload = json.dumps([normalize_query(query), model_name])
+        return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+    
+    @staticmethod
+    def referenced_layers(params_list, layer_names):
+        """Names among `layer_names` that a plan's parameters refer to"""
+        return sorted({value for params in params_list for value in params.values()
+                       if isinstance(value, str) and value in layer_names})
+    
+    def _expired(self, stored_at):
+        return self.ttl > 0 and time.time() - stored_at > self.ttl
+    
+    def lookup(self, key, layer_names):
+        """The cached plan for `key`, or None if there's none or a layer it uses is gone"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or self._expired(entry[0]):
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+            if not set(entry[1].get("layers", ())) <= set(layer_names):
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+    
+    def store(self, key, plan):
+        with self.lock:
+            self.entries[key] = (time.time(), plan)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+    
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+    
+    def load(self):
+        if self.path is None or not self.path.exists():
+            return
+        try:
+            stored = json.loads(self.path.read_text(encoding="utf-8"))
+            with self.lock:
+                for key, stored_at, plan in stored:
+                    if not self._expired(stored_at):
+                        self.entries[key] = (stored_at, plan)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+        except Exception as e:
+            logger.warning(f"Could not load plan cache from {self.path}: {e}")
+    
+    def save(self):
+        if self.path is None:
+            return
+        with self.lock:
+            stored = [[key, stored_at, plan] for key, (stored_at, plan) in self.entries.items()
+                      if not self._expired(stored_at)]
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+            temp_path.write_text(json.dumps(stored), encoding="utf-8")
+            os.replace(temp_path, self.path)
+        except Exception as e:
+            logger.warning(f"Could not save plan cache to {self.path}: {e}")
+    
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
 
-    return result
+PLAN_CACHE = PlanCache()
 
-def create_gis_agent(model_name="gpt-4"):
+def create_gis_agent(model_name=DEFAULT_MODEL):
+    from langgraph.graph import StateGraph, END
+    
     # Define the graph
     graph_builder = StateGraph(AgentState)
     
-    # Define the main assistant node
-    def assistant_node(state: AgentState):
-        """Process user input and generate a response with possible GIS actions"""
-        # Prepare messages with system context
-        messages = [
-            {
-                "role": "system",
-                "content": f"""You are an advanced GIS (Geographic Information System) assistant.
+    # The system prompt only depends on gis_operations, so build it once per graph
+    system_message = {
+        "role": "system",
+        "content": f"""You are an advanced GIS (Geographic Information System) assistant.
                 Provide detailed explanations about geographic concepts, spatial analysis, and
                 GIS technologies. 
                 
@@ -562,14 +4279,14 @@ def create_gis_agent(model_name="gpt-4"):
                 For multi-step operations, provide ALL steps in the correct sequence. 
                 Each step will create a intermediate result that can be referenced in subsequent steps.
                 
-                Make sure the result layer are being called in the format of: Result_ID
-
-                When referring to results from previous steps, use the format Layer ID:
+                When referring to the result of a previous step, use Result_N, where N is the
+                number of that step in your list (Result_1 is the output of the first step):
                 - Step 1: [GIS_ACTION:buffer_layer:layer_name=Layer 1:distance=500]
-                - Step 2: [GIS_ACTION:intersection:layer1_name=Layer 2:layer2_name=Layer 3]
-                - Step 3: ..
+                - Step 2: [GIS_ACTION:buffer_layer:layer_name=Layer 2:distance=200]
+                - Step 3: [GIS_ACTION:union:layer1_name=Result_1:layer2_name=Result_2]
                 
                 Ensure each step's output is properly referenced as input for subsequent steps.
+                Steps that don't reference each other's results may run at the same time.
                 Don't suggest operations unless they're clearly relevant to the user's query.
                 
                 IMPORTANT: Pay attention if the user specifies how many steps they want. If they ask for a 
@@ -578,21 +4295,79 @@ def create_gis_agent(model_name="gpt-4"):
                 try to simplify your approach to use fewer operations while still achieving the result. Additionally,
                 you must provide any question related to this specific software, meaning understand the avaible functions you have
                 """
-            }
-        ]
+    }
+    
+    # Define the main assistant node
+    async def assistant_node(state: AgentState):
+        """Process user input and generate a response with possible GIS actions"""
+        # Prepare messages with system context
+        messages = [system_message]
         
         # Add conversation history
         for msg in state['messages']:
             messages.append(msg)
         
+        started = time.perf_counter()
+        
+        def planned(message, actions, params_dict, params_list, planner):
+            """State update for a plan, reported to streaming clients first"""
+            planner_ms = (time.perf_counter() - started) * 1000
+            PLANNER_DECISIONS.labels(planner).inc()
+            if debug_sampled():
+                logger.debug(f"Planner {planner} ({planner_ms:.1f} ms): {actions}")
+            listener = PLAN_STEP_LISTENER.get()
+            if listener is not None:
+                listener("assistant", {"message": message, "actions": actions, "planner": planner, "planner_ms": planner_ms})
+            return {
+                "messages": state['messages'] + [{"role": "assistant", "content": message}],
+                "actions": actions,
+                "params_dict": params_dict,
+                "params_list": params_list,
+                "results": [],
+                "intermediate_layers": [],
+                "planner": planner,
+                "planner_ms": planner_ms
+            }
+        
+        # Only a fresh question can skip the model; with history the answer
+        # depends on the whole conversation
+        cache_key = None
+        if len(state['messages']) == 1 and state['messages'][0].get('role') == 'user':
+            query = state['messages'][0]['content']
+            layer_names = LOADED_LAYERS.keys()
+            
+            if FAST_PATH_ENABLED:
+                parsed = parse_fast_path(query, layer_names)
+                if parsed is not None:
+                    actions, params_list = parsed
+                    params_dict = {action: params for action, params in zip(actions, params_list)}
+                    return planned(describe_plan(actions, params_list), actions, params_dict, params_list, "fast_path")
+            
+            cache_key = PLAN_CACHE.key(query, model_name)
+            plan = PLAN_CACHE.lookup(cache_key, layer_names)
+            if plan is not None:
+                return planned(
+                    plan["message"],
+                    list(plan["actions"]),
+                    {action: dict(params) for action, params in plan["params_dict"].items()},
+                    [dict(params) for params in plan["params_list"]],
+                    "plan_cache"
+                )
+        
         try:
             # Call OpenAI API instead of Ollama
-            response = client.chat.completions.create(
-                model=model_name,
-                messages=messages,
-                temperature=0.7,
-                max_tokens=500
-            )
+            llm_started = time.perf_counter()
+            try:
+                response = await get_openai_client().chat.completions.create(
+                    model=model_name,
+                    messages=messages,
+                    temperature=0.7,
+                    max_tokens=500
+                )
+            except Exception:
+                LLM_REQUEST_SECONDS.labels(model_name, "error").observe(time.perf_counter() - llm_started)
+                raise
+            LLM_REQUEST_SECONDS.labels(model_name, "ok").observe(time.perf_counter() - llm_started)
             
             # Extract content from OpenAI response
             try:
@@ -600,43 +4375,44 @@ def create_gis_agent(model_name="gpt-4"):
             except Exception as e:
                 logger.error(f"Error extracting content from OpenAI response: {e}")
                 content = "I'm having trouble processing your request."
+                cache_key = None  # Don't remember the fallback answer
             
             # Identify GIS actions and parameters in the response using regex
-            import re
-            action_patterns = re.findall(r'\[GIS_ACTION:(\w+)(?::([^\]]+))?\]', content)
+            action_patterns = GIS_ACTION_PATTERN.findall(content)
             actions = []
             params_dict = {}
+            params_list = []
             
             for action, params_str in action_patterns:
                 actions.append(action)
+                params = {}
                 # Parse parameters if they exist
                 if params_str:
-                    params = {}
                     param_pairs = params_str.split(':')
                     for pair in param_pairs:
                         if '=' in pair:
                             key, value = pair.split('=', 1)
                             params[key.strip()] = value.strip()
                     params_dict[action] = params
+                params_list.append(params)
             
-            logger.info(f"Identified actions: {actions} with parameters: {params_dict}")
+            if debug_sampled():
+                logger.debug(f"Identified actions: {actions} with parameters: {params_dict}")
             
             # Clean up the response by removing the action tags
-            cleaned_content = re.sub(r'\[GIS_ACTION:\w+(?::[^\]]+)?\]', '', content).strip()
+            cleaned_content = GIS_ACTION_PATTERN.sub('', content).strip()
             
-            # Return the state update
-            return {
-                "messages": state['messages'] + [
-                    {
-                        "role": "assistant",
-                        "content": cleaned_content
-                    }
-                ],
-                "actions": actions,
-                "params_dict": params_dict,
-                "results": [],
-                "intermediate_layers": []
-            }
+            if cache_key is not None:
+                PLAN_CACHE.store(cache_key, {
+                    "message": cleaned_content,
+                    "actions": actions,
+                    "params_dict": {action: dict(params) for action, params in params_dict.items()},
+                    "params_list": [dict(params) for params in params_list],
+                    "layers": PlanCache.referenced_layers(params_list, layer_names)
+                })
+            
+            # Let streaming clients show the answer before any step has run
+            return planned(cleaned_content, actions, params_dict, params_list, "llm")
             
         except Exception as e:
             logger.error(f"Error in assistant node: {str(e)}")
@@ -650,163 +4426,22 @@ def create_gis_agent(model_name="gpt-4"):
                 ],
                 "actions": [],
                 "params_dict": {},
+                "params_list": [],
                 "results": [],
-                "intermediate_layers": []
+                "intermediate_layers": [],
+                "planner": "llm",
+                "planner_ms": (time.perf_counter() - started) * 1000
             }
     
     # Define the action processor node
-    def action_processor(state: AgentState):
+    async def action_processor(state: AgentState):
         """Process multi-step GIS actions with dependency tracking"""
-        actions = state.get('actions', [])
-        params_dict = state.get('params_dict', {})
-        results = []
-        
-        # Create a dependency tracker
-        tracker = OperationDependencyTracker()
-        
-        # Get all available GIS functions from your code
-        available_functions = {
-            "buffer_layer": buffer_layer,
-            "intersection": intersection,
-            "union": union_layers,
-            "clip": clip_layer,
-            "dissolve": dissolve_layer,
-            "simplify": simplify_layer,
-            "reproject_layer": reproject_layer,
-            "points_within_polygon": points_within_polygon,
-            "get_layers_info": get_layers_info,
-        }
-        
-        # Register all operations in the tracker
-        for i, action in enumerate(actions):
-            operation_id = f"Result_{len(LOADED_LAYERS)+i+1}"  # Use i to ensure unique IDs
-            tracker.add_operation(operation_id, action, params_dict.get(action, {}))
-        
-        # Track which operations we've already processed to avoid infinite loops
-        processed_ops = set()
-        
-        # Process executable operations until all are complete
-        while True:
-            executable = tracker.get_executable_operations()
-            # Filter out operations we've already processed
-            executable = [op for op in executable if op["id"] not in processed_ops]
-            
-            if not executable:
-                break  # No more operations can be executed
-                
-            for op in executable:
-                operation_id = op["id"]
-                # Mark this operation as processed immediately to prevent re-processing
-                processed_ops.add(operation_id)
-                action = op["type"]
-                
-                try:
-                    # Get the function
-                    if action not in available_functions:
-                        results.append({
-                            "action": action,
-                            "status": "unknown_action",
-                            "message": f"Unknown GIS action: {action}",
-                            "step": int(operation_id.split("_")[1])
-                        })
-                        tracker.mark_completed(operation_id, None)
-                        continue
-                        
-                    func = available_functions[action]
-                    
-                    # Resolve dependencies with actual results
-                    params = tracker.resolve_dependencies(op["params"])
-                    
-                    # Check required parameters
-                    sig = inspect.signature(func)
-                    param_names = list(sig.parameters.keys())
-                    
-                    missing_params = [p for p in param_names if p not in params and 
-                                    sig.parameters[p].default == inspect.Parameter.empty]
-                    
-                    if missing_params:
-                        results.append({
-                            "action": action,
-                            "status": "parameter_missing",
-                            "message": f"Missing required parameters for {action}: {', '.join(missing_params)}",
-                            "step": int(operation_id.split("_")[1])
-                        })
-                        tracker.mark_completed(operation_id, None)
-                        continue
-                    
-                    # Filter parameters to only include those accepted by the function
-                    filtered_params = {k: v for k, v in params.items() if k in param_names}
-                    
-                    # Execute the function with the parameters
-                    result_data = func(**filtered_params)
-                    
-                    # Process the result
-                    if isinstance(result_data, gpd.GeoDataFrame):
-                        # Create a consistent layer ID
-                        layer_id = f"Layer {len(LOADED_LAYERS)+1}"
-                        
-                        # Store with the Layer ID format
-                        LOADED_LAYERS[layer_id] = result_data
-                        if logger.isEnabledFor(logging.DEBUG):
-                            logger.debug(f"LOADED_LAYERS keys after: {list(LOADED_LAYERS.keys())}")
-                        
-                        # Convert to GeoJSON for the frontend
-                        geojson_data = json.loads(result_data.to_json())
-                        
-                        # Ensure proper GeoJSON structure
-                        if "type" not in geojson_data:
-                            geojson_data = {
-                                "type": "FeatureCollection",
-                                "features": geojson_data.get("features", [])
-                            }
-                        
-                        # Mark operation as completed and store result, but map the operation_id to the layer_id
-                        tracker.mark_completed(operation_id, result_data)
-                        
-                        # Create a mapping between operation_id and layer_id for future reference
-                        if not hasattr(tracker, 'id_mapping'):
-                            tracker.id_mapping = {}
-                        tracker.id_mapping[operation_id] = layer_id
-                        
-                        results.append({
-                            "action": action,
-                            "status": "executed",
-                            "message": f"Successfully executed {action}. Created layer: {layer_id}",
-                            "result": layer_id,  # Use layer_id in the results
-                            "geojson": geojson_data,
-                            "step": int(operation_id.split("_")[1])
-                        })
-                    else:
-                        # For other types of results
-                        tracker.mark_completed(operation_id, result_data)
-                        
-                        results.append({
-                            "action": action,
-                            "status": "executed",
-                            "message": f"Successfully executed {action}",
-                            "result": str(result_data),
-                            "step": int(operation_id.split("_")[1])
-                        })
-                    
-                except Exception as e:
-                    # Handle errors
-                    logger.error(f"Error executing {action}: {str(e)}")
-                    logger.error(traceback.format_exc())
-                    
-                    results.append({
-                        "action": action,
-                        "status": "error",
-                        "message": f"Error executing {action}: {str(e)}",
-                        "step": int(operation_id.split("_")[1])
-                    })
-                    
-                    # Mark as completed even though it failed
-                    tracker.mark_completed(operation_id, None)
-        
-        return {
-            "results": results,
-            "intermediate_layers": list(tracker.results.keys())
-        }
+        return await run_gis_plan(
+            state.get('actions', []),
+            params_dict=state.get('params_dict', {}),
+            params_list=state.get('params_list') or [],
+            include_geojson=state.get('include_geojson', True)
+        )
     
     # Define the routing logic
     def should_process_actions(state: AgentState):
@@ -834,33 +4469,144 @@ def create_gis_agent(model_name="gpt-4"):
     # Compile the graph
     return graph_builder.compile()
 
-@app.post("/process-gis-query")
-async def process_gis_query(request: GISQueryRequest):
+# Compiled agent graphs keyed by model name. Building and compiling a graph is
+# the same work for every request, so it is done once and the result reused.
+AGENT_GRAPHS = {}
+AGENT_GRAPHS_LOCK = threading.Lock()
+# Compiling at startup imports langgraph (and the first request then only
+# pays for openai); off by default so workers start without either
+AGENT_WARM_UP = os.getenv("AGENT_WARM_UP", "0") != "0"
+
+def get_gis_agent(model_name=DEFAULT_MODEL):
+    """
+    Get the compiled agent graph for a model, compiling it on first use.
+    
+    Args:
+        model_name: One of AGENT_MODELS
+        
+    Returns:
+        The compiled graph
+    """
+    if model_name not in AGENT_MODELS:
+        raise ValueError(f"Model '{model_name}' is not enabled. Available models: {', '.join(AGENT_MODELS)}")
+    
+    agent = AGENT_GRAPHS.get(model_name)
+    if agent is None:
+        with AGENT_GRAPHS_LOCK:
+            agent = AGENT_GRAPHS.get(model_name)
+            if agent is None:
+                agent = create_gis_agent(model_name)
+                AGENT_GRAPHS[model_name] = agent
+    return agent
+
+@app.on_event("startup")
+def warm_up_agents():
+    """Compile the agent graph for every enabled model before serving requests (AGENT_WARM_UP=1)"""
+    if not AGENT_WARM_UP:
+        return
+    for model_name in AGENT_MODELS:
+        get_gis_agent(model_name)
+    logger.info(f"Compiled agent graphs for: {', '.join(AGENT_MODELS)}")
+
+@app.on_event("startup")
+def remove_orphaned_rasters():
+    """Delete raster files that no raster (of any worker or earlier run) refers to"""
+    removed = LOADED_RASTERS.remove_orphans()
+    if removed:
+        logger.info(f"Removed {removed} orphaned files from {RASTER_DIR}")
+
+@app.on_event("startup")
+async def start_job_workers():
+    JOB_MANAGER.start()
+
+async def expire_sessions():
+    """Drop idle sessions and their layers every SESSION_CLEANUP_INTERVAL seconds"""
+    while True:
+        await asyncio.sleep(SESSION_CLEANUP_INTERVAL)
+        try:
+            await run_gis(SESSIONS.expire, JOB_MANAGER.busy_sessions())
+        except Exception as e:
+            logger.error(f"Session cleanup failed: {str(e)}")
+
+@app.on_event("startup")
+async def start_session_cleanup():
+    app.state.session_cleanup = asyncio.create_task(expire_sessions())
+
+async def publish_store_stats():
+    """Write this worker's store and cache numbers to the multiprocess metric files"""
+    while True:
+        try:
+            STORE_STATS.publish()
+        except Exception as e:
+            logger.error(f"Publishing store metrics failed: {str(e)}")
+        await asyncio.sleep(METRICS_PUBLISH_INTERVAL)
+
+@app.on_event("startup")
+async def start_store_stats_publisher():
+    app.state.store_stats_publisher = asyncio.create_task(publish_store_stats()) if STORE_STATS is not None else None
+
+@app.on_event("shutdown")
+async def close_clients():
+    """Release pooled connections and GIS worker threads"""
+    await JOB_MANAGER.stop()
+    app.state.session_cleanup.cancel()
+    if app.state.store_stats_publisher is not None:
+        app.state.store_stats_publisher.cancel()
+        # Drop this worker's gauges from the live sums
+        multiprocess.mark_process_dead(os.getpid())
+    if client is not None:
+        await client.close()
+    GIS_EXECUTOR.shutdown(wait=False, cancel_futures=True)
+    RASTER_EXECUTOR.shutdown(wait=False, cancel_futures=True)
+    if GEOMETRY_PROCESS_POOL is not None:
+        GEOMETRY_PROCESS_POOL.shutdown(wait=False, cancel_futures=True)
+    LAYER_STORE.clear_spill()
+    if LAYER_STORE.backend is not None:
+        LAYER_STORE.backend.close()
+    LOADED_RASTERS.close()
+    PLAN_CACHE.save()
+
+async def run_gis_query(request: GISQueryRequest):
+    """
+    Run a query through the agent and build the response payload.
+    
+    Shared by /process-gis-query and the background job queue.
+    """
     try:
-        logger.info(f"Received GIS Query: {request.query}")
+        if debug_sampled():
+            logger.debug(f"Received GIS Query: {request.query}")
         
-        # Create agent
-        agent = create_gis_agent()
+        # Reuse the compiled agent for the requested model
+        try:
+            agent = get_gis_agent(request.model or DEFAULT_MODEL)
+        except ValueError as e:
+            return {
+                "status": "error",
+                "message": str(e)
+            }
         
         # Initialize state with params_dict
         initial_state = {
             "messages": [{"role": "user", "content": request.query}],
             "actions": [],
             "params_dict": {},
+            "params_list": [],
             "results": [],
-            "intermediate_layers": []
+            "intermediate_layers": [],
+            "include_geojson": request.include_geojson
         }
         
         # Run the agent
         try:
-            result = agent.invoke(initial_state)
+            result = await agent.ainvoke(initial_state)
             
             # Extract the assistant's response
             assistant_messages = [msg for msg in result["messages"] if msg["role"] == "assistant"]
             response_content = assistant_messages[-1]["content"] if assistant_messages else "No response generated."
             
             # Log the full result (not truncated)
-            logger.info(f"Agent response: {response_content}")
+            if debug_sampled():
+                logger.debug(f"Agent response: {response_content}")
             
             # Prepare response data
             response_data = {
@@ -869,18 +4615,21 @@ async def process_gis_query(request: GISQueryRequest):
                 "actions": result.get("actions", []),
                 "results": result.get("results", []),
                 "query": request.query,
-                "intermediate_layers": result.get("intermediate_layers", [])
+                "intermediate_layers": result.get("intermediate_layers", []),
+                "planner": result.get("planner"),
+                "planner_ms": result.get("planner_ms")
             }
             
             # Include all GeoJSON data for each step
             geojson_steps = {}
             for res in result.get("results", []):
-                if "geojson" in res and "step" in res:
+                if "layer" in res and "step" in res:
                     step_num = res["step"]
                     geojson_steps[f"step_{step_num}"] = {
                         "layer_name": res.get("result", f"Step {step_num}"),
                         "action": res.get("action", "unknown"),
-                        "geojson": res["geojson"]
+                        "geojson": res.get("geojson"),
+                        "layer": res["layer"]
                     }
             
             # Add all steps to the response
@@ -889,7 +4638,7 @@ async def process_gis_query(request: GISQueryRequest):
                 
                 # For backward compatibility, include the final result geojson at the top level
                 final_step = max(geojson_steps.keys(), key=lambda k: int(k.split('_')[1]), default=None)
-                if final_step:
+                if final_step and geojson_steps[final_step]["geojson"] is not None:
                     response_data["geojson"] = geojson_steps[final_step]["geojson"]
             
             return response_data
@@ -910,6 +4659,483 @@ async def process_gis_query(request: GISQueryRequest):
             "message": str(e)
         }
 
+@app.post("/process-gis-query")
+async def process_gis_query(request: GISQueryRequest):
+    return LayerJSONResponse(await run_gis_query(request))
+
+@app.post("/process-gis-query/stream")
+async def process_gis_query_stream(request: GISQueryRequest, http_request: Request):
+    """
+    Streaming variant of /process-gis-query.
+    
+    Sends the assistant's answer as soon as it is available, then one event per
+    step as each step finishes, then a final "done" event. Result layers are
+    sent as references (layer name, tile URL, bbox); fetch the geometry from
+    /layers/{name} or the tile endpoint. The stream is NDJSON, or server-sent
+    events when the client accepts text/event-stream.
+    """
+    use_sse = "text/event-stream" in http_request.headers.get("accept", "")
+    events = asyncio.Queue()
+    
+    def on_event(event, data):
+        if event == "step":
+            data = _without_geometry(data)
+        events.put_nowait((event, data))
+    
+    async def run():
+        token = PLAN_STEP_LISTENER.set(on_event)
+        try:
+            # Layers are sent as references, so don't encode any GeoJSON
+            result = await run_gis_query(request.model_copy(update={"include_geojson": False}))
+        except Exception as e:
+            result = {"status": "error", "message": str(e)}
+        finally:
+            PLAN_STEP_LISTENER.reset(token)
+        
+        summary = {key: value for key, value in result.items() if key not in ("geojson", "geojson_steps")}
+        if "results" in summary:
+            summary["results"] = [_without_geometry(entry) for entry in summary["results"]]
+        events.put_nowait(("done", summary))
+    
+    def encode(event, data):
+        if use_sse:
+            return b"event: " + event.encode() + b"\ndata: " + _dumps(data) + b"\n\n"
+        return _dumps({"event": event, "data": data}) + b"\n"
+    
+    async def stream():
+        task = asyncio.create_task(run())
+        try:
+            while True:
+                event, data = await events.get()
+                yield encode(event, data)
+                if event == "done":
+                    break
+        finally:
+            if not task.done():
+                task.cancel()
+    
+    return StreamingResponse(stream(), media_type="text/event-stream" if use_sse else "application/x-ndjson")
+
+# Background jobs: bounded queue, fixed number of workers
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "32"))
+JOB_HISTORY_SIZE = int(os.getenv("JOB_HISTORY_SIZE", "200"))  # Finished jobs kept for polling
+
+def _without_geometry(entry):
+    """Step entry for progress events: layer reference only, no encoded GeoJSON"""
+    return {key: value for key, value in entry.items() if key != "geojson"}
+
+class GISJob:
+    """A queued agent query or operation, with its progress events and result"""
+    
+    def __init__(self, kind, request):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.request = request
+        self.session_id = CURRENT_SESSION.get()  # The job runs against the submitter's layers
+        self.status = "queued"
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.total_steps = None
+        self.completed_steps = 0
+        self.result = None
+        self.error = None
+        self.events = []
+        self.subscribers = set()  # One wake-up queue per event stream
+    
+    @property
+    def done(self):
+        return self.status in ("completed", "failed")
+    
+    def publish(self, event, data):
+        """Record a progress event and wake up subscribers (called on the event loop)"""
+        self.events.append({"event": event, "data": data})
+        for queue in self.subscribers:
+            queue.put_nowait(None)
+    
+    def subscribe(self):
+        """Queue that gets an item after every published event; pass it to unsubscribe when done"""
+        queue = asyncio.Queue()
+        self.subscribers.add(queue)
+        return queue
+    
+    def unsubscribe(self, queue):
+        self.subscribers.discard(queue)
+    
+    def on_plan_event(self, event, data):
+        """PLAN_STEP_LISTENER callback for this job's run_gis_plan"""
+        if event == "plan":
+            self.total_steps = data["total_steps"]
+        elif event == "step":
+            self.completed_steps += 1
+            data = _without_geometry(data)
+        self.publish(event, data)
+    
+    def snapshot(self, include_result=True):
+        info = {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "progress": {"completed_steps": self.completed_steps, "total_steps": self.total_steps},
+        }
+        if self.error is not None:
+            info["error"] = self.error
+        if include_result and self.result is not None:
+            info["result"] = self.result
+        return info
+
+class JobManager:
+    """
+    Runs GISJobs on a fixed set of asyncio workers fed by a bounded queue.
+    
+    The step work itself still goes through run_gis_plan and the GIS thread
+    pool; the queue only limits how many jobs are in flight. When the queue is
+    full, submit() fails so the caller can push back on the client.
+    """
+    
+    def __init__(self, workers=JOB_WORKERS, queue_size=JOB_QUEUE_SIZE, history_size=JOB_HISTORY_SIZE):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.history_size = history_size
+        self.jobs = OrderedDict()
+        self.queue = None
+        self.tasks = []
+    
+    def start(self):
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self.tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+    
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+    
+    def submit(self, kind, request):
+        """Queue a job; raises asyncio.QueueFull when the queue is at capacity"""
+        job = GISJob(kind, request)
+        self.queue.put_nowait(job)
+        self.jobs[job.id] = job
+        self._trim_history()
+        job.publish("status", {"status": job.status})
+        return job
+    
+    def get(self, job_id):
+        """A job of the current session"""
+        job = self.jobs.get(job_id)
+        return job if job is not None and job.session_id == CURRENT_SESSION.get() else None
+    
+    def busy_sessions(self):
+        return {job.session_id for job in self.jobs.values() if not job.done}
+    
+    def _trim_history(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.done]
+        for job_id in finished[:max(0, len(finished) - self.history_size)]:
+            del self.jobs[job_id]
+    
+    async def _worker(self):
+        while True:
+            job = await self.queue.get()
+            try:
+                await self._run(job)
+            finally:
+                self.queue.task_done()
+    
+    async def _run(self, job):
+        job.status = "running"
+        job.started_at = time.time()
+        job.publish("status", {"status": job.status})
+        
+        token = PLAN_STEP_LISTENER.set(job.on_plan_event)
+        session_token = CURRENT_SESSION.set(job.session_id)
+        try:
+            if job.kind == "query":
+                job.result = await run_gis_query(job.request)
+                if job.result.get("status") == "error":
+                    job.error = job.result.get("message")
+            else:
+                plan = await run_gis_plan(
+                    [job.request.operation],
+                    params_list=[job.request.params],
+                    include_geojson=job.request.include_geojson
+                )
+                job.result = plan
+                failed = [r for r in plan["results"] if r.get("status") != "executed"]
+                if failed:
+                    job.error = failed[0].get("message")
+        except Exception as e:
+            logger.error(f"Job {job.id} failed: {str(e)}")
+            logger.error(traceback.format_exc())
+            job.error = str(e)
+        finally:
+            CURRENT_SESSION.reset(session_token)
+            PLAN_STEP_LISTENER.reset(token)
+        
+        job.status = "failed" if job.error is not None else "completed"
+        job.finished_at = time.time()
+        job.publish("status", job.snapshot(include_result=False))
+        self._trim_history()
+
+JOB_MANAGER = JobManager()
+
+def submit_job(kind, request):
+    try:
+        job = JOB_MANAGER.submit(kind, request)
+    except asyncio.QueueFull:
+        # Backpressure: tell the client to come back later instead of queueing without bound
+        return JSONResponse(
+            status_code=429,
+            content={"status": "error", "message": "Job queue is full, try again later"},
+            headers={"Retry-After": "5"}
+        )
+    return JSONResponse(
+        status_code=202,
+        content={"job_id": job.id, "status": job.status, "status_url": f"/jobs/{job.id}", "events_url": f"/jobs/{job.id}/events"}
+    )
+
+@app.post("/jobs/query")
+async def submit_query_job(request: GISQueryRequest):
+    """Queue an agent query; returns a job ID right away"""
+    return submit_job("query", request)
+
+@app.post("/jobs/operation")
+async def submit_operation_job(request: OperationJobRequest):
+    """Queue a single GIS operation; returns a job ID right away"""
+    if request.operation not in GIS_FUNCTIONS:
+        raise HTTPException(status_code=400, detail=f"Unknown GIS action: {request.operation}")
+    return submit_job("operation", request)
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Poll a job: status, per-step progress and, once finished, its result"""
+    job = JOB_MANAGER.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found")
+    return LayerJSONResponse(job.snapshot())
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """Server-sent events with the job's status changes and each finished step"""
+    job = JOB_MANAGER.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found")
+    
+    async def stream():
+        sent = 0
+        wake_up = job.subscribe()
+        try:
+            while True:
+                while sent < len(job.events):
+                    event = job.events[sent]
+                    sent += 1
+                    yield b"event: " + event["event"].encode() + b"\ndata: " + _dumps(event["data"]) + b"\n\n"
+                if job.done:
+                    break
+                await wake_up.get()
+        finally:
+            job.unsubscribe(wake_up)
+    
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+@app.get("/layer-store/stats")
+def layer_store_stats():
+    """Hit/miss/spill counters and memory usage of the layer store"""
+    return {**LOADED_LAYERS.stats(), "result_cache": RESULT_CACHE.stats(), "plan_cache": PLAN_CACHE.stats(), "raster_tile_cache": RASTER_TILE_CACHE.stats(), "dissolve_cache": DISSOLVE_CACHE.stats()}
+
+@app.get("/metrics")
+def metrics():
+    """Stage timings, GIS function histograms and layer store gauges for Prometheus"""
+    if STORE_STATS is not None:
+        STORE_STATS.publish()
+    return Response(content=generate_latest(METRICS_REGISTRY), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/session")
+def get_session():
+    """Current session: layer count, memory used, quotas and expiry"""
+    return SESSIONS.info(CURRENT_SESSION.get())
+
+@app.delete("/session")
+def delete_session():
+    """Remove every layer of the current session right away"""
+    session_id = CURRENT_SESSION.get()
+    return {"session_id": session_id, "removed_layers": SESSIONS.drop(session_id)}
+
+# Viewport queries: only the features in view, simplified for the zoom level
+LAYER_QUERY_DEFAULT_LIMIT = 1000
+LAYER_QUERY_MAX_LIMIT = int(os.getenv("LAYER_QUERY_MAX_LIMIT", "10000"))
+WEB_MERCATOR_MAX_LATITUDE = 85.05112878
+
+@functools.lru_cache(maxsize=1)
+def to_web_mercator():
+    """WGS84 -> Web Mercator transformer, created on the first viewport query"""
+    return pyproj.Transformer.from_crs("EPSG:4326", "EPSG:3857", always_xy=True)
+
+def query_layer(layer_name, bbox=None, zoom=None, columns=None, limit=LAYER_QUERY_DEFAULT_LIMIT, cursor=None):
+    """
+    Features of a layer inside a WGS84 bbox, ready for a web map.
+    
+    Uses the layer's Web Mercator copy and spatial index from TILE_CACHE.
+    With a zoom level, geometries are simplified to one screen pixel and
+    coordinates are rounded to the precision a pixel can show.
+    
+    Args:
+        layer_name: Name of the layer
+        bbox: (minx, miny, maxx, maxy) in EPSG:4326, the whole layer when None
+        zoom: Web map zoom level
+        columns: Attribute columns to include (all when None)
+        limit: Maximum number of features
+        cursor: next_cursor of the previous page
+        
+    Returns:
+        Dict with the encoded FeatureCollection parts and paging info
+    """
+    if layer_name not in LOADED_LAYERS:
+        raise KeyError(layer_name)
+    layer_key = LOADED_LAYERS.qualified(layer_name)
+    version = TILE_CACHE.version(layer_key)
+    gdf = LOADED_LAYERS[layer_name]
+    projected = TILE_CACHE.get_projected(layer_key, gdf, version)
+    
+    if columns is not None:
+        unknown = [column for column in columns if column not in projected.columns or column == projected.geometry.name]
+        if unknown:
+            raise ValueError(f"Unknown columns: {', '.join(unknown)}")
+    
+    # Positions of the matching features, in layer order so pages are stable
+    if bbox is not None:
+        minx, miny, maxx, maxy = bbox
+        miny, maxy = max(miny, -WEB_MERCATOR_MAX_LATITUDE), min(maxy, WEB_MERCATOR_MAX_LATITUDE)
+        query_box = shapely.box(*to_web_mercator().transform_bounds(minx, miny, maxx, maxy))
+        matches = np.sort(projected.sindex.query(query_box, predicate="intersects"))
+    else:
+        matches = np.arange(len(projected))
+    
+    after = -1
+    if cursor:
+        try:
+            cursor_version, cursor_position = (int(part) for part in cursor.split(".", 1))
+        except ValueError:
+            raise ValueError("Invalid cursor") from None
+        if cursor_version != version:
+            raise ValueError("The layer changed since the first page, start the query again")
+        after = cursor_position
+    remaining = matches[np.searchsorted(matches, after, side="right"):]
+    page = remaining[:limit]
+    next_cursor = f"{version}.{page[-1]}" if len(remaining) > limit else None
+    
+    subset = projected.iloc[page]
+    geometries = np.asarray(subset.geometry.array, dtype=object)
+    decimals = 7
+    if zoom is not None:
+        pixel = 2 * WEB_MERCATOR_HALF_WORLD / (TILE_SIZE_PIXELS * 2 ** zoom)
+        geometries = shapely.simplify(geometries, pixel, preserve_topology=True)
+        # Degrees per pixel at this zoom, plus one digit of headroom
+        decimals = int(min(7, max(0, np.ceil(-np.log10(360 / (TILE_SIZE_PIXELS * 2 ** zoom))) + 1)))
+    
+    geographic = gpd.GeoSeries(geometries, index=subset.index, crs=projected.crs).to_crs(epsg=4326)
+    quantized = shapely.transform(np.asarray(geographic.array, dtype=object), lambda coords: np.round(coords, decimals))
+    result = gpd.GeoDataFrame(
+        subset[columns] if columns is not None else subset.drop(columns=[subset.geometry.name]),
+        geometry=quantized,
+        crs="EPSG:4326",
+    )
+    
+    return {
+        "type": "FeatureCollection",
+        "features": orjson.Fragment(b"[" + b",".join(iter_geojson_features(result)) + b"]"),
+        "matched": int(len(matches)),
+        "returned": int(len(page)),
+        "next_cursor": next_cursor,
+        "zoom": zoom,
+        "coordinate_decimals": decimals,
+    }
+
+@app.get("/layers/{layer_name}/query")
+async def query_layer_features(
+    layer_name: str,
+    bbox: Optional[str] = None,  # "minx,miny,maxx,maxy" in EPSG:4326 (the map viewport)
+    zoom: Optional[int] = None,
+    columns: Optional[str] = None,  # Comma separated attribute columns; empty for none
+    limit: int = LAYER_QUERY_DEFAULT_LIMIT,
+    cursor: Optional[str] = None,
+):
+    """Visible features of a layer for a map viewport, as a GeoJSON FeatureCollection"""
+    try:
+        bbox_filter = parse_bbox(bbox) if bbox else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid bbox: {str(e)}")
+    if zoom is not None and not 0 <= zoom <= TILE_MAX_ZOOM:
+        raise HTTPException(status_code=400, detail=f"zoom must be between 0 and {TILE_MAX_ZOOM}")
+    if not 1 <= limit <= LAYER_QUERY_MAX_LIMIT:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {LAYER_QUERY_MAX_LIMIT}")
+    column_filter = [c.strip() for c in columns.split(",") if c.strip()] if columns is not None else None
+    
+    try:
+        result = await run_gis(query_layer, layer_name, bbox_filter, zoom, column_filter, limit, cursor)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Layer '{layer_name}' not found")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return LayerJSONResponse(result, media_type=GEOJSON_MEDIA_TYPE)
+
+@app.get("/catalog")
+def list_catalog():
+    """Layers and rasters of the current session with their metadata, without loading them"""
+    return {
+        "layers": {name: LOADED_LAYERS.metadata(name) for name in LOADED_LAYERS.keys()},
+        "rasters": LOADED_RASTERS.catalog(),
+    }
+
+@app.get("/catalog/{layer_name}")
+def get_catalog_entry(layer_name: str):
+    """Metadata of a layer and the lineage of every layer it was derived from"""
+    if layer_name not in LOADED_LAYERS:
+        raise HTTPException(status_code=404, detail=f"Layer '{layer_name}' not found")
+    
+    entry = LOADED_LAYERS.metadata(layer_name)
+    ancestors = {}
+    lineage = (entry or {}).get("lineage") or {}
+    pending = list(lineage.get("inputs", []))
+    while pending:
+        name = pending.pop()
+        if name in ancestors or name == layer_name:
+            continue
+        ancestor = LOADED_LAYERS.metadata(name) if name in LOADED_LAYERS else None
+        ancestors[name] = ancestor["lineage"] if ancestor is not None else None  # None: deleted or never recorded
+        if ancestors[name]:
+            pending.extend(ancestors[name].get("inputs", []))
+    return {"name": layer_name, **(entry or {}), "ancestors": ancestors}
+
+@app.get("/layers/{layer_name}")
+async def download_layer(layer_name: str, request: Request):
+    """Download a loaded layer as GeoJSON, Arrow IPC or FlatGeobuf (via Accept)"""
+    if layer_name not in LOADED_LAYERS:
+        raise HTTPException(status_code=404, detail=f"Layer '{layer_name}' not found")
+    
+    return layer_response(LOADED_LAYERS[layer_name], request)
+
+@app.get("/tiles/{layer_name}/{z}/{x}/{y}.mvt")
+def get_vector_tile(layer_name: str, z: int, x: int, y: int):
+    """Serve a Mapbox Vector Tile for a loaded layer"""
+    if layer_name not in LOADED_LAYERS:
+        raise HTTPException(status_code=404, detail=f"Layer '{layer_name}' not found")
+    if not 0 <= z <= TILE_MAX_ZOOM or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise HTTPException(status_code=400, detail=f"Invalid tile {z}/{x}/{y}")
+    
+    key = (z, x, y)
+    layer_key = LOADED_LAYERS.qualified(layer_name)
+    tile = TILE_CACHE.get_tile(layer_key, key)
+    if tile is None:
+        version = TILE_CACHE.version(layer_key)
+        tile = render_vector_tile(layer_name, LOADED_LAYERS[layer_name], z, x, y, version)
+        TILE_CACHE.put_tile(layer_key, key, tile, version)
+    
+    return Response(content=tile, media_type=MVT_MEDIA_TYPE)
+
 # Basic health check endpoint
 @app.get("/")
 def read_root():
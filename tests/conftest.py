@@ -0,0 +1,21 @@
+"""
+Shared setup for the test suite.
+
+main.py reads its settings from the environment at import time, so they are
+set here before any test module imports it: a dummy OpenAI key (the client is
+only created on the first LLM call) and a temporary layer directory, so the
+tests never touch the layer catalog in uploads/.
+"""
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("LAYER_SHARED_DIR", tempfile.mkdtemp(prefix="test-layers-"))
+os.environ.setdefault("RESULT_CACHE_SIZE", "0")
+os.environ.setdefault("PLAN_CACHE_SIZE", "0")
+os.environ.setdefault("DISSOLVE_CACHE_SIZE", "0")
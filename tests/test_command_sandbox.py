@@ -0,0 +1,60 @@
+"""Whitelisted AST interpreter behind /execute-command/"""
+import pytest
+
+import main
+
+
+@pytest.mark.parametrize("command, expected", [
+    ("len([1, 2, 3])", 3),
+    ("round(2.5 * 3 - 1, 1)", 6.5),
+    ("sorted([3, 1, 2], reverse=True)", [3, 2, 1]),
+    ("max((4, -2, 9))", 9),
+    ("{'a': 1}.get('a')", 1),
+    ("[10, 20, 30][1:]", [20, 30]),
+])
+def test_whitelisted_expressions(command, expected):
+    result, _ = main.run_command(command)
+    assert result == expected
+
+
+def test_print_goes_to_the_run_output():
+    result, run = main.run_command("print('area', 12, sep=': ')")
+    assert result is None
+    assert run.output.getvalue() == "area: 12\n"
+    # Each run has its own output
+    _, other = main.run_command("len([])")
+    assert other.output.getvalue() == ""
+
+
+@pytest.mark.parametrize("command", [
+    "__import__('os')",
+    "open('/etc/passwd')",
+    "eval('1')",
+    "getattr(layers, 'store')",
+    "().__class__",
+    "().__class__.__bases__[0].__subclasses__()",
+    "layers.__dict__",
+    "layers.store",
+    "str.__dict__",
+    "print(**{'sep': ''})",
+    "[x for x in [1, 2]]",
+    "(lambda: 1)()",
+    "2 ** 100000",
+    "1 if True else 0",
+    "layers == layers",
+])
+def test_rejected_at_parse_time(command):
+    with pytest.raises(ValueError):
+        main.parse_command(command)
+
+
+@pytest.mark.parametrize("command", ["import os", "x = 1", "len([1]); len([2])"])
+def test_statements_are_not_expressions(command):
+    with pytest.raises(SyntaxError):
+        main.parse_command(command)
+
+
+@pytest.mark.parametrize("command", ["'x' * 1000000000", "[0] * 1000000000", "'a' + 'b'"])
+def test_arithmetic_is_numbers_only(command):
+    with pytest.raises(TypeError):
+        main.run_command(command)
@@ -0,0 +1,98 @@
+"""Dissolve with aggregations and its incremental path, against GeoDataFrame.dissolve"""
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+import shapely
+
+import main
+
+AGGREGATIONS = "sum(value), mean(value), min(value), max(value), count(value), count"
+
+
+def layer(count, seed):
+    rng = np.random.default_rng(seed)
+    groups = rng.integers(0, 12, count).astype(float)
+    groups[rng.random(count) < 0.05] = np.nan  # Features without a key are dropped, as in geopandas
+    values = rng.random(count) * 100
+    values[rng.random(count) < 0.1] = np.nan
+    centers = rng.uniform(0, 1000, size=(count, 2))
+    return gpd.GeoDataFrame(
+        {"group": groups, "value": values, "label": [f"f{i}" for i in range(count)]},
+        geometry=shapely.buffer(shapely.points(centers), rng.uniform(5, 60, count)),
+        crs="EPSG:3400",
+    )
+
+
+def expected_dissolve(gdf):
+    dissolved = gdf[["group", "geometry"]].dissolve(by="group").sort_index()
+    grouped = gdf.groupby("group")["value"]
+    stats = pd.DataFrame({
+        "value_sum": grouped.sum(),
+        "value_mean": grouped.mean(),
+        "value_min": grouped.min(),
+        "value_max": grouped.max(),
+        "value_count": grouped.count(),
+        "count": grouped.size(),
+    }).sort_index()
+    return dissolved, stats
+
+
+def assert_matches(result, gdf):
+    dissolved, stats = expected_dissolve(gdf)
+    assert result["group"].tolist() == dissolved.index.tolist()
+    for name in stats.columns:
+        assert np.allclose(result[name].to_numpy(dtype=float), stats[name].to_numpy(dtype=float), equal_nan=True), name
+    difference = result.geometry.symmetric_difference(dissolved.geometry.reset_index(drop=True)).area
+    assert (difference <= dissolved.geometry.area.to_numpy() * 1e-9).all()
+
+
+@pytest.fixture
+def dissolve_cache(monkeypatch):
+    cache = main.DissolveCache(max_entries=8)
+    monkeypatch.setattr(main, "DISSOLVE_CACHE", cache)
+    yield cache
+    del main.LOADED_LAYERS["parcels"]
+
+
+def test_dissolve_with_aggregations_matches_geopandas(dissolve_cache):
+    gdf = layer(600, seed=1)
+    main.register_layer("parcels", gdf)
+    assert_matches(main.dissolve_layer("parcels", "group", AGGREGATIONS), gdf)
+
+
+def test_appended_features_are_dissolved_incrementally(dissolve_cache):
+    first = layer(400, seed=2)
+    main.register_layer("parcels", first)
+    main.dissolve_layer("parcels", "group", AGGREGATIONS)
+
+    # Features appended, some of them in groups the first rows didn't have
+    added = layer(200, seed=3)
+    added["group"] = added["group"] + 6
+    grown = pd.concat([first, added], ignore_index=True)
+    main.register_layer("parcels", grown)
+    result = main.dissolve_layer("parcels", "group", AGGREGATIONS)
+
+    assert dissolve_cache.stats()["incremental"] == 1
+    assert_matches(result, grown)
+
+
+def test_merged_states_keep_the_first_values():
+    gdf = layer(300, seed=4)
+    merged = main.DissolveState.build(gdf.iloc[:120], "group", []).merge(main.DissolveState.build(gdf.iloc[120:], "group", []))
+    full = main.DissolveState.build(gdf, "group", [])
+    assert merged.rows == full.rows == len(gdf)
+    result = merged.to_frame("group", [], "geometry", gdf.crs)
+    expected = full.to_frame("group", [], "geometry", gdf.crs)
+    assert result[["group", "value", "label"]].equals(expected[["group", "value", "label"]])
+
+
+def test_dissolve_without_column(dissolve_cache):
+    gdf = layer(100, seed=5)
+    main.register_layer("parcels", gdf)
+    result = main.dissolve_layer("parcels", aggregations="sum(value), count")
+    # One feature for the whole layer, without the "index" column reset_index() used to add
+    assert list(result.columns) == ["geometry", "value_sum", "count"]
+    assert result["count"].tolist() == [100]
+    assert result["value_sum"].iloc[0] == pytest.approx(gdf["value"].sum())
+    assert result.geometry.iloc[0].area == pytest.approx(gdf.geometry.union_all().area)
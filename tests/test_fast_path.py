@@ -0,0 +1,79 @@
+"""Local parsing of explicit operation queries (the planner's fast path)"""
+import pytest
+
+import main
+
+LAYERS = ["Layer 1", "Layer 2", "Layer 10", "Roads"]
+
+
+@pytest.mark.parametrize("query, action, params", [
+    ("buffer Layer 1 500", "buffer_layer", {"layer_name": "Layer 1", "distance": "500"}),
+    ("Create a buffer around Layer 1 with a distance of 500 meters", "buffer_layer", {"layer_name": "Layer 1", "distance": "500"}),
+    ("buffer Layer 10 by 2.5m", "buffer_layer", {"layer_name": "Layer 10", "distance": "2.5"}),
+    ("buffer Layer 1 -50", "buffer_layer", {"layer_name": "Layer 1", "distance": "-50"}),
+    ("simplify Roads 10", "simplify", {"layer_name": "Roads", "tolerance": "10"}),
+    ("simplify Roads with tolerance 0.5", "simplify", {"layer_name": "Roads", "tolerance": "0.5"}),
+    ("clip Layer 1 by Layer 2", "clip", {"layer_name": "Layer 1", "clip_layer_name": "Layer 2"}),
+    ("clip Roads using Layer 10", "clip", {"layer_name": "Roads", "clip_layer_name": "Layer 10"}),
+    ("intersect Layer 1 with Layer 2", "intersection", {"layer1_name": "Layer 1", "layer2_name": "Layer 2"}),
+    ("intersection of Layer 1 and Layer 2", "intersection", {"layer1_name": "Layer 1", "layer2_name": "Layer 2"}),
+    ("union Layer 1 and Roads", "union", {"layer1_name": "Layer 1", "layer2_name": "Roads"}),
+    ("merge Layer 1 with Layer 2", "union", {"layer1_name": "Layer 1", "layer2_name": "Layer 2"}),
+    ("dissolve Layer 1", "dissolve", {"layer_name": "Layer 1"}),
+    ("dissolve Layer 1 by group", "dissolve", {"layer_name": "Layer 1", "column": "group"}),
+    ("dissolve Layer 1 by group with sum(value), count", "dissolve",
+     {"layer_name": "Layer 1", "column": "group", "aggregations": "sum(value), count"}),
+    ("reproject Layer 1", "reproject_layer", {"layer_name": "Layer 1"}),
+    ("reproject Layer 1 to WGS84", "reproject_layer", {"layer_name": "Layer 1"}),
+    ("find points of Layer 1 within Layer 2", "points_within_polygon",
+     {"points_layer_name": "Layer 1", "polygon_layer_name": "Layer 2"}),
+    ("describe Roads", "get_layers_info", {"layer": "Roads"}),
+    ("info for Layer 2", "get_layers_info", {"layer": "Layer 2"}),
+])
+def test_each_pattern(query, action, params):
+    assert main.parse_fast_path(query, LAYERS) == ([action], [params])
+
+
+@pytest.mark.parametrize("query", [
+    "BUFFER LAYER 1 500",
+    "Buffer layer 1 500.",
+    "  buffer   Layer 1\t500 ",
+])
+def test_case_and_whitespace_insensitive(query):
+    # Layer names come back as loaded, whatever their case in the query
+    assert main.parse_fast_path(query, LAYERS) == (["buffer_layer"], [{"layer_name": "Layer 1", "distance": "500"}])
+
+
+@pytest.mark.parametrize("query", [
+    "buffer Layer 1 500; clip Layer 2 by Roads",
+    "buffer Layer 1 500 then clip Layer 2 by Roads",
+    "buffer Layer 1 500 and then clip Layer 2 by Roads",
+    "buffer Layer 1 500 THEN clip Layer 2 by Roads;",
+])
+def test_chained_statements(query):
+    assert main.parse_fast_path(query, LAYERS) == (
+        ["buffer_layer", "clip"],
+        [{"layer_name": "Layer 1", "distance": "500"}, {"layer_name": "Layer 2", "clip_layer_name": "Roads"}],
+    )
+
+
+@pytest.mark.parametrize("query", [
+    # Layers that aren't loaded
+    "buffer Layer 3 500",
+    "buffer Layer 1 500; clip Layer 2 by Rivers",
+    # Free text around or instead of a statement
+    "please buffer Layer 1 500",
+    "buffer Layer 1 500 and clip it",
+    "buffer Layer 1 a bit",
+    "what is a buffer?",
+    "dissolve Layer 1 by",
+    "show me the roads near Layer 1",
+    "",
+    " ; ",
+])
+def test_everything_else_goes_to_the_model(query):
+    assert main.parse_fast_path(query, LAYERS) is None
+
+
+def test_nothing_matches_without_layers():
+    assert main.parse_fast_path("buffer Layer 1 500", []) is None
@@ -0,0 +1,91 @@
+"""The spatial-index versions of the overlay functions against plain geopandas"""
+import geopandas as gpd
+import numpy as np
+import pytest
+import shapely
+
+import main
+
+
+def polygons(count, seed, spread=1000.0, radius=30.0):
+    rng = np.random.default_rng(seed)
+    centers = shapely.points(rng.uniform(0, spread, size=(count, 2)))
+    return gpd.GeoDataFrame(
+        {"zone_id": np.arange(count), "value": rng.random(count)},
+        geometry=shapely.buffer(centers, radius * rng.uniform(0.5, 1.5, count), quad_segs=4),
+        crs="EPSG:3857",
+    )
+
+
+def points(count, seed, spread=1000.0):
+    rng = np.random.default_rng(seed)
+    return gpd.GeoDataFrame(
+        {"point_id": np.arange(count)},
+        geometry=shapely.points(rng.uniform(0, spread, size=(count, 2))),
+        crs="EPSG:3857",
+    )
+
+
+def assert_same_overlay(result, expected):
+    """Same features (compared by the attribute columns) with the same geometries"""
+    columns = sorted(c for c in expected.columns if c != expected.geometry.name)
+    assert sorted(c for c in result.columns if c != result.geometry.name) == columns
+    assert len(result) == len(expected)
+
+    result = result.sort_values(columns, na_position="last").reset_index(drop=True)
+    expected = expected.sort_values(columns, na_position="last").reset_index(drop=True)
+    for column in columns:
+        np.testing.assert_allclose(result[column].astype(float), expected[column].astype(float))
+    # Symmetric difference instead of equality, so vertex order doesn't matter
+    difference = shapely.area(shapely.symmetric_difference(result.geometry.values, expected.geometry.values))
+    assert np.all(difference <= 1e-6 * np.maximum(shapely.area(expected.geometry.values), 1.0))
+
+
+@pytest.fixture
+def layers():
+    loaded = {
+        "zones_a": polygons(200, seed=1),
+        # Further out as well, so some features meet nothing in zones_a
+        "zones_b": polygons(200, seed=2, spread=2000.0),
+        "points": points(1000, seed=3, spread=1500.0),
+        "area": gpd.GeoDataFrame({"name": ["area"]}, geometry=[shapely.box(100, 100, 700, 800)], crs="EPSG:3857"),
+    }
+    for name, layer in loaded.items():
+        main.register_layer(name, layer)
+    yield loaded
+    for name in loaded:
+        if name in main.LOADED_LAYERS:
+            del main.LOADED_LAYERS[name]
+
+
+def test_intersection_matches_overlay(layers):
+    expected = gpd.overlay(layers["zones_a"], layers["zones_b"], how="intersection", keep_geom_type=False)
+    assert_same_overlay(main.intersection("zones_a", "zones_b"), expected)
+
+
+def test_union_matches_overlay(layers):
+    expected = gpd.overlay(layers["zones_a"], layers["zones_b"], how="union")
+    assert_same_overlay(main.union_layers("zones_a", "zones_b"), expected)
+
+
+def test_union_when_every_feature_is_a_candidate():
+    # Both layers overlap everywhere, so there's nothing to prefilter
+    layer1 = polygons(20, seed=4, spread=100.0, radius=80.0)
+    layer2 = polygons(20, seed=5, spread=100.0, radius=80.0)
+    candidates1, candidates2 = main.bbox_candidates(layer1, layer2)
+    assert len(candidates1) == len(layer1) and len(candidates2) == len(layer2)
+
+    assert_same_overlay(main.indexed_union(layer1, layer2), gpd.overlay(layer1, layer2, how="union"))
+
+
+def test_clip_matches_geopandas(layers):
+    expected = gpd.clip(layers["points"], layers["zones_a"])
+    result = main.clip_layer("points", "zones_a")
+    assert sorted(result["point_id"]) == sorted(expected["point_id"])
+
+
+def test_points_within_polygon_matches_sjoin(layers):
+    expected = gpd.sjoin(layers["points"], layers["area"], predicate="within", how="inner")
+    result = main.points_within_polygon("points", "area")
+    assert sorted(result["point_id"]) == sorted(expected["point_id"])
+    assert list(result.columns) == list(expected.columns)
@@ -0,0 +1,40 @@
+"""Layer fingerprints and the row hashes behind them"""
+import geopandas as gpd
+import numpy as np
+import shapely
+
+import main
+
+
+def layer(count=50):
+    rng = np.random.default_rng(7)
+    return gpd.GeoDataFrame(
+        {"group": rng.integers(0, 5, count), "tags": [[i] for i in range(count)]},
+        geometry=list(shapely.points(rng.random((count, 2)))[:-1]) + [None],
+        crs="EPSG:3400",
+    )
+
+
+def test_prefix_fingerprint_matches_truncated_layer():
+    gdf = layer()
+    row_hashes = main.layer_row_hashes(gdf)
+    assert row_hashes.shape == (len(gdf), 2)
+    for rows in (1, 20, len(gdf)):
+        expected = main.layer_fingerprint(gdf.iloc[:rows])
+        assert main.layer_fingerprint(gdf, rows=rows) == expected
+        assert main.layer_fingerprint(gdf, rows=rows, row_hashes=row_hashes) == expected
+
+
+def test_fingerprint_changes_with_content():
+    gdf = layer()
+    fingerprint = main.layer_fingerprint(gdf)
+
+    moved = gdf.copy()
+    moved.loc[3, "geometry"] = shapely.Point(10, 10)
+    assert main.layer_fingerprint(moved) != fingerprint
+
+    regrouped = gdf.copy()
+    regrouped.loc[3, "group"] = 99
+    assert main.layer_fingerprint(regrouped) != fingerprint
+
+    assert main.layer_fingerprint(gdf.to_crs("EPSG:4326")) != fingerprint
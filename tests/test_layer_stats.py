@@ -0,0 +1,70 @@
+"""Layer statistics and the HyperLogLog distinct count"""
+import uuid
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+import shapely
+
+import main
+
+# 2**14 registers: standard error 1.04 / sqrt(2**14), checked at four standard errors
+HLL_BOUND = 4 * 1.04 / np.sqrt(1 << main.HYPERLOGLOG_PRECISION)
+
+
+@pytest.mark.parametrize("distinct", [10, 1_000, 30_000, 300_000])
+def test_hyperloglog_within_error_bound(distinct):
+    rng = np.random.default_rng(distinct)
+    values = pd.Series(rng.integers(0, distinct, distinct * 2).astype(float))
+    values[::7] = np.nan  # Nulls aren't counted
+    exact = values.nunique()
+    assert abs(main.hyperloglog_count(values) - exact) <= max(1, exact * HLL_BOUND)
+
+
+def test_hyperloglog_of_strings_and_empty_columns():
+    words = pd.Series([f"word {i % 5000}" for i in range(20_000)])
+    assert abs(main.hyperloglog_count(words) - 5000) <= 5000 * HLL_BOUND
+    assert main.hyperloglog_count(pd.Series([], dtype=float)) == 0
+    assert main.hyperloglog_count(pd.Series([np.nan, None])) == 0
+
+
+def layer(count, seed=0):
+    rng = np.random.default_rng(seed)
+    return gpd.GeoDataFrame(
+        {"kind": rng.integers(0, 50, count), "value": rng.random(count)},
+        geometry=shapely.points(rng.random((count, 2))),
+        crs="EPSG:4326",
+    )
+
+
+def test_distinct_count_is_approximate_above_the_limit(monkeypatch):
+    gdf = layer(2000)
+    stats = main.LayerStats(gdf)
+    assert stats.distinct_count(gdf, "kind") == (50, False)
+
+    monkeypatch.setattr(main, "EXACT_DISTINCT_LIMIT", 1000)
+    stats = main.LayerStats(gdf)
+    count, approximate = stats.distinct_count(gdf, "kind")
+    assert approximate and abs(count - 50) <= 1
+
+
+@pytest.fixture
+def session():
+    token = main.CURRENT_SESSION.set(f"test-{uuid.uuid4().hex[:8]}")
+    yield
+    main.SESSIONS.drop(main.CURRENT_SESSION.get())
+    main.CURRENT_SESSION.reset(token)
+
+
+def test_stats_are_recomputed_after_the_layer_is_replaced(session):
+    main.register_layer("points", layer(100, seed=1))
+    stats = main.LOADED_LAYERS.layer_stats("points")
+    assert stats.feature_count == 100
+    assert main.LOADED_LAYERS.layer_stats("points") is stats
+
+    replacement = layer(40, seed=2)
+    main.register_layer("points", replacement)
+    stats = main.LOADED_LAYERS.layer_stats("points")
+    assert stats.feature_count == 40
+    assert stats.numeric_stats["value"]["max"] == pytest.approx(replacement["value"].max())
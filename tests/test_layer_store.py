@@ -0,0 +1,120 @@
+"""LayerStore memory budget and spilling"""
+import threading
+
+import geopandas as gpd
+import numpy as np
+import pytest
+import shapely
+
+import main
+
+
+def layer(count, seed=0):
+    rng = np.random.default_rng(seed)
+    return gpd.GeoDataFrame(
+        {"value": rng.random(count)},
+        geometry=shapely.points(rng.random((count, 2))),
+        crs="EPSG:4326",
+    )
+
+
+@pytest.fixture
+def store(tmp_path):
+    # Room for about one layer, so every put spills the previous one
+    return main.LayerStore(budget=main.estimate_layer_bytes(layer(1000)) * 3 // 2, spill_dir=tmp_path)
+
+
+@pytest.fixture
+def blocked_spill(monkeypatch):
+    """(writing, release) events: spill writes wait for `release` once `writing` is set"""
+    writing = threading.Event()
+    release = threading.Event()
+    to_parquet = gpd.GeoDataFrame.to_parquet
+
+    def slow_to_parquet(self, path, *args, **kwargs):
+        writing.set()
+        assert release.wait(5)
+        return to_parquet(self, path, *args, **kwargs)
+
+    monkeypatch.setattr(gpd.GeoDataFrame, "to_parquet", slow_to_parquet)
+    yield writing, release
+    release.set()
+
+
+def test_spilled_layers_reload(store):
+    layers = {f"layer {n}": layer(1000, seed=n) for n in range(3)}
+    for name, gdf in layers.items():
+        store[name] = gdf
+
+    stats = store.stats()
+    assert stats["layers_in_memory"] == 1 and stats["layers_spilled"] == 2
+    assert sorted(store.keys()) == sorted(layers)
+    for name, gdf in layers.items():
+        assert store[name]["value"].tolist() == gdf["value"].tolist()
+
+
+def test_spill_is_written_without_the_lock(store, blocked_spill):
+    writing, release = blocked_spill
+    first = layer(1000, seed=1)
+    store["first"] = first
+    putter = threading.Thread(target=store.__setitem__, args=("second", layer(1000, seed=2)))
+    putter.start()
+    try:
+        assert writing.wait(5)
+        # The store stays usable while "first" is written, and "first" can still be read
+        assert store.lock.acquire(timeout=1)
+        store.lock.release()
+        assert "first" in store
+        assert store["first"] is first
+        assert store.stats()["layers_spilling"] == 1
+    finally:
+        release.set()
+        putter.join()
+    assert store.stats()["layers_spilled"] == 1
+    assert store["first"]["value"].tolist() == first["value"].tolist()
+
+
+def test_layer_replaced_while_spilling_keeps_new_version(store, blocked_spill):
+    writing, release = blocked_spill
+    store["first"] = layer(1000, seed=1)
+    putter = threading.Thread(target=store.__setitem__, args=("second", layer(1000, seed=2)))
+    putter.start()
+    assert writing.wait(5)
+    replacement = layer(10, seed=3)
+    store["first"] = replacement
+    release.set()
+    putter.join()
+
+    # The file written for the old version is discarded
+    assert store["first"] is replacement
+    assert "first" not in store.spilled
+    assert list(store.spill_dir.glob("*.parquet")) == []
+
+
+def test_backend_write_is_done_without_the_lock(tmp_path, monkeypatch):
+    store = main.LayerStore(spill_dir=tmp_path / "spill", backend=main.SharedDirectoryBackend(tmp_path / "layers"))
+    store["small"] = layer(10)
+    writing = threading.Event()
+    release = threading.Event()
+    to_feather = gpd.GeoDataFrame.to_feather
+
+    def slow_to_feather(self, path, *args, **kwargs):
+        writing.set()
+        assert release.wait(5)
+        return to_feather(self, path, *args, **kwargs)
+
+    monkeypatch.setattr(gpd.GeoDataFrame, "to_feather", slow_to_feather)
+    big = layer(1000, seed=1)
+    putter = threading.Thread(target=store.__setitem__, args=("big", big))
+    putter.start()
+    try:
+        assert writing.wait(5)
+        # Other layers stay readable while "big" is written
+        assert store.lock.acquire(timeout=1)
+        store.lock.release()
+        assert len(store["small"]) == 10
+    finally:
+        release.set()
+        putter.join()
+    assert store["big"] is big
+    store.backend.close()
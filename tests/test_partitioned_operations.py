@@ -0,0 +1,92 @@
+"""Geometry operations run in the process pool against the in-process results"""
+import geopandas as gpd
+import numpy as np
+import pytest
+import shapely
+
+import main
+
+
+@pytest.fixture
+def partitioned(monkeypatch):
+    """Send every layer to the process pool, with at least two workers"""
+    monkeypatch.setattr(main, "PARTITION_WORKERS", max(2, main.PARTITION_WORKERS))
+    monkeypatch.setattr(main, "PARTITION_FEATURE_THRESHOLD", 1)
+    yield
+    if main.GEOMETRY_PROCESS_POOL is not None:
+        main.GEOMETRY_PROCESS_POOL.shutdown()
+        main.GEOMETRY_PROCESS_POOL = None
+
+
+@pytest.fixture
+def layer():
+    rng = np.random.default_rng(7)
+    count = 500
+    geometries = shapely.buffer(shapely.points(rng.uniform(0, 1000, size=(count, 2))), rng.uniform(5, 40, count))
+    geometries[::50] = None  # Missing geometries survive the WKB round trip
+    gdf = gpd.GeoDataFrame(
+        {"group": rng.integers(0, 20, count), "value": rng.random(count)},
+        geometry=geometries,
+        crs="EPSG:3857",
+    )
+    main.register_layer("zones", gdf)
+    yield gdf
+    del main.LOADED_LAYERS["zones"]
+
+
+def test_wkb_round_trip():
+    geometries = np.array([shapely.Point(1, 2), None, shapely.box(0, 0, 1, 1), shapely.LineString([(0, 0), (1, 1)])])
+    raw, lengths = main.geometry_workers.encode_chunk(geometries)
+    assert lengths[1] == 0
+    assert list(main.geometry_workers.decode_chunk(raw, lengths)) == list(geometries)
+
+    shm, offsets = main.geometry_workers.write_shared(geometries)
+    try:
+        assert list(main.geometry_workers.read_chunk(shm.name, offsets[1:])) == list(geometries[1:])
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def test_partitioned_buffer_matches_geopandas(layer, partitioned):
+    assert main.should_partition(layer)
+    result = main.buffer_layer("zones", 10)
+    expected = layer.geometry.buffer(10)
+    present = expected.notna()
+    assert result.geometry.notna().tolist() == present.tolist()
+    assert result.geometry[present].geom_equals_exact(expected[present], tolerance=1e-9).all()
+
+
+def test_partitioned_dissolve_matches_geopandas(layer, partitioned):
+    result = main.dissolve_layer("zones", "group").set_index("group").sort_index()
+    expected = layer.dissolve("group").sort_index()
+    assert result.index.tolist() == expected.index.tolist()
+    difference = shapely.area(shapely.symmetric_difference(result.geometry.values, expected.geometry.values))
+    assert np.all(difference <= 1e-6 * shapely.area(expected.geometry.values))
+
+
+def test_dissolve_partitions_by_group_count(layer, monkeypatch):
+    monkeypatch.setattr(main, "PARTITION_WORKERS", 4)
+    assert not main.should_partition(layer)
+    monkeypatch.setattr(main, "DISSOLVE_PARTITION_FEATURES", len(layer))
+    monkeypatch.setattr(main, "DISSOLVE_PARTITION_GROUPS", 20)
+    assert main.should_partition_dissolve(layer, 20)
+    assert not main.should_partition_dissolve(layer, 19)
+    monkeypatch.setattr(main, "DISSOLVE_PARTITION_FEATURES", len(layer) + 1)
+    assert not main.should_partition_dissolve(layer, 20)
+
+
+def test_partitioned_reproject_keeps_z(partitioned):
+    rng = np.random.default_rng(3)
+    coords = rng.uniform([-1000, -1000, 0], [1000, 1000, 500], size=(200, 3))
+    geometries = np.concatenate([shapely.points(coords[:100]), shapely.points(coords[100:, :2])])
+    gdf = gpd.GeoDataFrame({"id": range(200)}, geometry=geometries, crs="EPSG:3400")
+    main.register_layer("heights", gdf)
+    try:
+        result = main.reproject_layer("heights")
+    finally:
+        del main.LOADED_LAYERS["heights"]
+    expected = gdf.to_crs(epsg=4326)
+    assert result.geometry.has_z.tolist() == [True] * 100 + [False] * 100
+    assert np.allclose(shapely.get_coordinates(result.geometry, include_z=True),
+                       shapely.get_coordinates(expected.geometry, include_z=True), equal_nan=True)
@@ -0,0 +1,38 @@
+"""Planner answer cache"""
+import main
+
+
+def plan(params_list, layer_names):
+    return {
+        "message": "Buffering",
+        "actions": ["buffer_layer"] * len(params_list),
+        "params_dict": {"buffer_layer": params_list[-1]},
+        "params_list": params_list,
+        "layers": main.PlanCache.referenced_layers(params_list, layer_names),
+    }
+
+
+def test_key_ignores_unrelated_layers():
+    cache = main.PlanCache(max_entries=8, ttl=0, path=None)
+    key = cache.key("Buffer  Layer 1 by 500", "gpt-4o")
+    assert key == cache.key("buffer layer 1 by 500", "gpt-4o")
+    assert key != cache.key("buffer layer 1 by 500", "gpt-4o-mini")
+
+    cache.store(key, plan([{"layer_name": "Layer 1", "distance": "500"}], ["Layer 1"]))
+    # Each executed plan adds a result layer, which must not make the next query miss
+    assert cache.lookup(key, ["Layer 1", "Result 1", "Result 2"]) is not None
+    assert cache.stats()["hits"] == 1
+
+
+def test_plan_referencing_a_removed_layer_misses():
+    cache = main.PlanCache(max_entries=8, ttl=0, path=None)
+    key = cache.key("intersect layer 1 and layer 2", "gpt-4o")
+    params_list = [{"layer1_name": "Layer 1", "layer2_name": "Layer 2"}]
+    cache.store(key, plan(params_list, ["Layer 1", "Layer 2", "Layer 3"]))
+    assert cache.lookup(key, ["Layer 1", "Layer 3"]) is None
+    assert cache.lookup(key, ["Layer 1", "Layer 2"]) is not None
+
+
+def test_referenced_layers_only_counts_loaded_names():
+    params_list = [{"layer_name": "Layer 1", "distance": "500"}, {"layer_name": "Layer 9", "distance": 10}]
+    assert main.PlanCache.referenced_layers(params_list, ["Layer 1", "Layer 2"]) == ["Layer 1"]
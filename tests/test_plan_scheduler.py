@@ -0,0 +1,81 @@
+"""Scheduling of agent plan steps"""
+import asyncio
+import uuid
+
+import geopandas as gpd
+import pytest
+import shapely
+
+import main
+
+
+def tracker_for(steps):
+    tracker = main.OperationDependencyTracker()
+    for i, params in enumerate(steps):
+        tracker.add_operation(f"Result_{i + 1}", "buffer_layer", params, output_name=f"Layer {i + 2}")
+    return tracker
+
+
+def ids(operations):
+    return [op["id"] for op in operations]
+
+
+def test_independent_steps_are_ready_together():
+    tracker = tracker_for([{"layer_name": "Layer 1"}, {"layer_name": "Layer 1"}, {"layer_name": "Roads"}])
+    assert ids(tracker.pop_executable_operations()) == ["Result_1", "Result_2", "Result_3"]
+
+
+@pytest.mark.parametrize("reference", ["Result_1", "Layer 2"])
+def test_chained_step_waits_for_its_input(reference):
+    tracker = tracker_for([{"layer_name": "Layer 1"}, {"layer_name": reference}, {"layer_name": "Layer 1"}])
+    assert ids(tracker.pop_executable_operations()) == ["Result_1", "Result_3"]
+    tracker.mark_completed("Result_3", None)
+    assert tracker.pop_executable_operations() == []
+
+    tracker.mark_completed("Result_1", "buffered")
+    tracker.id_mapping["Result_1"] = "Layer 2"
+    assert ids(tracker.pop_executable_operations()) == ["Result_2"]
+    assert tracker.resolve_dependencies(tracker.operations_by_id["Result_2"]["params"]) == {"layer_name": "Layer 2"}
+
+
+def test_cycles_and_missing_inputs_are_blocked():
+    tracker = tracker_for([
+        {"layer_name": "Layer 3"},  # Output of the next step, which needs this one's
+        {"layer_name": "Result_1"},
+        {"layer_name": "Result_9"},  # No such step
+        {"layer_name": "Layer 1"},
+    ])
+    assert ids(tracker.pop_executable_operations()) == ["Result_4"]
+    tracker.mark_completed("Result_4", None)
+    assert tracker.pop_executable_operations() == []
+    ordered, blocked = tracker.topological_order()
+    assert ordered == ["Result_4"]
+    assert blocked == ["Result_1", "Result_2", "Result_3"]
+
+
+@pytest.fixture
+def session():
+    session_id = f"test-{uuid.uuid4().hex[:8]}"
+    token = main.CURRENT_SESSION.set(session_id)
+    yield session_id
+    main.CURRENT_SESSION.reset(token)
+    main.SESSIONS.drop(session_id)
+
+
+def test_chained_plan_runs_in_order(session):
+    main.SESSIONS.store_layer("Layer 1", gpd.GeoDataFrame(geometry=[shapely.Point(0, 0)], crs="EPSG:3400"))
+    plan = asyncio.run(main.run_gis_plan(
+        ["buffer_layer", "buffer_layer", "buffer_layer", "union"],
+        params_list=[
+            {"layer_name": "Layer 1", "distance": 10},
+            {"layer_name": "Layer 2", "distance": 5},  # The first step's output
+            {"layer_name": "Layer 1", "distance": 1},
+            {"layer1_name": "Result_2", "layer2_name": "Result_3"},
+        ],
+        include_geojson=False,
+    ))
+    results = plan["results"]
+    assert [entry["status"] for entry in results] == ["executed"] * 4
+    # Output names follow the plan order, whatever order the steps finished in
+    assert [entry["result"] for entry in results] == ["Layer 2", "Layer 3", "Layer 4", "Layer 5"]
+    assert main.LOADED_LAYERS["Layer 3"].geometry.area.iloc[0] == pytest.approx(3.14159 * 15 ** 2, rel=0.01)
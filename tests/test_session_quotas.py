@@ -0,0 +1,74 @@
+"""Per-session layer namespaces, quotas and expiry"""
+import uuid
+
+import geopandas as gpd
+import pytest
+import shapely
+
+import main
+
+
+@pytest.fixture
+def session():
+    session_id = f"test-{uuid.uuid4().hex[:8]}"
+    token = main.CURRENT_SESSION.set(session_id)
+    yield session_id
+    main.CURRENT_SESSION.reset(token)
+    main.SESSIONS.drop(session_id)
+
+
+def layer(count=10):
+    return gpd.GeoDataFrame({"id": range(count)}, geometry=shapely.points([(i, i) for i in range(count)]), crs="EPSG:4326")
+
+
+def test_layer_count_quota(session):
+    sessions = main.SessionManager(max_layers=2, memory_quota=0)
+    sessions.store_layer("A", layer())
+    sessions.store_layer("B", layer())
+    with pytest.raises(main.SessionQuotaExceeded):
+        sessions.store_layer("C", layer())
+    # Replacing a layer doesn't add one
+    sessions.store_layer("A", layer(3))
+    assert len(main.LOADED_LAYERS["A"]) == 3
+
+
+def test_memory_quota(session):
+    size = main.estimate_layer_bytes(layer(1000))
+    sessions = main.SessionManager(max_layers=0, memory_quota=size * 3 // 2)
+    sessions.store_layer("A", layer(1000))
+    with pytest.raises(main.SessionQuotaExceeded):
+        sessions.store_layer("B", layer(1000))
+    assert "B" not in main.LOADED_LAYERS
+
+
+def test_sessions_are_isolated(session):
+    main.SESSIONS.store_layer("Layer 1", layer())
+    token = main.CURRENT_SESSION.set(f"other-{session}")
+    try:
+        assert "Layer 1" not in main.LOADED_LAYERS
+    finally:
+        main.CURRENT_SESSION.reset(token)
+    assert main.SESSIONS.drop(session) == 1
+    assert "Layer 1" not in main.LOADED_LAYERS
+
+
+@pytest.mark.skipif(main.LAYER_STORE.backend is None, reason="needs the shared layer backend")
+def test_memory_quota_counts_layers_of_other_workers(session):
+    gdf = layer(1000)
+    size = main.estimate_layer_bytes(gdf)
+    sessions = main.SessionManager(max_layers=0, memory_quota=size * 3 // 2)
+    sessions.store_layer("A", gdf)
+
+    # Another worker stores a layer in the same session, through its own backend connection
+    other_worker = main.SharedDirectoryBackend(main.LAYER_SHARED_DIR)
+    try:
+        other_worker.write(main.SessionLayers.qualified("B", session), gdf, main.layer_catalog_entry(gdf))
+    finally:
+        other_worker.close()
+    assert sessions.usage(session) == {"A": size, "B": size}
+    with pytest.raises(main.SessionQuotaExceeded):
+        sessions.store_layer("C", layer(10))
+
+    # And space freed by other workers is available again
+    del main.LAYER_STORE[main.SessionLayers.qualified("B", session)]
+    sessions.store_layer("C", layer(10))
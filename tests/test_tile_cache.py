@@ -0,0 +1,45 @@
+"""Web Mercator copies kept by the vector tile cache"""
+import geopandas as gpd
+import numpy as np
+import shapely
+
+import main
+
+
+def layer(count=100, seed=0):
+    rng = np.random.default_rng(seed)
+    return gpd.GeoDataFrame(
+        {"value": rng.random(count)},
+        geometry=shapely.points(rng.random((count, 2))),
+        crs="EPSG:4326",
+    )
+
+
+def test_projection_of_a_replaced_layer_is_not_cached():
+    cache = main.LayerTileCache()
+    version = cache.version("roads")
+    old = layer(seed=1)
+    # The layer is replaced after the caller fetched it, before it was reprojected
+    cache.invalidate("roads")
+    projected = cache.get_projected("roads", old, version)
+    assert projected.crs.to_epsg() == 3857
+    assert "roads" not in cache.projected
+
+    new = layer(seed=2)
+    assert cache.get_projected("roads", new)["value"].tolist() == new["value"].tolist()
+    assert cache.get_projected("roads", old)["value"].tolist() == new["value"].tolist()
+
+
+def test_projected_copies_are_bounded():
+    size = main.estimate_layer_bytes(layer().to_crs(epsg=3857))
+    cache = main.LayerTileCache(max_projected_bytes=size * 2)
+    for name in ("a", "b", "c"):
+        cache.get_projected(name, layer())
+    assert list(cache.projected) == ["b", "c"]
+    assert cache.projected_bytes == size * 2
+
+    cache.invalidate("b")
+    assert list(cache.projected) == ["c"] and cache.projected_bytes == size
+    # Layers bigger than the whole bound are reprojected but never kept
+    cache.get_projected("big", layer(1000))
+    assert "big" not in cache.projected